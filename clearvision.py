@@ -8,9 +8,16 @@ class ClearVisionApp(wx.App):
     def OnInit(self):
         """Initialise the application"""
         import cvxMain
+        from cvxRecovery import recover
         self.SetAppName("ClearVision")
+        # Look for unsaved work before the new frame starts its own journal
+        recovered = recover()
         self.frame = cvxMain.MainFrame(None, size=(1024, 768))
         self.frame.Show()
+        if recovered is not None and wx.MessageBox("ClearVision did not close properly last time.\n"
+                                                   "Do you want to recover the unsaved changes?",
+                                                   "Recover changes", style=wx.YES_NO|wx.ICON_QUESTION) == wx.YES:
+            self.frame.Recover(*recovered)
         return True
 
 
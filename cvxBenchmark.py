@@ -0,0 +1,58 @@
+"""
+Compare reading and writing graphs as xml and as YAML.
+Usage: python cvxBenchmark.py [file.xml ...]
+With no files, example.xml and googlenet.xml are used.
+For each file the best of several runs is shown, with the size of each format,
+and the YAML is checked to read back as the same tree, saved as the same bytes.
+"""
+import os
+import sys
+import time
+import tempfile
+from lxml import etree
+from cvxXML import writeTree
+from cvxYAML import readYAML, writeYAML, loader, dumper
+
+repeats = 5
+
+def best(action, *args):
+    """
+    Return the shortest time taken by action(*args), in milliseconds
+    """
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        action(*args)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+def readXML(filename):
+    return etree.parse(filename).getroot()
+
+def benchmark(filename, directory):
+    root = readXML(filename)
+    xmlFile = os.path.join(directory, 'bench.xml')
+    yamlFile = os.path.join(directory, 'bench.yaml')
+    xmlSave = best(writeTree, root, xmlFile)
+    yamlSave = best(writeYAML, root, yamlFile)
+    xmlLoad = best(readXML, xmlFile)
+    yamlLoad = best(readYAML, yamlFile)
+    copyFile = os.path.join(directory, 'copy.xml')
+    writeTree(readYAML(yamlFile), copyFile)
+    with open(xmlFile, 'rb') as f, open(copyFile, 'rb') as g:
+        same = f.read() == g.read()
+    print("%-16s %5s %9.2f %9.2f %10d %s"%(os.path.basename(filename), 'xml', xmlLoad, xmlSave,
+                                          os.path.getsize(xmlFile), ''))
+    print("%-16s %5s %9.2f %9.2f %10d %s"%('', 'yaml', yamlLoad, yamlSave,
+                                          os.path.getsize(yamlFile), 'same' if same else 'DIFFERENT'))
+
+def main(filenames):
+    print("YAML loader %s, dumper %s; best of %d runs"%(loader().__name__, dumper().__name__, repeats))
+    print("%-16s %5s %9s %9s %10s"%('file', 'form', 'load ms', 'save ms', 'bytes'))
+    with tempfile.TemporaryDirectory() as directory:
+        for filename in filenames:
+            benchmark(filename, directory)
+
+if __name__ == '__main__':
+    here = os.path.dirname(os.path.abspath(__file__))
+    main(sys.argv[1:] or [os.path.join(here, 'example.xml'), os.path.join(here, 'googlenet.xml')])
@@ -0,0 +1,587 @@
+'''
+This module keeps the data of scalars and arrays of numbers, LUTs,
+distributions, matrices, convolutions and remaps in typed buffers (see the array module), which are
+what is edited, rather than in the text of the xml. Changing one value then costs the same however many values there
+are, where rewriting the text costs time in proportion to all of them.
+A buffer is made from the xml when it is first needed. From then on the xml
+is out of date until the changed buffers are written back into it, which is
+done only when the children of the element are changed some other way (see
+forget()). A copy of the document that is to be written out is brought up to
+date from copies of the buffers (see snapshot()), on the thread that writes it,
+as writing a large buffer as xml takes a while.
+Changes to buffers are made through cvxJournal, like changes to the tree, so
+they can be undone and are followed by the recovery journal. That includes
+changes to the attributes giving the layout of the data, such as the rows
+and columns of a matrix, which reshape the buffer (see cvxJournal.reshape()).
+The data of other types (structs, enums, booleans, characters) stays in the xml.
+'''
+import array
+import copy
+import struct
+from lxml import etree
+from cvxDataDefs import TypeDef
+
+# array typecodes of the OpenVX types kept in buffers
+typecodes = {
+    'VX_TYPE_INT8': 'b',
+    'VX_TYPE_UINT8': 'B',
+    'VX_TYPE_INT16': 'h',
+    'VX_TYPE_UINT16': 'H',
+    'VX_TYPE_INT32': 'i',
+    'VX_TYPE_UINT32': 'I',
+    'VX_TYPE_INT64': 'q',
+    'VX_TYPE_UINT64': 'Q',
+    'VX_TYPE_SIZE': 'Q',
+    'VX_TYPE_FLOAT32': 'f',
+    'VX_TYPE_FLOAT64': 'd',
+    }
+
+def intLimits(code):
+    bits = array.array(code).itemsize * 8
+    if code.islower():
+        return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    return 0, (1 << bits) - 1
+
+limits = dict((code, intLimits(code)) for code in set(typecodes.values()) if code not in 'fd')
+
+def convert(code, value):
+    """
+    Return value, a string or a number, as a number of the type given by the typecode.
+    Integers out of range are clamped.
+    """
+    if code in 'fd':
+        return float(value)
+    if isinstance(value, str):
+        try:
+            value = int(value, 0)
+        except ValueError:
+            value = float(value)
+    low, high = limits[code]
+    return min(max(int(value), low), high)
+
+float32 = struct.Struct('f')
+
+def converted(code, values):
+    """
+    Return the sequence of numbers values as an array with the given typecode
+    """
+    if isinstance(values, array.array) and values.typecode == code:
+        return array.array(code, values.tobytes())
+    return array.array(code, [convert(code, v) for v in values])
+
+def text(code, value):
+    """
+    Return the text of a value for the xml: the shortest that reads back the same
+    """
+    if code == 'f':
+        if value.is_integer() and abs(value) < 1e7:
+            return '%d'%value
+        for digits in range(6, 10):
+            s = '%.*g'%(digits, value)
+            if float32.unpack(float32.pack(float(s)))[0] == value:
+                return s
+    elif code == 'd':
+        return repr(value)
+    return str(value)
+
+class Buffer(object):
+    """
+    The values of the data of one data object. The subclasses below hold the
+    values of each kind of data object, and Buffer.kinds gives the subclass by tag.
+    Buffers are kept by element in Buffer.buffers, so that a buffer stays with its
+    element while the element is out of the tree, e.g. after being removed, in
+    case the removal is undone.
+    """
+    buffers = {}
+    kinds = {}
+    layout = ()         # the attributes of the element that the key depends on
+
+    def __init__(self, elem, key, code, values):
+        self.elem = elem
+        self.key = key          # what the layout of the values depends on; see keyOf()
+        self.code = code        # the typecode of the values
+        self.values = array.array(code, values)
+        self.dirty = False      # True if the xml is out of date
+
+    def __len__(self):
+        return len(self.values)
+
+    def splice(self, start, stop, values):
+        """
+        Replace the values start:stop with values, an array of the same type.
+        Use cvxJournal.splice() to change the buffer of an element in the document.
+        """
+        self.values[start:stop] = values
+        self.dirty = True
+
+    def resized(self, key):
+        """
+        Return the values in the layout given by key, converted, cut down or
+        padded as needed
+        """
+        raise NotImplementedError
+
+    def reshape(self, key, values):
+        """
+        Change the layout of the buffer to that given by key, with values laid out to suit.
+        Use cvxJournal.reshape() to change the buffer of an element in the document.
+        """
+        self.key = key
+        self.code = values.typecode
+        self.values = values
+        self.dirty = True
+
+    def write(self):
+        """
+        Bring the xml of the data object up to date with the buffer
+        """
+        raise NotImplementedError
+
+    def sameText(self, old, new):
+        """
+        Return True if the text old, from the xml, reads as the same values as the text new
+        """
+        if old is None or new is None:
+            return old == new
+        try:
+            return converted(self.code, old.split()) == converted(self.code, new.split())
+        except ValueError:
+            return False
+
+    def unchanged(self, child, tag, t, attrib):
+        """
+        Return True if the existing child already reads as the child to be written
+        """
+        return child.tag == tag and len(child) == 0 and self.sameText(child.text, t) and \
+            len(child.attrib) == len(attrib) and all(self.sameText(child.get(name), value) for name, value in attrib)
+
+    def writeChildren(self, tag, children):
+        """
+        Make the children of the element those given by children, a sequence of
+        (text, attributes) with the tag given.
+        Existing children are re-used, so the journal's record of them stays good,
+        and those that already have the same values are left as they were written.
+        """
+        elem = self.elem
+        tag = etree.QName(elem, tag).text
+        old = list(elem)
+        count = 0
+        for t, attrib in children:
+            if count < len(old):
+                child = old[count]
+                if self.unchanged(child, tag, t, attrib):
+                    count += 1
+                    continue
+                child.tag = tag
+                child.attrib.clear()
+                del child[:]
+            else:
+                child = etree.SubElement(elem, tag)
+            for name, value in attrib:
+                child.set(name, value)
+            child.text = t
+            count += 1
+        for child in old[count:]:
+            elem.remove(child)
+        self.dirty = False
+
+    @staticmethod
+    def kindOf(elem):
+        """
+        Return the subclass of Buffer that holds the data of elem, or None if the
+        data of elem is not kept in a buffer. Data kept in a file (see cvxPayload)
+        is never kept in a buffer.
+        """
+        kind = Buffer.kinds.get(etree.QName(elem).localname)
+        if kind is None or 'data_file' in elem.attrib or not kind.holds(elem):
+            return None
+        return kind
+
+    @staticmethod
+    def buffered(elem):
+        return Buffer.kindOf(elem) is not None
+
+    @staticmethod
+    def fromElement(elem):
+        """
+        Return a new buffer holding the data in the xml of elem, which must be buffered
+        """
+        return Buffer.kindOf(elem).fromElement(elem)
+
+    @staticmethod
+    def get(elem):
+        """
+        Return the buffer for elem, making it from the xml if necessary, or None if
+        the data of elem is not kept in a buffer.
+        If the layout of the data has changed, e.g. its type or size, the buffer is
+        forgotten and a new one made from the xml, so the values are converted while
+        the xml keeps the old ones until the new buffer is changed; undoing the change
+        gives back the old values unless they have been edited since.
+        """
+        buf = Buffer.buffers.get(elem)
+        if buf is not None and buf.key != buf.keyOf(elem):
+            Buffer.forget(elem)
+            buf = None
+        kind = Buffer.kindOf(elem)
+        if kind is None:
+            return None
+        if buf is None:
+            buf = Buffer.buffers[elem] = kind.fromElement(elem)
+        return buf
+
+    @staticmethod
+    def sync(elem):
+        """
+        Bring the xml of elem up to date with its buffer, if it has one
+        """
+        buf = Buffer.buffers.get(elem)
+        if buf is not None and buf.dirty:
+            buf.write()
+
+    @staticmethod
+    def forget(elem):
+        """
+        Bring the xml of elem up to date and forget its buffer; here before the
+        children of elem are changed other than through the buffer
+        """
+        Buffer.sync(elem)
+        Buffer.buffers.pop(elem, None)
+
+    @staticmethod
+    def snapshot(root, rootCopy):
+        """
+        Return copies of the buffers of elements in the tree root whose xml is out of
+        date, each given to the matching element of rootCopy, a deep copy of root.
+        Calling write() on them brings rootCopy up to date, which can be done on
+        another thread, as they share nothing with the document.
+        """
+        dirty = dict((elem, buf) for elem, buf in Buffer.buffers.items() if buf.dirty)
+        buffers = []
+        if dirty:
+            for elem, elemCopy in zip(root.iter(), rootCopy.iter()):
+                buf = dirty.get(elem)
+                if buf is not None:
+                    buffers.append(buf.copyFor(elemCopy))
+        return buffers
+
+    def copyFor(self, elem):
+        """
+        Return a copy of the buffer for elem, sharing nothing with this one
+        """
+        buf = copy.copy(self)
+        buf.elem = elem
+        buf.values = self.values[:]
+        return buf
+
+    @staticmethod
+    def clear():
+        """
+        Forget all the buffers; here when there is a new document
+        """
+        Buffer.buffers.clear()
+
+class ValueBuffer(Buffer):
+    """
+    The values of a scalar or array of numbers; the key is the element type
+    """
+    layout = ('elemType',)
+
+    @staticmethod
+    def holds(elem):
+        return elem.get('elemType') in typecodes
+
+    @staticmethod
+    def keyOf(elem):
+        return elem.get('elemType')
+
+    @staticmethod
+    def fromElement(elem):
+        """
+        Children of another type are converted, e.g. after the type of elem has been
+        changed, and values that cannot be read are zero.
+        """
+        enum = elem.get('elemType')
+        code = typecodes[enum]
+        values = []
+        for child in elem:
+            if len(child) == 0 and child.text:
+                for v in child.text.split():
+                    try:
+                        values.append(convert(code, v))
+                    except ValueError:
+                        values.append(0)
+        if len(values) == 0 and etree.QName(elem).localname == 'scalar':
+            values = [0]
+        return ValueBuffer(elem, enum, code, values)
+
+    def resized(self, key):
+        return converted(typecodes[key], self.values)
+
+    def write(self):
+        """
+        The values are written as in the files, separated by spaces in one child,
+        which keeps any space around the values it had
+        """
+        values = ' '.join(text(self.code, v) for v in self.values)
+        old = self.elem[0].text if len(self.elem) else None
+        if old and old.strip():
+            values = old[:len(old) - len(old.lstrip())] + values + old[len(old.rstrip()):]
+        self.writeChildren(TypeDef.tagFromEnum(self.key), [(values, ())] if len(self.values) else [])
+
+class IndexedBuffer(Buffer):
+    """
+    The entries of a LUT by index, or the frequencies of a distribution by bin.
+    The xml need not have every entry; missing ones are zero. Those it has and
+    those that are not zero are written back, in order, so that writing
+    changes only the entries that were changed. The key is (element type, count).
+    """
+    layout = ('elemType', 'count', 'bins')
+
+    def __init__(self, elem, key, code, values):
+        Buffer.__init__(self, elem, key, code, values)
+        self.present = bytearray(len(self.values))     # 1 for the entries in the xml
+
+    @staticmethod
+    def holds(elem):
+        return IndexedBuffer.keyOf(elem)[0] in typecodes
+
+    @staticmethod
+    def keyOf(elem):
+        if etree.QName(elem).localname == 'lut':
+            return elem.get('elemType', 'VX_TYPE_UINT8'), int(elem.get('count', '256'))
+        return 'VX_TYPE_UINT32', int(elem.get('bins', '16'))
+
+    def names(self):
+        """
+        Return the tag of the entries and the name of their index attribute
+        """
+        if etree.QName(self.elem).localname == 'lut':
+            return TypeDef.tagFromEnum(self.key[0]), 'index'
+        return 'frequency', 'bin'
+
+    @staticmethod
+    def fromElement(elem):
+        """
+        Entries of another type are converted, e.g. after the type of a LUT has changed
+        """
+        enum, count = IndexedBuffer.keyOf(elem)
+        code = typecodes[enum]
+        buf = IndexedBuffer(elem, (enum, count), code, bytes(array.array(code).itemsize * count))
+        attr = buf.names()[1]
+        for child in elem:
+            try:
+                i = int(child.get(attr))
+                if 0 <= i < count and child.text:
+                    buf.values[i] = convert(code, child.text.strip())
+                    buf.present[i] = 1
+            except (TypeError, ValueError):
+                pass
+        return buf
+
+    def copyFor(self, elem):
+        buf = Buffer.copyFor(self, elem)
+        buf.present = self.present[:]
+        return buf
+
+    def resized(self, key):
+        enum, count = key
+        values = converted(typecodes[enum], self.values[:count])
+        values.frombytes(bytes(values.itemsize * (count - len(values))))
+        return values
+
+    def reshape(self, key, values):
+        Buffer.reshape(self, key, values)
+        count = len(values)
+        self.present = self.present[:count] + bytearray(count - min(count, len(self.present)))
+
+    def write(self):
+        tag, attr = self.names()
+        code = self.code
+        present = self.present
+        self.writeChildren(tag, ((text(code, v), ((attr, str(i)),))
+                                 for i, v in enumerate(self.values) if present[i] or v))
+
+class RemapBuffer(Buffer):
+    """
+    The points of a remap: src_x, src_y pairs for each point in [dst_y][dst_x] order,
+    as in cvxPayload, so a point is found from its coordinates rather than by search.
+    Points not in the xml map to themselves. Those it has and those that no longer
+    map to themselves are written back, in order, so that a remap that lists only
+    some of its points still does after it is edited. The key is (dst_width, dst_height).
+    """
+    layout = ('dst_width', 'dst_height')
+
+    def __init__(self, elem, key, code, values):
+        Buffer.__init__(self, elem, key, code, values)
+        self.present = bytearray(len(values) // 2)     # 1 for the points in the xml
+
+    @staticmethod
+    def holds(elem):
+        return True
+
+    @staticmethod
+    def keyOf(elem):
+        return int(elem.get('dst_width', '16')), int(elem.get('dst_height', '16'))
+
+    def index(self, x, y):
+        """
+        Return the index in values of src_x for the point (x, y); src_y follows it
+        """
+        return 2 * (y * self.key[0] + x)
+
+    @staticmethod
+    def identity(width, height):
+        values = array.array('f', bytes(8 * width * height))
+        values[0::2] = array.array('f', list(range(width)) * height)
+        values[1::2] = array.array('f', [y for y in range(height) for x in range(width)])
+        return values
+
+    def resized(self, key):
+        """
+        Points keep their coordinates; new ones map to themselves
+        """
+        width, height = key
+        oldWidth, oldHeight = self.key
+        values = RemapBuffer.identity(width, height)
+        n = 2 * min(width, oldWidth)
+        for y in range(min(height, oldHeight)):
+            values[2 * y * width:2 * y * width + n] = self.values[2 * y * oldWidth:2 * y * oldWidth + n]
+        return values
+
+    @staticmethod
+    def fromElement(elem):
+        width, height = RemapBuffer.keyOf(elem)
+        buf = RemapBuffer(elem, (width, height), 'f', RemapBuffer.identity(width, height))
+        for child in elem:
+            if etree.QName(child).localname == 'point':
+                try:
+                    x, y = int(child.get('dst_x')), int(child.get('dst_y'))
+                    if 0 <= x < width and 0 <= y < height:
+                        i = buf.index(x, y)
+                        buf.values[i:i + 2] = array.array('f', (float(child.get('src_x')), float(child.get('src_y'))))
+                        buf.present[i // 2] = 1
+                except (TypeError, ValueError):
+                    pass
+        return buf
+
+    def copyFor(self, elem):
+        buf = Buffer.copyFor(self, elem)
+        buf.present = self.present[:]
+        return buf
+
+    def reshape(self, key, values):
+        """
+        Points in the xml keep their coordinates
+        """
+        width, height = key
+        oldWidth, oldHeight = self.key
+        present = bytearray(width * height)
+        n = min(width, oldWidth)
+        for y in range(min(height, oldHeight)):
+            present[y * width:y * width + n] = self.present[y * oldWidth:y * oldWidth + n]
+        Buffer.reshape(self, key, values)
+        self.present = present
+
+    def write(self):
+        width, height = self.key
+        values = self.values
+        present = self.present
+        def points():
+            i = 0
+            for y in range(height):
+                for x in range(width):
+                    if present[i // 2] or values[i] != x or values[i + 1] != y:
+                        yield None, (('src_x', text('f', values[i])), ('src_y', text('f', values[i + 1])),
+                                     ('dst_x', str(x)), ('dst_y', str(y)))
+                    i += 2
+        self.writeChildren('point', points())
+
+class MatrixBuffer(Buffer):
+    """
+    The coefficients of a matrix or convolution, in row major order.
+    The xml need not have every coefficient; missing ones are zero. Those it has
+    and those that are not zero are written back, in order, as for IndexedBuffer.
+    The key is (element type, rows, columns).
+    """
+    layout = ('elemType', 'rows', 'columns')
+
+    def __init__(self, elem, key, code, values):
+        Buffer.__init__(self, elem, key, code, values)
+        self.present = bytearray(len(self.values))     # 1 for the coefficients in the xml
+
+    @staticmethod
+    def holds(elem):
+        return MatrixBuffer.keyOf(elem)[0] in typecodes
+
+    @staticmethod
+    def keyOf(elem):
+        if etree.QName(elem).localname == 'convolution':
+            enum = 'VX_TYPE_INT16'
+        else:
+            enum = elem.get('elemType', 'VX_TYPE_FLOAT32')
+        return enum, int(elem.get('rows', '1')), int(elem.get('columns', '1'))
+
+    def index(self, row, column):
+        return row * self.key[2] + column
+
+    @staticmethod
+    def fromElement(elem):
+        """
+        Coefficients of another type are converted, and missing ones are zero
+        """
+        enum, rows, columns = MatrixBuffer.keyOf(elem)
+        code = typecodes[enum]
+        buf = MatrixBuffer(elem, (enum, rows, columns), code, bytes(array.array(code).itemsize * rows * columns))
+        for child in elem:
+            try:
+                r, c = int(child.get('row')), int(child.get('column'))
+                if 0 <= r < rows and 0 <= c < columns and child.text:
+                    buf.values[buf.index(r, c)] = convert(code, child.text.strip())
+                    buf.present[buf.index(r, c)] = 1
+            except (TypeError, ValueError):
+                pass
+        return buf
+
+    def copyFor(self, elem):
+        buf = Buffer.copyFor(self, elem)
+        buf.present = self.present[:]
+        return buf
+
+    def resized(self, key):
+        """
+        Coefficients keep their row and column; new ones are zero
+        """
+        enum, rows, columns = key
+        oldRows, oldColumns = self.key[1:]
+        values = converted(typecodes[enum], self.values)
+        resized = array.array(values.typecode, bytes(values.itemsize * rows * columns))
+        n = min(columns, oldColumns)
+        for r in range(min(rows, oldRows)):
+            resized[r * columns:r * columns + n] = values[r * oldColumns:r * oldColumns + n]
+        return resized
+
+    def reshape(self, key, values):
+        """
+        Coefficients in the xml keep their row and column
+        """
+        rows, columns = key[1:]
+        oldRows, oldColumns = self.key[1:]
+        present = bytearray(rows * columns)
+        n = min(columns, oldColumns)
+        for r in range(min(rows, oldRows)):
+            present[r * columns:r * columns + n] = self.present[r * oldColumns:r * oldColumns + n]
+        Buffer.reshape(self, key, values)
+        self.present = present
+
+    def write(self):
+        enum, rows, columns = self.key
+        tag = 'int16' if etree.QName(self.elem).localname == 'convolution' else TypeDef.tagFromEnum(enum)
+        values = self.values
+        present = self.present
+        code = self.code
+        self.writeChildren(tag, ((text(code, values[r * columns + c]), (('row', str(r)), ('column', str(c))))
+                                 for r in range(rows) for c in range(columns)
+                                 if present[r * columns + c] or values[r * columns + c]))
+
+Buffer.kinds.update(scalar=ValueBuffer, array=ValueBuffer, lut=IndexedBuffer, distribution=IndexedBuffer,
+                    matrix=MatrixBuffer, convolution=MatrixBuffer, remap=RemapBuffer)
@@ -110,6 +110,9 @@ class Const(object):
         self.ID_EditMenuRemoveGraph = wx.NewId()
         self.ID_EditMenuVirtual = wx.NewId()
         self.ID_EditMenuReplicate = wx.NewId()
+        self.ID_EditMenuStoreData = wx.NewId()
+        self.ID_EditMenuLoadData = wx.NewId()
+        self.ID_EditMenuCompact = wx.NewId()
         self.ID_EditMenuClear = wx.NewId()
         self.ID_EditMenuPreferences = wx.NewId()
 
@@ -172,6 +175,7 @@ class Const(object):
         self.ID_ViewMenu1200DPI = wx.NewId()
         self.ID_ViewMenuLowDPI = self.ID_ViewMenu96DPI
         self.ID_ViewMenuHighDPI = self.ID_ViewMenu1200DPI
+        self.ID_ViewMenuVector = wx.NewId()
 
     def HelpMenuIds(self):
         """Help Menu Constants"""
@@ -0,0 +1,65 @@
+'''
+This module brings the model and the user interface up to date when the
+application is idle, rather than whenever a window is painted.
+Anything that changes the tree, the graphs or the selection asks for an
+update with request(); however many requests there are, the update is done
+once, at the next idle time, and its stages are done in order, so that
+each sees the results of the ones before:
+    build       rebuild or update the graphs if the xml is dirty or changed
+    layout      start laying out the graph shown, if it is dirty
+    menus       enable the menu items to suit the selection
+    properties  show the properties of the selected object
+Painting then only has to draw the last bitmap.
+'''
+import wx
+from cvxXML import Xref
+
+class IdleScheduler(object):
+    """
+    Coalesces requests to update the notebook and its current page, and does
+    the update when the application is next idle
+    """
+    def __init__(self, notebook):
+        self.notebook = notebook
+        self.pending = False
+        self.running = False
+        # What the menus were last updated for
+        self.shown = None
+        notebook.Bind(wx.EVT_IDLE, self.OnIdle)
+
+    def request(self):
+        """
+        Ask for an update at the next idle time. Requests made by the update
+        itself are ignored, as the later stages see what the earlier ones did.
+        """
+        if not self.running and not self.pending:
+            self.pending = True
+            wx.WakeUpIdle()
+
+    def OnIdle(self, evt):
+        evt.Skip()
+        if not self.pending:
+            return
+        self.pending = False
+        self.running = True
+        try:
+            self.update()
+        finally:
+            self.running = False
+
+    def update(self):
+        nb = self.notebook
+        built = False
+        if nb.tree is not None and (Xref.isDirty() or Xref.isChanged()):
+            nb.BuildGraphs()
+            built = True
+        page = nb.GetCurrentPage()
+        if page is None:
+            return
+        if Xref.isDirty(page.graph):
+            page.Redraw()
+        page.fitVirtualSize()
+        if built or self.shown != (page, page.selectedObj):
+            self.shown = (page, page.selectedObj)
+            page.updateMenus()
+        page.updateProperties()
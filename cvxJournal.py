@@ -0,0 +1,360 @@
+'''
+This module holds the journal of edits to the xml tree, used for undo and redo.
+Rather than saving a copy of the whole tree before each edit, every change to
+an element that is already in the tree is made through the functions here,
+which record what is needed to reverse it. Undoing an edit costs time and
+memory in proportion to the size of the edit, not the size of the tree.
+Changes to elements that are not (yet) in the document are not recorded, so
+new elements should be complete before they are inserted.
+Every change to the document is also passed to Journal.observer, if there is
+one, which is how the recovery journal (see cvxRecovery) follows the edits.
+The values of many data objects are kept in buffers (see cvxBuffer)
+and changed with splice(); the children of such an element are brought up to
+date before they are changed in any other way.
+The index of the uses of data objects (see cvxUses) is also kept up to date here.
+'''
+import array
+import cvxPreferences as options
+from lxml import etree
+from cvxBuffer import Buffer, converted
+from cvxUses import Uses
+
+# Approximate memory cost of recording an operation, in bytes
+opSize = 64
+
+class Transaction(object):
+    """
+    The operations recorded for one edit, in the order they were done.
+    Each operation is a tuple of kind, element, and the data needed to reverse it:
+    ('attr', elem, name, old value or None)
+    ('text', elem, old text)
+    ('tag', elem, old tag)
+    ('insert', parent, child)
+    ('remove', parent, index, child)
+    ('splice', elem, start, count, old values) for the values of a buffer
+    ('reshape', elem, old attributes, old values) for the layout of a buffer
+    """
+    def __init__(self):
+        self.ops = []
+        self.size = 0
+
+    def add(self, op, size=opSize):
+        self.ops.append(op)
+        self.size += size
+
+class Journal(object):
+    """
+    Static class holding the undo and redo lists of transactions
+    """
+    undoList = []
+    redoList = []
+    current = None          # The transaction being recorded, or None
+    root = None             # The root of the document
+    observer = None         # Called by notify() with each change to the document
+
+    @staticmethod
+    def begin():
+        """
+        Start recording a new edit. The redo list is scrapped and the oldest
+        edits are forgotten to keep within options.maxUndoBytes.
+        """
+        Journal.current = Transaction()
+        Journal.undoList.append(Journal.current)
+        del Journal.redoList[:]
+        total = sum(t.size for t in Journal.undoList)
+        while len(Journal.undoList) > 1 and total > options.maxUndoBytes:
+            total -= Journal.undoList.pop(0).size
+
+    @staticmethod
+    def recording(elem):
+        """
+        Return True if a change to elem should be recorded: there must be a
+        transaction, and elem must be in the document rather than new
+        """
+        if Journal.current is None:
+            return False
+        p = elem.getparent()
+        while p is not None:
+            elem = p
+            p = elem.getparent()
+        return Journal.root is None or elem is Journal.root
+
+    @staticmethod
+    def record(op, size=opSize):
+        Journal.current.add(op, size)
+
+    @staticmethod
+    def notify(kind, elem, *args):
+        """
+        Tell the observer about a change that is about to be made to elem:
+        ('attr', elem, name, value or None)
+        ('text', elem, text)
+        ('tag', elem, tag)
+        ('insert', parent, index, child)
+        ('remove', parent, index)
+        ('splice', elem, start, stop, values)
+        ('reshape', elem, attributes, values)
+        ('renumber', root, count) when fixupReferences() renumbers the tree
+        """
+        if Journal.observer is not None:
+            Journal.observer(kind, elem, *args)
+
+    @staticmethod
+    def isEmpty():
+        """
+        Return True if nothing has been recorded for the current edit
+        """
+        return Journal.current is None or len(Journal.current.ops) == 0
+
+    @staticmethod
+    def scrap():
+        """
+        Forget the last edit (without undoing it)
+        """
+        if len(Journal.undoList):
+            t = Journal.undoList.pop()
+            if t is Journal.current:
+                Journal.current = None
+
+    @staticmethod
+    def clear():
+        """
+        Forget everything
+        """
+        del Journal.undoList[:]
+        del Journal.redoList[:]
+        Journal.current = None
+
+    @staticmethod
+    def reverse(t, touch):
+        """
+        Reverse the operations of the transaction t, recording them in a new
+        transaction, which is returned.
+        touch(elem) is called for each element changed, while it is in the tree,
+        so that the graphs can be updated.
+        """
+        Journal.current = Transaction()
+        for op in reversed(t.ops):
+            kind = op[0]
+            if kind == 'attr':
+                touch(op[1])
+                setAttr(op[1], op[2], op[3])
+            elif kind == 'text':
+                touch(op[1])
+                setText(op[1], op[2])
+            elif kind == 'tag':
+                touch(op[1])
+                setTag(op[1], op[2])
+            elif kind == 'insert':
+                touch(op[2])
+                remove(op[1], op[2])
+            elif kind == 'remove':
+                insert(op[1], op[2], op[3])
+                touch(op[3])
+            elif kind == 'splice':
+                touch(op[1])
+                splice(op[1], op[2], op[2] + op[3], op[4])
+            elif kind == 'reshape':
+                touch(op[1])
+                reshape(op[1], op[2], op[3])
+        reversed_t = Journal.current
+        Journal.current = None
+        return reversed_t
+
+    @staticmethod
+    def undo(touch):
+        """
+        Undo the last edit; return False if there was nothing to undo
+        """
+        if len(Journal.undoList) == 0:
+            return False
+        Journal.redoList.append(Journal.reverse(Journal.undoList.pop(), touch))
+        return True
+
+    @staticmethod
+    def redo(touch):
+        """
+        Redo the last undone edit; return False if there was nothing to redo
+        """
+        if len(Journal.redoList) == 0:
+            return False
+        Journal.undoList.append(Journal.reverse(Journal.redoList.pop(), touch))
+        return True
+
+    @staticmethod
+    def remapReferences(oldToNew, count, attrs):
+        """
+        Here after the references in the tree have been renumbered by the map oldToNew.
+        Change the references remembered in the journal to match, both as old attribute
+        values and in elements that have been removed from the tree. References that
+        are no longer in the tree are given new numbers from count upwards, and are added
+        to the map; returns the new count.
+        attrs are the names of attributes holding references.
+        """
+        def renumber(ref):
+            if ref not in oldToNew:
+                oldToNew[ref] = str(count + len(newRefs))
+                newRefs.add(ref)
+            return oldToNew[ref]
+        newRefs = set()
+        seen = set()
+        for t in Journal.undoList + Journal.redoList:
+            for i, op in enumerate(t.ops):
+                if op[0] == 'attr' and op[2] in attrs and op[3] is not None:
+                    t.ops[i] = op[:3] + (renumber(op[3]),)
+                elif op[0] == 'remove' and op[3].getparent() is None and op[3] not in seen:
+                    seen.add(op[3])
+                    for elem in op[3].iter():
+                        for attr in attrs:
+                            if attr in elem.attrib:
+                                elem.attrib[attr] = renumber(elem.attrib[attr])
+        return count + len(newRefs)
+
+# Functions that change the tree and record how to reverse the change
+
+def forgetParent(elem):
+    parent = elem.getparent()
+    if parent is not None:
+        Buffer.forget(parent)
+
+def setAttr(elem, name, value):
+    """
+    Set an attribute of elem; if value is None, the attribute is removed
+    """
+    old = elem.get(name)
+    if value is not None:
+        value = str(value)
+    if old == value:
+        return
+    if Journal.recording(elem):
+        Journal.record(('attr', elem, name, old), opSize + len(name) + len(old or ''))
+    Journal.notify('attr', elem, name, value)
+    watched = Uses.watched(elem, name)
+    if watched:
+        Uses.removing(elem)
+    if value is None:
+        del elem.attrib[name]
+    else:
+        elem.set(name, value)
+    if watched:
+        Uses.inserted(elem)
+
+def setText(elem, text):
+    old = elem.text
+    if old == text:
+        return
+    forgetParent(elem)
+    if Journal.recording(elem):
+        Journal.record(('text', elem, old), opSize + len(old or ''))
+    Journal.notify('text', elem, text)
+    elem.text = text
+
+def setTag(elem, tag):
+    old = elem.tag
+    if old == tag:
+        return
+    forgetParent(elem)
+    if Journal.recording(elem):
+        Journal.record(('tag', elem, old))
+    Journal.notify('tag', elem, tag)
+    elem.tag = tag
+
+def remove(parent, child):
+    """
+    Remove child from parent. The child is kept by the journal, so the
+    cost is that of the whole subtree.
+    """
+    Buffer.forget(parent)
+    index = parent.index(child)
+    if Journal.recording(parent):
+        Journal.record(('remove', parent, index, child), opSize * sum(1 for e in child.iter()))
+    Journal.notify('remove', parent, index)
+    Uses.removing(child)
+    parent.remove(child)
+
+def insert(parent, index, child):
+    """
+    Insert child in parent at the given index. If the child is already
+    in the tree, it is moved.
+    """
+    oldParent = child.getparent()
+    if oldParent is not None:
+        remove(oldParent, child)
+    Buffer.forget(parent)
+    index = min(index, len(parent))
+    if Journal.recording(parent):
+        Journal.record(('insert', parent, child))
+    Journal.notify('insert', parent, index, child)
+    parent.insert(index, child)
+    Uses.inserted(child)
+
+def append(parent, child):
+    insert(parent, len(parent), child)
+
+def clear(elem):
+    """
+    Remove the text, attributes and children of elem
+    """
+    for child in list(elem):
+        remove(elem, child)
+    for name in list(elem.attrib.keys()):
+        setAttr(elem, name, None)
+    setText(elem, None)
+
+def replaceContent(elem, source):
+    """
+    Give elem the attributes and children of the element source
+    """
+    clear(elem)
+    for name, value in source.items():
+        setAttr(elem, name, value)
+    setText(elem, source.text)
+    for child in list(source):
+        append(elem, child)
+
+def splice(elem, start, stop, values):
+    """
+    Replace the values start:stop in the buffer of elem (see cvxBuffer) with the
+    sequence values, which are converted to the
+    type of the buffer. The cost is that of the values replaced, not of the whole buffer.
+    """
+    buf = Buffer.get(elem)
+    if not isinstance(values, array.array) or values.typecode != buf.code:
+        values = converted(buf.code, values)
+    old = buf.values[start:stop]
+    if Journal.recording(elem):
+        Journal.record(('splice', elem, start, len(values), old), opSize + old.itemsize * len(old))
+    Journal.notify('splice', elem, start, stop, values.tolist())
+    buf.splice(start, stop, values)
+
+def setItem(elem, index, value):
+    splice(elem, index, index + 1, [value])
+
+def reshape(elem, attrs, values=None):
+    """
+    Change the attributes of elem that give the layout of its buffer, such as the
+    rows and columns of a matrix, given as a dictionary where None removes the
+    attribute, and lay out the values to suit, as one change (see cvxBuffer).
+    values are the new values, an array laid out to suit, by default the old ones
+    converted, cut down or padded.
+    """
+    buf = Buffer.get(elem)
+    probe = etree.Element(elem.tag, dict(elem.attrib))
+    for name, value in attrs.items():
+        if value is None:
+            probe.attrib.pop(name, None)
+        else:
+            probe.set(name, str(value))
+    key = buf.keyOf(probe)
+    if values is None:
+        values = buf.resized(key)
+    old = dict((name, elem.get(name)) for name in attrs)
+    if Journal.recording(elem):
+        Journal.record(('reshape', elem, old, buf.values), opSize + buf.values.itemsize * len(buf.values))
+    Journal.notify('reshape', elem, dict((name, probe.get(name)) for name in attrs), values.tolist())
+    for name in attrs:
+        if probe.get(name) is None:
+            elem.attrib.pop(name, None)
+        else:
+            elem.set(name, probe.get(name))
+    buf.reshape(key, values)
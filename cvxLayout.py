@@ -0,0 +1,234 @@
+'''
+This module lays out and renders graphs in the background.
+Layout is done by dot, which is an external process, so a pool of threads
+can lay out several graphs at once while the user interface carries on.
+Layouts are cached on disk, keyed by a hash of the dot source and the
+drawing options, so an unchanged graph is never laid out twice. The most
+recent layouts are also kept in memory, ready to draw, so that undo and
+redo can go straight back to a previous picture.
+'''
+import io
+import os
+import json
+import hashlib
+import struct
+import tempfile
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import wx
+import cvxPreferences as options
+from cvxXdot import Drawing
+
+# The last chunk of a PNG file: length, type and CRC
+pngEnd = b'\x00\x00\x00\x00IEND\xaeB`\x82'
+
+def layoutGraph(source, rankdir):
+    """
+    Lay out and render the graph given as a dot language string.
+    This runs on a worker thread, so it only uses its own copy of the graph.
+    dot is run once, through pipes, asking for both the PNG image and the
+    layout in json; the two arrive one after the other on stdout.
+    Returns a tuple of the PNG data and the json layout.
+    """
+    proc = subprocess.run([options.dotEngine, '-Grankdir=%s'%rankdir, '-Tpng', '-Tjson'],
+                          input=source.encode('utf-8'), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    end = proc.stdout.find(pngEnd)
+    if proc.returncode != 0 or end < 0:
+        raise RuntimeError(proc.stderr.decode('utf-8', 'replace').strip() or 'no output from %s'%options.dotEngine)
+    end += len(pngEnd)
+    return proc.stdout[:end], json.loads(proc.stdout[end:].decode('utf-8'))
+
+def nodeGeometry(layout):
+    """
+    Return a list of (name, width, height, pos) for each node of the layout
+    """
+    # subgraphs, if there are any, are also listed as objects but have a list of nodes
+    return [(n['name'], n['width'], n['height'], n['pos'])
+            for n in layout.get('objects', []) if 'pos' in n and 'nodes' not in n]
+
+def pngSize(png):
+    """
+    Return the width and height of a PNG image, from its IHDR chunk
+    """
+    return struct.unpack('>II', png[16:24])
+
+# Changed whenever the format of cache entries changes
+cacheVersion = 2
+
+def cacheDir():
+    """
+    Return the layout cache directory, creating it if necessary
+    """
+    path = options.layoutCacheDir
+    if path is None:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        path = os.path.join(base, 'clearvision', 'layouts')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def cacheKey(source, rankdir, dpi=96):
+    """
+    Return the cache key for a graph given as a dot language string
+    """
+    return hashlib.sha1(('%s\n%s\n%s\n%s'%(cacheVersion, rankdir, dpi, source)).encode('utf-8')).hexdigest()
+
+def writeAtomic(path, data):
+    """
+    Write the data to the file so that readers see either all of it or nothing
+    """
+    h, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(h, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+def readCache(key):
+    """
+    Return the cached (png, layout) for the key, or None.
+    A hit makes the entry the most recently used.
+    """
+    try:
+        path = os.path.join(cacheDir(), key)
+        with open(path + '.json', 'r') as f:
+            layout = json.load(f)
+        with open(path + '.png', 'rb') as f:
+            png = f.read()
+        os.utime(path + '.json')
+        os.utime(path + '.png')
+        return png, layout
+    except (OSError, ValueError):
+        return None
+
+def writeCache(key, png, layout):
+    """
+    Store a layout in the cache, then evict the least recently used entries
+    until the cache is no bigger than options.layoutCacheSize.
+    The json file is written last, as readCache() looks at it first.
+    """
+    try:
+        path = os.path.join(cacheDir(), key)
+        writeAtomic(path + '.png', png)
+        writeAtomic(path + '.json', json.dumps(layout).encode('utf-8'))
+        trimCache()
+    except OSError:
+        pass        # the cache is only an optimisation
+
+def trimCache():
+    """
+    Evict the least recently used entries from the cache
+    """
+    path = cacheDir()
+    entries = []
+    total = 0
+    for e in os.scandir(path):
+        try:
+            st = e.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, e.path))
+        total += st.st_size
+    entries.sort()
+    for mtime, size, name in entries:
+        if total <= options.layoutCacheSize:
+            break
+        try:
+            os.unlink(name)
+        except OSError:
+            pass
+        total -= size
+
+def cachedLayoutGraph(key, source, rankdir):
+    """
+    As layoutGraph(), but use the cache if possible
+    """
+    result = readCache(key)
+    if result is None:
+        result = layoutGraph(source, rankdir)
+        writeCache(key, *result)
+    return result
+
+def renderGraph(key, source, rankdir):
+    """
+    The layout job: returns the PNG data, the layout and the parsed Drawing
+    """
+    png, layout = cachedLayoutGraph(key, source, rankdir)
+    return png, layout, Drawing(layout, pngSize(png)[1])
+
+class LayoutScheduler(object):
+    """
+    Runs layouts for the pages of the notebook on a pool of threads.
+    Each graph has a generation count which is incremented whenever a new layout
+    is scheduled; results for any earlier generation are stale and are dropped,
+    and stale jobs that have not yet started are cancelled.
+    Results are delivered to the page on the GUI thread by calling page.SetLayout()
+    The last options.layoutMemoryCache results are kept, by cache key; a graph
+    that matches one of these is given it at once, without starting a job.
+    """
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=options.layoutThreads)
+        self.generation = {}        # generation count, by graph name
+        self.jobs = {}              # job in progress, by graph name
+        self.recent = OrderedDict() # (bitmap, nodes, drawing) by cache key, oldest first
+
+    def schedule(self, page, graph, rankdir):
+        """
+        Schedule a layout of the graph for the page, cancelling any earlier one.
+        The graph is copied here so that it can be edited while dot runs.
+        """
+        name = graph.name
+        gen = self.generation.get(name, 0) + 1
+        self.generation[name] = gen
+        job = self.jobs.pop(name, None)
+        if job is not None:
+            job.cancel()
+        source = graph.string()
+        key = cacheKey(source, rankdir)
+        result = self.recent.get(key)
+        if result is not None:
+            self.recent.move_to_end(key)
+            page.SetLayout(*result)
+            return
+        job = self.pool.submit(renderGraph, key, source, rankdir)
+        self.jobs[name] = job
+        job.add_done_callback(lambda j: wx.CallAfter(self.deliver, page, name, gen, key, j))
+
+    def deliver(self, page, name, gen, key, job):
+        """
+        Here on the GUI thread when a job has finished.
+        The result is remembered even if it is stale, as an undo may want it.
+        """
+        if self.jobs.get(name) is job:
+            del self.jobs[name]
+        if job.cancelled():
+            return
+        if job.exception() is not None:
+            if gen == self.generation.get(name):
+                wx.GetApp().frame.Error("Layout of graph failed: %s"%job.exception(), True)
+            return
+        png, layout, drawing = job.result()
+        result = (wx.Bitmap(wx.Image(io.BytesIO(png), wx.BITMAP_TYPE_PNG)), nodeGeometry(layout), drawing)
+        self.recent[key] = result
+        while len(self.recent) > options.layoutMemoryCache:
+            self.recent.popitem(last=False)
+        if gen == self.generation.get(name) and page:
+            page.SetLayout(*result)
+
+    def isBusy(self, graph):
+        """
+        Return True if a layout of the graph is in progress
+        """
+        return graph.name in self.jobs
+
+    def shutdown(self):
+        """
+        Cancel everything and stop the threads
+        """
+        for job in self.jobs.values():
+            job.cancel()
+        self.jobs.clear()
+        self.recent.clear()
+        self.pool.shutdown(wait=False)
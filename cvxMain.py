@@ -2,9 +2,10 @@
 MainFrame for Clearvision.
 Note that this module now requires wxPython Phoenix (i.e. version 4)
 """
+import os
 import wx.aui
 import wx.propgrid
-from lxml import etree
+from concurrent.futures import ThreadPoolExecutor
 from cvxConst import const
 # Menus
 from cvxMenus import MenuBar
@@ -12,8 +13,13 @@ from cvxMenus import MenuBar
 from cvxTabs import DrawPanel, Notebook
 # debug
 from cvxtestobject import Test
-from cvxXML import fixupReferences
+from cvxXML import copyForSaving, writeCopy, writeTree
+from cvxYAML import isYAML, writeYAML
+import cvxPayload as payload
+from cvxRecovery import Recovery
 # from wx.lib import imageutils, msgpanel
+
+fileTypes = "OpenVX XML (*.xml)|*.xml|OpenVX YAML (*.yaml;*.yml)|*.yaml;*.yml"
 # ----------------------------------------------------------------------
 
 
@@ -52,6 +58,8 @@ class MainFrame(wx.Frame):
 
         # Some class variables
         self.filename = ""        # Until we save or load, there is no filename
+        self.saver = ThreadPoolExecutor(max_workers=1)  # writes files in the background, in order
+        self.recovery = Recovery()  # keeps the changes that have not been saved
         
         # create menubar
         self.SetMenuBar(MenuBar())
@@ -169,6 +177,12 @@ class MainFrame(wx.Frame):
                   id=const.ID_EditMenuVirtual)
         self.Bind(wx.EVT_MENU, self.OnEditMenuReplicate,
                   id=const.ID_EditMenuReplicate)
+        self.Bind(wx.EVT_MENU, self.OnEditMenuStoreData,
+                  id=const.ID_EditMenuStoreData)
+        self.Bind(wx.EVT_MENU, self.OnEditMenuLoadData,
+                  id=const.ID_EditMenuLoadData)
+        self.Bind(wx.EVT_MENU, self.OnEditMenuCompact,
+                  id=const.ID_EditMenuCompact)
         self.Bind(wx.EVT_MENU, self.OnEditMenuPreferences,
                   id=const.ID_EditMenuPreferences)
 
@@ -195,6 +209,8 @@ class MainFrame(wx.Frame):
     def BindViewMenu(self):
         self.Bind(wx.EVT_MENU, self.OnViewMenuShowVirtuals,
                   id=const.ID_ViewMenuShowVirtuals)
+        self.Bind(wx.EVT_MENU, self.OnViewMenuVector,
+                  id=const.ID_ViewMenuVector)
         self.Bind(wx.EVT_MENU, self.OnViewMenuZoomIn,
                   id=const.ID_ViewMenuZoomIn)
         self.Bind(wx.EVT_MENU, self.OnViewMenuZoomOut,
@@ -274,43 +290,62 @@ class MainFrame(wx.Frame):
         self.GetMenuBar().FindItemById(const.ID_FileMenuSave).Enable(name!="")
         self.GetMenuBar().FindItemById(const.ID_FileMenuRevert).Enable(name!="")
         self.filename = name
+        self.recovery.setFilename(name)
+        payload.directory = os.path.dirname(os.path.abspath(name)) if name != "" else None
 
-    def SaveInFile(self, filename):
+    def SaveInFile(self, filename, wait=False):
         """
-        TODO 
-        trap errors
-
         String filename
         returns boolean
-        updates self.filename
-        Return True if all is well and the data is safe, otherwise False
+        updates self.filename once the file has been written
+        A copy of the tree is written on a worker thread, so the user can carry on.
+        The file is replaced only when the new one is complete.
+        If wait is True, wait for the file to be written.
+        Files named *.yaml or *.yml are written as YAML, others as xml.
+        Return True if all is well and the data is safe (or being saved), otherwise False
         """
         self.Ready()
         if self.nb.tree is not None:
             if filename == "":
                 fd = wx.FileDialog(self, message="Select OpenVX filename to save", defaultFile=self.filename, 
-                                    wildcard='*.xml', style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+                                    wildcard=fileTypes, style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
                 if fd.ShowModal() == wx.ID_OK:
                     filename = fd.GetPath()
             if filename != "":
-                try:
-                    f = open(filename, 'w')
-                    fixupReferences(self.nb.tree)
-                    f.write(etree.tostring(self.nb.tree))
-                    f.close()
-                    self.Filename(filename)
-                    return True
-                except:
-                    self.Error("Error writing to file '%s'"%self.filename)
+                self.Status("Saving '%s'"%filename)
+                write = writeYAML if isYAML(filename) else writeTree
+                tree, buffers = copyForSaving(self.nb.tree)
+                payload.relativePaths(tree, os.path.dirname(os.path.abspath(filename)))
+                job = self.saver.submit(writeCopy, write, tree, buffers, filename)
+                # Keep the recovery journal short. The save may yet fail, so this is not a saved base.
+                self.recovery.rebase(self.nb.tree, filename, saved=False)
+                if wait:
+                    return self.SaveDone(filename, job)
+                job.add_done_callback(lambda j: wx.CallAfter(self.SaveDone, filename, j))
+                return True
         return False
 
+    def SaveDone(self, filename, job):
+        """
+        Here on the GUI thread when a file has been written. Only then does the
+        document take the name of the file.
+        Return True if it was written successfully
+        """
+        if not self:
+            return False    # The frame has gone
+        if job.exception() is not None:
+            return self.Error("Error writing to file '%s': %s"%(filename, job.exception()), True)
+        self.Filename(filename)
+        self.Status("Saved '%s'"%filename)
+        return True
+
     def SaveChanges(self):
         """
         If there are any changes, offer to save them either in the existing file
         or a new one, by calling SaveInFile
         """
         if len(self.nb.undoList) != 0 and wx.MessageBox("Save changes?", "You have made changes", style=wx.YES_NO|wx.ICON_QUESTION) == wx.YES:
-            return self.SaveInFile(self.filename)
+            return self.SaveInFile(self.filename, wait=True)
         return True
 
     def LoadFile(self, filename):
@@ -325,6 +360,14 @@ class MainFrame(wx.Frame):
                 self.Error("Problem reading file '%s'"%filename, True)
                 self.Filename("")
         
+    def Recover(self, tree, filename):
+        """
+        Carry on with a tree recovered from the journal of an earlier run
+        """
+        self.nb.UseTree(tree, saved=False)
+        self.Filename(filename)
+        self.Status("Recovered unsaved changes")
+
     def undoRedoEnable(self):
         """
         enable or disable undo and redo menus according to lists
@@ -343,6 +386,9 @@ class MainFrame(wx.Frame):
         if len(self.nb.undoList) == 0 or wx.MessageBox("Changes not saved, quit anyway?",
                                                "There are unsaved changes",
                                                style=wx.YES_NO|wx.ICON_QUESTION) == wx.YES:
+            self.nb.layouts.shutdown()
+            self.saver.shutdown(wait=True)      # finish writing any files
+            self.recovery.discard()
             self._mgr.UnInit()
             self.Destroy()
 
@@ -404,7 +450,7 @@ class MainFrame(wx.Frame):
         """
         self.Ready()
         self.SaveChanges()
-        fd = wx.FileDialog(self, message="Select OpenVX file to open", defaultFile=self.filename, wildcard='*.xml', style=wx.FD_OPEN)
+        fd = wx.FileDialog(self, message="Select OpenVX file to open", defaultFile=self.filename, wildcard=fileTypes, style=wx.FD_OPEN)
         if fd.ShowModal() == wx.ID_OK:
             filename = fd.GetPath()
             if filename != "":
@@ -495,6 +541,26 @@ class MainFrame(wx.Frame):
         self.Ready()
         self.nb.Replicate()
 
+    def OnEditMenuStoreData(self, event):
+        """
+        Keep the data of the selected object in a file
+        """
+        self.Ready()
+        self.nb.StoreData()
+
+    def OnEditMenuLoadData(self, event):
+        """
+        Take the data of the selected object from a file
+        """
+        self.Ready()
+        self.nb.LoadData()
+
+    def OnEditMenuCompact(self, event):
+        """
+        Renumber the references of all the objects
+        """
+        self.Ready()
+        self.nb.CompactReferences()
 
     def OnEditMenuPreferences(self, event):
         """
@@ -555,7 +621,15 @@ class MainFrame(wx.Frame):
         Show virtuals or not
         """
         self.Ready()
-        self.nb.BuildGraphs()
+        self.nb.ShowVirtuals(self.GetMenuBar().IsChecked(const.ID_ViewMenuShowVirtuals))
+
+    def OnViewMenuVector(self, event):
+        """
+        Draw graphs as vectors or as bitmaps
+        """
+        self.Ready()
+        self.nb.vector = self.GetMenuBar().IsChecked(const.ID_ViewMenuVector)
+        self.nb.Refresh()
 
     def OnViewMenuProperties(self, event):
         """
@@ -567,6 +641,7 @@ class MainFrame(wx.Frame):
         else:
             self._mgr.GetPane("Properties").Hide()
         self._mgr.Update()
+        self.nb.idle.request()
     
     def OnViewMenuLog(self, event):
         """
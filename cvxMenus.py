@@ -65,6 +65,15 @@ class EditMenu(wx.Menu):
         self.Append(const.ID_EditMenuReplicate,
                     "&Node replication...\talt-R",
                     "Control the replication of nodes")
+        self.Append(const.ID_EditMenuStoreData,
+                    "&Store data in file...",
+                    "Keep the data of the selected object in a NumPy file rather than in the xml")
+        self.Append(const.ID_EditMenuLoadData,
+                    "&Load data from file...",
+                    "Use a NumPy file for the data of the selected object")
+        self.Append(const.ID_EditMenuCompact,
+                    "Re&number references",
+                    "Number the references of all the objects consecutively, as when saved")
         self.Append(const.ID_EditMenuPreferences,
                     "&Options...\tAlt-O",
                     "Set global options using the options dialog")
@@ -113,6 +122,9 @@ class ViewMenu(wx.Menu):
         self.AppendCheckItem(const.ID_ViewMenuShowVirtuals, "&Show connected data objects\tctrl-alt-c",
                     "Always show data objects connected between OpenVX nodes")
         self.Check(const.ID_ViewMenuShowVirtuals, False)
+        self.AppendCheckItem(const.ID_ViewMenuVector, "&Vector drawing\tctrl-alt-v",
+                    "Draw graphs from shapes rather than a bitmap, so they stay sharp when zoomed")
+        self.Check(const.ID_ViewMenuVector, False)
         self.AppendCheckItem(const.ID_ViewMenuProperties, "&Properties\talt-P",
                     "Show the properties pane to view and edit properties of the selected object")
         self.Check(const.ID_ViewMenuProperties, True)
@@ -0,0 +1,117 @@
+'''
+This module keeps a topological order of the nodes of each dot graph, so that
+checks for cycles, such as whether a merge would make a node depend on its own
+output, don't have to walk every path through the graph.
+The order of a graph is made once from its edges, in time proportional to the
+size of the graph, and is kept until the graph is changed (see Xref.setDirty()).
+A node can only reach nodes later in the order, so most questions are answered
+by comparing two positions; otherwise only the nodes between the two are searched,
+and the answer is remembered.
+Graphs that already have cycles have no topological order; the nodes on or
+between cycles are found, searches in such a graph look at every path, and
+those that meet a cycle report it.
+'''
+
+class GraphOrder(object):
+    """
+    The topological order of one graph.
+    Member variables:
+        graph       the pygraphviz AGraph
+        successors  node name: list of successor names
+        position    node name: index in the topological order, for nodes not on or after a cycle
+        cyclic      set of the names of nodes on or between cycles
+        known       (source, destination): whether source reaches destination
+    """
+    orders = {}             # graph name: GraphOrder
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.successors = dict((str(n), []) for n in graph.nodes_iter())
+        inDegree = dict.fromkeys(self.successors, 0)
+        for u, v in graph.edges_iter():
+            self.successors[str(u)].append(str(v))
+            inDegree[str(v)] += 1
+        # Kahn's algorithm; whatever is left over is on or after a cycle
+        self.position = {}
+        ready = [n for n, d in inDegree.items() if d == 0]
+        while ready:
+            n = ready.pop()
+            self.position[n] = len(self.position)
+            for s in self.successors[n]:
+                inDegree[s] -= 1
+                if inDegree[s] == 0:
+                    ready.append(s)
+        self.cyclic = set(n for n in self.successors if n not in self.position)
+        if self.cyclic:
+            # Drop the nodes after the cycles, which lead to none of them
+            outDegree = dict((n, sum(1 for s in self.successors[n] if s in self.cyclic)) for n in self.cyclic)
+            predecessors = dict((n, []) for n in self.cyclic)
+            for n in self.cyclic:
+                for s in self.successors[n]:
+                    if s in self.cyclic:
+                        predecessors[s].append(n)
+            done = [n for n, d in outDegree.items() if d == 0]
+            while done:
+                n = done.pop()
+                self.cyclic.discard(n)
+                for p in predecessors[n]:
+                    outDegree[p] -= 1
+                    if outDegree[p] == 0:
+                        done.append(p)
+        self.known = {}
+
+    @staticmethod
+    def get(graph):
+        """
+        Return the order of the graph, making it if the graph is new or has changed
+        """
+        order = GraphOrder.orders.get(graph.name)
+        if order is None or order.graph is not graph:
+            order = GraphOrder.orders[graph.name] = GraphOrder(graph)
+        return order
+
+    @staticmethod
+    def forget(name):
+        """
+        Here when the graph with the given name has changed
+        """
+        GraphOrder.orders.pop(name, None)
+
+    @staticmethod
+    def clear():
+        GraphOrder.orders.clear()
+
+    def reaches(self, source, destination):
+        """
+        Return a tuple (reached, cycle): whether there is a path from source to
+        destination, and whether a cycle was met on the way
+        """
+        source, destination = str(source), str(destination)
+        if source == destination:
+            return True, False
+        key = (source, destination)
+        if key in self.known:
+            return self.known[key], False
+        if self.cyclic:
+            limit = None
+        else:
+            limit = self.position[destination]
+            if self.position[source] > limit:
+                return False, False
+        # Search forward; in a graph without cycles, only through nodes before the destination
+        seen = {source}
+        stack = [source]
+        reached = False
+        while stack and not reached:
+            n = stack.pop()
+            for s in self.successors.get(n, ()):
+                if s == destination:
+                    reached = True
+                    break
+                if s not in seen and (limit is None or self.position[s] < limit):
+                    seen.add(s)
+                    stack.append(s)
+        cycle = not seen.isdisjoint(self.cyclic)
+        if not cycle:
+            self.known[key] = reached
+        return reached, cycle
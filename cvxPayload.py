@@ -0,0 +1,240 @@
+'''
+This module moves the data of OpenVX data objects between the xml tree and
+NumPy arrays, and reads and writes the arrays as .npy files.
+A data object whose data is kept in a file has the attribute data_file naming
+the file, and none of its data in the xml. The file is opened memory-mapped, so
+a large remap or tensor is not read until it is looked at, and then only the
+pages looked at are read.
+While a document is being edited data_file is an absolute path; in the saved
+document it is relative to the document's directory (see relativePaths()).
+NumPy is optional; without it data can only be kept in the xml.
+'''
+import os
+from lxml import etree
+try:
+    import numpy as np
+except ImportError:
+    np = None
+import cvxJournal as journal
+from cvxDataDefs import TypeDef
+
+sdata_file = 'data_file'
+
+# The directory of the document, where new data files are put; None if not yet saved
+directory = None
+
+# NumPy types of the OpenVX types that may be kept in files
+dtypes = {
+    'VX_TYPE_INT8': 'int8',
+    'VX_TYPE_UINT8': 'uint8',
+    'VX_TYPE_INT16': 'int16',
+    'VX_TYPE_UINT16': 'uint16',
+    'VX_TYPE_INT32': 'int32',
+    'VX_TYPE_UINT32': 'uint32',
+    'VX_TYPE_INT64': 'int64',
+    'VX_TYPE_UINT64': 'uint64',
+    'VX_TYPE_FLOAT32': 'float32',
+    'VX_TYPE_FLOAT64': 'float64',
+    }
+enums = dict((v, k) for k, v in dtypes.items())
+
+# NumPy types and numbers of channels of the image formats that may be kept in files
+imageFormats = {
+    'U008': ('uint8', 1),
+    'U016': ('uint16', 1),
+    'S016': ('int16', 1),
+    'U032': ('uint32', 1),
+    'S032': ('int32', 1),
+    'RGB2': ('uint8', 3),
+    'RGBA': ('uint8', 4),
+    }
+
+# Objects whose children are all data in the xml
+inlineTags = {'lut', 'distribution', 'matrix', 'convolution', 'remap', 'array'}
+# Objects whose data may be kept in files
+storableTags = inlineTags | {'image', 'tensor'}
+
+def available():
+    return np is not None
+
+def localname(elem):
+    return etree.QName(elem).localname
+
+def dtypeOf(enum):
+    if enum not in dtypes:
+        raise ValueError("data of type %s cannot be kept in a file"%enum)
+    return dtypes[enum]
+
+def dimensions(elem):
+    """
+    Return the dimension elements of a tensor, in order
+    """
+    dims = [child for child in elem if localname(child) == 'dimension']
+    return sorted(dims, key=lambda dim: int(dim.get('index', '0')))
+
+def layout(elem):
+    """
+    Return the NumPy type and shape of the data of the data object elem, as given
+    by its attributes. For an array the shape is the capacity.
+    """
+    tag = localname(elem)
+    if tag == 'lut':
+        return dtypeOf(elem.get('elemType', 'VX_TYPE_UINT8')), (int(elem.get('count', '256')),)
+    elif tag == 'distribution':
+        return 'uint32', (int(elem.get('bins', '16')),)
+    elif tag == 'matrix':
+        return dtypeOf(elem.get('elemType', 'VX_TYPE_FLOAT32')), (int(elem.get('rows')), int(elem.get('columns')))
+    elif tag == 'convolution':
+        return 'int16', (int(elem.get('rows')), int(elem.get('columns')))
+    elif tag == 'remap':
+        return 'float32', (int(elem.get('dst_height', '16')), int(elem.get('dst_width', '16')), 2)
+    elif tag == 'array':
+        return dtypeOf(elem.get('elemType')), (int(elem.get('capacity', '0')),)
+    elif tag == 'image':
+        if elem.get('format') not in imageFormats:
+            raise ValueError("images of format %s cannot be kept in a file"%elem.get('format'))
+        dtype, channels = imageFormats[elem.get('format')]
+        shape = (int(elem.get('height')), int(elem.get('width')))
+        return dtype, shape if channels == 1 else shape + (channels,)
+    elif tag == 'tensor':
+        return dtypeOf(elem.get('data_type')), tuple(int(dim.get('size')) for dim in dimensions(elem))
+    raise ValueError("the data of a %s cannot be kept in a file"%tag)
+
+def number(text, dtype):
+    return float(text) if np.dtype(dtype).kind == 'f' else int(text)
+
+def fromElement(elem):
+    """
+    Return the data of the data object elem, from the xml, as an array.
+    Missing data is zero, or for a remap, the identity.
+    """
+    tag = localname(elem)
+    dtype, shape = layout(elem)
+    if tag == 'array':
+        values = []
+        vtag = TypeDef.tagFromEnum(elem.get('elemType'))
+        for child in elem:
+            if localname(child) == vtag and child.text:
+                values.extend(number(v, dtype) for v in child.text.split())
+        return np.array(values, dtype=dtype)
+    data = np.zeros(shape, dtype=dtype)
+    if tag == 'remap':
+        data[:, :, 0] = np.arange(shape[1], dtype=dtype)[np.newaxis, :]
+        data[:, :, 1] = np.arange(shape[0], dtype=dtype)[:, np.newaxis]
+        for child in elem:
+            x, y = int(child.get('dst_x')), int(child.get('dst_y'))
+            if y < shape[0] and x < shape[1]:
+                data[y, x] = float(child.get('src_x')), float(child.get('src_y'))
+    elif tag in {'lut', 'distribution'}:
+        vtag, attr = (TypeDef.tagFromEnum(elem.get('elemType', 'VX_TYPE_UINT8')), 'index') \
+                     if tag == 'lut' else ('frequency', 'bin')
+        for child in elem:
+            if localname(child) == vtag and child.text:
+                i = int(child.get(attr))
+                if i < shape[0]:
+                    data[i] = number(child.text, dtype)
+    elif tag in {'matrix', 'convolution'}:
+        vtag = TypeDef.tagFromEnum(elem.get('elemType', 'VX_TYPE_FLOAT32')) if tag == 'matrix' else 'int16'
+        for child in elem:
+            if localname(child) == vtag and child.text:
+                r, c = int(child.get('row')), int(child.get('column'))
+                if r < shape[0] and c < shape[1]:
+                    data[r, c] = number(child.text, dtype)
+    return data
+
+def fit(elem, data):
+    """
+    Return the attributes that the data object elem must have to hold data, an
+    array read from a file. Raises ValueError if it cannot hold it.
+    The dimensions of a tensor are given by the shape of the data.
+    """
+    tag = localname(elem)
+    dtype = data.dtype.name
+    shape = data.shape
+    def require(ok, what):
+        if not ok:
+            raise ValueError("a %s needs %s, not %d dimensions of %s"%(tag, what, data.ndim, dtype))
+    if tag == 'lut':
+        require(data.ndim == 1 and dtype in ('uint8', 'int16'), "one dimension of uint8 or int16")
+        return dict(count=shape[0], elemType=enums[dtype])
+    elif tag == 'distribution':
+        require(data.ndim == 1 and dtype == 'uint32', "one dimension of uint32")
+        return dict(bins=shape[0])
+    elif tag == 'matrix':
+        require(data.ndim == 2 and dtype in ('uint8', 'int32', 'float32'), "two dimensions of uint8, int32 or float32")
+        return dict(rows=shape[0], columns=shape[1], elemType=enums[dtype])
+    elif tag == 'convolution':
+        require(data.ndim == 2 and dtype == 'int16', "two dimensions of int16")
+        return dict(rows=shape[0], columns=shape[1])
+    elif tag == 'remap':
+        require(data.ndim == 3 and shape[2] == 2 and dtype == 'float32', "[y][x][src_x, src_y] of float32")
+        return dict(dst_height=shape[0], dst_width=shape[1])
+    elif tag == 'array':
+        require(data.ndim == 1 and dtype in enums, "one dimension of numbers")
+        return dict(elemType=enums[dtype], capacity=max(shape[0], int(elem.get('capacity', '0'))))
+    elif tag == 'image':
+        channels = 1 if data.ndim == 2 else shape[2] if data.ndim == 3 else 0
+        formats = [f for f, t in imageFormats.items() if t == (dtype, channels)]
+        require(len(formats) == 1, "[y][x] or [y][x][channel] of a type matching an image format")
+        return dict(height=shape[0], width=shape[1], format=formats[0])
+    elif tag == 'tensor':
+        require(1 <= data.ndim <= 4 and dtype in enums, "one to four dimensions of numbers")
+        return dict(number_of_dims=data.ndim, data_type=enums[dtype])
+    raise ValueError("the data of a %s cannot be kept in a file"%tag)
+
+def clearData(elem):
+    """
+    Remove the data from the xml of the data object elem
+    """
+    if localname(elem) in inlineTags:
+        for child in list(elem):
+            journal.remove(elem, child)
+
+def summary(values):
+    """
+    Return the minimum, maximum and mean of a sequence of numbers, such as an array
+    or a typed buffer, or None if it is empty. With NumPy the sequence is not copied.
+    """
+    if len(values) == 0:
+        return None
+    if np is not None:
+        a = np.asarray(values)
+        return a.min(), a.max(), a.mean(dtype='float64')
+    return min(values), max(values), sum(values) / len(values)
+
+def newFilename(name):
+    """
+    Return a filename for the data of the object with the given name
+    """
+    return os.path.join(directory or os.getcwd(), name + '.npy')
+
+def save(f, data):
+    """
+    Write the array to the open file f
+    """
+    np.save(f, data, allow_pickle=False)
+
+def load(filename):
+    """
+    Open the data file, memory-mapped and read-only
+    """
+    return np.load(filename, mmap_mode='r', allow_pickle=False)
+
+def absolutePaths(root, base):
+    """
+    Make the data files named in the document absolute, taking relative names
+    from the directory base; here when a document is read
+    """
+    for elem in root.xpath('//*[@%s]'%sdata_file):
+        elem.set(sdata_file, os.path.normpath(os.path.join(base, elem.get(sdata_file))))
+
+def relativePaths(root, base):
+    """
+    Make the data files named in the document relative to the directory base
+    where possible; here on a copy of the document that is to be saved
+    """
+    for elem in root.xpath('//*[@%s]'%sdata_file):
+        try:
+            elem.set(sdata_file, os.path.relpath(elem.get(sdata_file), base))
+        except ValueError:
+            pass        # on another drive
@@ -11,9 +11,25 @@ defaultGraph = '<openvx xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
 
 # The layout and drawing engine
 dotEngine = 'dot'
-
-# Maximum number of tree copies in the undo list:
-maxUndo = 5
+# Number of graphs that may be laid out at the same time
+layoutThreads = 4
+# Where layouts are cached; None for the user cache directory
+layoutCacheDir = None
+# Maximum size of the layout cache in bytes
+layoutCacheSize = 256 * 1024 * 1024
+# Number of recent layouts kept in memory, ready to draw
+layoutMemoryCache = 32
+
+# Approximate maximum memory used by the undo list, in bytes:
+maxUndoBytes = 64 * 1024 * 1024
+# Where the recovery journal is kept; None for the user cache directory
+recoveryDir = None
+# How often changes are written to the recovery journal, in seconds
+recoveryInterval = 5
+# Whether to keep a binary copy of the model next to each xml file, for faster loading
+useSidecar = True
+# Number of items of a large data object shown at once on the properties page
+propertyPageSize = 16
 
 # Things for graphs:
 rankDir='TB'
@@ -0,0 +1,280 @@
+'''
+This module keeps a recovery journal, so that work is not lost if ClearVision
+stops without saving.
+The journal is a copy of the document as it was when it was loaded, created or
+saved (the base), and a log of every change made to it since, as given by
+cvxJournal. The changes are collected as they happen and written out in batches
+by a worker thread, so writing never holds up the user interface, and each batch
+costs only as much as the changes in it.
+Elements are identified in the log by their path from the root, as a list of
+child indices.
+'''
+import os
+import json
+import glob
+import time
+import array
+import threading
+from copy import deepcopy
+from lxml import etree
+import wx
+import cvxPreferences as options
+from cvxJournal import Journal
+from cvxBuffer import Buffer
+from cvxXML import referenceMap, renumberReferences, writeCopy, writeTree, sreferences
+
+logName = 'journal.log'
+
+def recoveryDir():
+    """
+    Return the recovery directory, creating it if necessary
+    """
+    path = options.recoveryDir
+    if path is None:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        path = os.path.join(base, 'clearvision', 'recovery')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def pathOf(elem):
+    """
+    Return the path of elem from the root of the document, or None if it is
+    not in the document
+    """
+    path = []
+    p = elem.getparent()
+    while p is not None:
+        path.append(p.index(elem))
+        elem = p
+        p = elem.getparent()
+    if elem is not Journal.root:
+        return None
+    path.reverse()
+    return path
+
+def find(root, path):
+    elem = root
+    for i in path:
+        elem = elem[i]
+    return elem
+
+def apply(root, record):
+    """
+    Apply a record from the log to the tree
+    """
+    kind = record[0]
+    elem = find(root, record[1])
+    if kind == 'attr':
+        if record[3] is None:
+            del elem.attrib[record[2]]
+        else:
+            elem.set(record[2], record[3])
+    elif kind == 'text':
+        elem.text = record[2]
+    elif kind == 'tag':
+        elem.tag = record[2]
+    elif kind == 'insert':
+        child = etree.fromstring(record[3])
+        child.tail = record[4]
+        elem.insert(record[2], child)
+    elif kind == 'remove':
+        del elem[record[2]]
+    elif kind == 'splice':
+        buf = Buffer.fromElement(elem)
+        buf.splice(record[2], record[3], array.array(buf.code, record[4]))
+        buf.write()
+    elif kind == 'reshape':
+        for name, value in record[2].items():
+            if value is None:
+                elem.attrib.pop(name, None)
+            else:
+                elem.set(name, value)
+        buf = Buffer.fromElement(elem)
+        buf.reshape(buf.key, array.array(buf.code, record[3]))
+        buf.write()
+    elif kind == 'renumber':
+        renumberReferences(root, referenceMap(root))
+        root.set(sreferences, record[2])
+
+def recover():
+    """
+    Read the recovery journal left by an earlier run.
+    Returns a tuple of the recovered tree and its filename, or None if there
+    is nothing to recover. A record cut short by a crash ends the log.
+    """
+    try:
+        path = recoveryDir()
+        with open(os.path.join(path, logName), 'r') as f:
+            lines = f.readlines()
+        header = json.loads(lines[0])
+        root = etree.parse(os.path.join(path, header[1])).getroot()
+        filename = header[2]
+        changes = 0 if header[3] else 1    # is there anything not in a file?
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record[0] == 'filename':
+                filename = record[1]
+            else:
+                apply(root, record)
+                changes += 1
+        if changes == 0:
+            return None
+        return root, filename
+    except (OSError, IndexError, ValueError, etree.XMLSyntaxError):
+        return None
+
+class Recovery(object):
+    """
+    Collects the changes to the document, as the observer of the Journal, and has
+    a worker thread write them to the log every options.recoveryInterval seconds.
+    Everything the worker is to do goes through the pending list, in order, so a
+    new base is never mixed up with changes made before or after it.
+    """
+    def __init__(self):
+        self.pending = []           # things for the worker to do
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = False
+        self.discarding = False
+        self.started = False        # set when the first base has been written
+        self.failing = False        # set when writing has failed, until it succeeds again
+        self.thread = threading.Thread(target=self.run, name='recovery', daemon=True)
+        self.thread.start()
+        Journal.observer = self.observe
+
+    def observe(self, kind, elem, *args):
+        """
+        Here from Journal.notify() before each change to the document
+        """
+        path = pathOf(elem)
+        if path is None:
+            return
+        if kind == 'insert':
+            index, child = args
+            for e in child.iter():
+                Buffer.sync(e)
+            args = (index, etree.tostring(child, encoding='unicode', with_tail=False), child.tail)
+        elif kind == 'renumber':
+            args = (str(args[0]),)
+        with self.lock:
+            self.pending.append((kind, path) + tuple(args))
+
+    def rebase(self, root, filename, saved=True):
+        """
+        Start a new log from a copy of the document.
+        saved is False if the document is not the same as the file.
+        """
+        copy = deepcopy(root)
+        buffers = Buffer.snapshot(root, copy)
+        with self.lock:
+            self.pending.append(('base', copy, buffers, filename, saved))
+        self.wake.set()
+
+    def setFilename(self, filename):
+        with self.lock:
+            self.pending.append(('filename', filename))
+
+    def discard(self):
+        """
+        Stop, and remove the journal; here when there is nothing that needs recovering
+        """
+        Journal.observer = None
+        self.discarding = True
+        self.stop()
+
+    def stop(self):
+        """
+        Write out anything pending and stop the worker
+        """
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+
+    def run(self):
+        """
+        The worker thread
+        """
+        while True:
+            self.wake.wait(options.recoveryInterval)
+            self.wake.clear()
+            stopping = self.stopping    # before the flush, so it takes everything done before stop()
+            try:
+                if self.discarding:
+                    self.remove()
+                else:
+                    self.flush()
+                self.failing = False
+            except OSError as e:
+                if not self.failing:
+                    self.failing = True
+                    wx.CallAfter(self.reportError, "Could not write the recovery journal: %s"%e)
+            if stopping:
+                return
+
+    def reportError(self, message):
+        """
+        Here on the GUI thread when the worker has failed to write
+        """
+        app = wx.GetApp()
+        if app is not None and getattr(app, 'frame', None):
+            app.frame.Error(message)
+
+    def flush(self):
+        """
+        Write the pending changes to the log, and make sure they are on disk
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+        path = recoveryDir()
+        f = None
+        try:
+            for item in pending:
+                if item[0] == 'base':
+                    if f is not None:
+                        f.close()
+                    f = self.writeBase(path, *item[1:])
+                    self.started = True
+                elif not self.started:
+                    continue                # the log is still the last run's
+                else:
+                    if f is None:
+                        f = open(os.path.join(path, logName), 'a')
+                    f.write(json.dumps(item) + '\n')
+            if f is not None:
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            if f is not None:
+                f.close()
+
+    def writeBase(self, path, root, buffers, filename, saved):
+        """
+        Write a new base, then a new log that refers to it, and remove the old base.
+        Returns the new log, open for appending.
+        """
+        name = 'base-%d.xml'%int(time.time() * 1000)
+        writeCopy(writeTree, root, buffers, os.path.join(path, name))
+        tmp = os.path.join(path, logName + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(('base', name, filename, saved)) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(path, logName))
+        for old in glob.glob(os.path.join(path, 'base-*.xml')):
+            if os.path.basename(old) != name:
+                os.unlink(old)
+        return open(os.path.join(path, logName), 'a')
+
+    def remove(self):
+        """
+        Remove the log and base
+        """
+        with self.lock:
+            self.pending = []
+        path = recoveryDir()
+        for name in glob.glob(os.path.join(path, 'base-*.xml')) + [os.path.join(path, logName)]:
+            if os.path.exists(name):
+                os.unlink(name)
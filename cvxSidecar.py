@@ -0,0 +1,88 @@
+'''
+This module keeps a binary copy of the parsed model next to each xml file
+that is opened, so that the file can be opened again without parsing and
+processing it. The sidecar holds the tree, Xref, the graphs and the element
+names (see cvxXML.modelState()), with a hash of the xml file it came from;
+if the file has changed, or anything else is wrong, the sidecar is ignored.
+Layouts are not kept here, as the layout cache already has them.
+Sidecars are signed with a key known only to this user, as unpickling a
+file from somewhere else could run arbitrary code.
+'''
+import os
+import hmac
+import pickle
+import hashlib
+import cvxPreferences as options
+from cvxLayout import writeAtomic
+from cvxXML import restoreModel
+
+# Changed whenever the format of sidecars changes
+sidecarVersion = 3
+magic = b'CVXSIDE\x00'
+suffix = '.cvxcache'
+
+def keyFile():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    path = os.path.join(base, 'clearvision')
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, 'sidecar.key')
+
+def signingKey():
+    """
+    Return the key used to sign sidecars, creating it if necessary
+    """
+    path = keyFile()
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        key = os.urandom(32)
+        h = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(h, 'wb') as f:
+            f.write(key)
+        return key
+
+def fileHash(filename):
+    """
+    Return a hash of the xml file and the things that affect how it is processed
+    """
+    h = hashlib.sha1(('%s\n'%sidecarVersion).encode('utf-8'))
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def readSidecar(filename, digest):
+    """
+    Return the model for the xml file from its sidecar as restoreModel() does,
+    or None if there is no good sidecar for this version of the file
+    """
+    if not options.useSidecar:
+        return None
+    try:
+        with open(filename + suffix, 'rb') as f:
+            data = f.read()
+        signature = data[len(magic):len(magic) + 32]
+        payload = data[len(magic) + 32:]
+        if not data.startswith(magic) or \
+           not hmac.compare_digest(signature, hmac.new(signingKey(), payload, hashlib.sha256).digest()):
+            return None
+        saved, state = pickle.loads(payload)
+        if saved != digest:
+            return None
+        return restoreModel(state)
+    except Exception:
+        return None     # the sidecar is only an optimisation; parse the file instead
+
+def writeSidecar(filename, digest, state):
+    """
+    Write the sidecar for the xml file. This may run on a worker thread.
+    """
+    if not options.useSidecar:
+        return
+    try:
+        payload = pickle.dumps((digest, state), pickle.HIGHEST_PROTOCOL)
+        signature = hmac.new(signingKey(), payload, hashlib.sha256).digest()
+        writeAtomic(filename + suffix, magic + signature + payload)
+    except (OSError, pickle.PicklingError):
+        pass
@@ -0,0 +1,64 @@
+'''
+This module holds a simple spatial index for the objects drawn on a page,
+so that things near a point or inside a rectangle can be found without
+looking at everything.
+'''
+
+class GridIndex(object):
+    """
+    A uniform grid of square cells. Each item is entered in every cell its
+    bounding rectangle touches. Rectangles are (x, y, width, height) tuples
+    or anything that can be unpacked like one, such as wx.Rect.
+    """
+    def __init__(self, cellSize=128):
+        self.cellSize = cellSize
+        self.cells = {}         # sets of keys, by (column, row)
+        self.rects = {}         # rectangles, by key
+
+    def clear(self):
+        self.cells.clear()
+        self.rects.clear()
+
+    def cellRange(self, rect):
+        """
+        Return the ranges of columns and rows covered by the rectangle
+        """
+        x, y, w, h = rect
+        size = self.cellSize
+        return (range(int(x // size), int((x + max(w, 1) - 1) // size) + 1),
+                range(int(y // size), int((y + max(h, 1) - 1) // size) + 1))
+
+    def insert(self, key, rect):
+        """
+        Add an item with the given key and bounding rectangle
+        """
+        self.rects[key] = tuple(rect)
+        cols, rows = self.cellRange(rect)
+        for c in cols:
+            for r in rows:
+                self.cells.setdefault((c, r), set()).add(key)
+
+    def query(self, rect):
+        """
+        Return the set of keys whose rectangles intersect the given one
+        """
+        x, y, w, h = rect
+        found = set()
+        cols, rows = self.cellRange(rect)
+        for c in cols:
+            for r in rows:
+                for key in self.cells.get((c, r), ()):
+                    if key not in found:
+                        kx, ky, kw, kh = self.rects[key]
+                        if kx < x + w and x < kx + kw and ky < y + h and y < ky + kh:
+                            found.add(key)
+        return found
+
+    def get(self, key):
+        """
+        Return the rectangle for the key, or None
+        """
+        return self.rects.get(key)
+
+    def keys(self):
+        return list(self.rects.keys())
@@ -2,14 +2,15 @@
 This module contains the class which implements the drawing area of each page
 in the notebook
 """
+import os
 import wx.aui
 import wx.propgrid
-import tempfile
-import os
 from lxml import etree
 from cvxConst import const
 import cvxXML as bG
 from cvxXML import Xref
+import cvxJournal as journal
+from cvxJournal import Journal
 import traceback
 import cvxKernelDefs as kdefs
 import cvxDataDefs as ddefs
@@ -17,6 +18,15 @@ from cvxDataDefs import TypeDef
 import cvxPreferences as options
 from cvxMenus import NodeMenu, XNodeMenu, DataMenu
 from cvxDialogs import GridCellHexEditor
+from cvxLayout import LayoutScheduler
+from cvxIdle import IdleScheduler
+from cvxSidecar import fileHash, readSidecar, writeSidecar
+from cvxYAML import isYAML, readYAML
+import cvxPayload as payload
+from cvxBuffer import Buffer, text
+from cvxUses import Uses
+from cvxOrder import GraphOrder
+from cvxSpatial import GridIndex
 
 # Map menu IDs to xml object tags
 idToTagMap = {
@@ -42,6 +52,15 @@ idToTagMap = {
     const.ID_InsertMenuDataView: bG.sview
 }
 
+dataFileTypes = "NumPy data (*.npy)|*.npy"
+
+def isPageProperty(attr):
+    """
+    Return True if attr is a property that chooses which part of a large data
+    object is shown, rather than changing the object
+    """
+    return attr.startswith('start ') or attr.endswith(' start') or attr in {'dst_x', 'dst_y'}
+
 def nearEnough(a, b):
     """
     test for "equality" of non-exact numbers
@@ -77,11 +96,14 @@ class Notebook(wx.aui.AuiNotebook):
         self.tree = None
         self.xrefs = None
         self.graphs = None
-        self.undoList = []
-        self.redoList = []
+        self.undoList = Journal.undoList
+        self.redoList = Journal.redoList
         self.zoom = 1.0
         self.rankdir = "TB"
         self.dpi = 96
+        self.vector = False
+        self.layouts = LayoutScheduler()
+        self.idle = IdleScheduler(self)
         self.Bind(wx.aui.EVT_AUINOTEBOOK_PAGE_CHANGED,  # @UndefinedVariable
                   self.OnPageChanged)
 
@@ -99,9 +121,17 @@ class Notebook(wx.aui.AuiNotebook):
             thisPage = self.GetCurrentPage()
             thisPage.attrObj = None # properties most likely will need to be updated.
             thisPage.SetFocus()
+            self.idle.request()
 
     # added functions
 
+    def Refresh(self, eraseBackground=True, rect=None):
+        """
+        Repaint, and bring the graphs and panels up to date when next idle
+        """
+        wx.aui.AuiNotebook.Refresh(self, eraseBackground, rect)
+        self.idle.request()
+
     def GetGlobalsPage(self):
         for i in range(self.GetPageCount()):
             if self.GetPageText(i) == bG.globalsName:
@@ -118,8 +148,24 @@ class Notebook(wx.aui.AuiNotebook):
     def DefaultGraph(self):
         # Read the default graph
         self.Save()
-        self.tree = etree.XML(options.defaultGraph)
+        if self.tree is None:
+            self.UseTree(etree.XML(options.defaultGraph))
+        else:
+            # Keep the root, so that this can be undone
+            journal.replaceContent(self.tree, etree.XML(options.defaultGraph))
+            Xref.setDirty()
+            self.BuildGraphs()
+
+    def UseTree(self, tree, saved=True):
+        """
+        Start again with the given tree, and make it the base of the recovery journal.
+        saved is False if the tree is not the same as the file.
+        """
+        self.Scrap()
+        self.tree = tree
+        Xref.setDirty()
         self.BuildGraphs()
+        self.topframe.recovery.rebase(self.tree, self.topframe.filename, saved)
     
     def BuildGraphs(self):
         """
@@ -127,10 +173,21 @@ class Notebook(wx.aui.AuiNotebook):
         Add pages as necessary, otherwise re-use them.
         Remove pages not now in the list
         Note: each entrey in self.graphs is a tuple of elem, graph
+        If only some objects have changed since the last build, and the
+        changes were recorded, just the affected graphs are updated.
         """
+        if self.graphs is not None and bG.updateGraphs(self.graphs):
+            self.Refresh()
+            return
         # Build all the graphs
         bG.showVirtuals = self.topframe.GetMenuBar().IsChecked(const.ID_ViewMenuShowVirtuals)
-        self.graphs = bG.buildGraphs(self.tree)
+        self.UpdatePages(bG.buildGraphs(self.tree))
+
+    def UpdatePages(self, graphs):
+        """
+        Use the given graphs, updating, adding and removing pages to match
+        """
+        self.graphs = graphs
         i = 0
         pageNames = set()
         while i < self.GetPageCount():
@@ -148,67 +205,87 @@ class Notebook(wx.aui.AuiNotebook):
                 self.AddPage(DrawPanel(self, self.topframe, self.graphs[name]), name)
         self.Refresh()
 
+    def ShowVirtuals(self, show):
+        """
+        Show connected virtual data objects or not. Only the views of the graphs
+        change, and those already made for this setting are used again.
+        """
+        bG.showVirtuals = show
+        for i in range(self.GetPageCount()):
+            self.GetPage(i).Redraw()
+        self.Refresh()
+
     def Redraw(self, rankdir=None):
         """
-        Mark all graphs for redraw and update the rank direction
+        Mark all graphs for redraw and update the rank direction.
+        All the layouts are started now, rather than as each page is shown.
         """
         if rankdir is not None:
             self.rankdir = rankdir
         for elem, graph in list(self.graphs.values()):
             Xref.setDirty(graph)
+        for i in range(self.GetPageCount()):
+            self.GetPage(i).Redraw()
         self.Refresh()
 
     def ReadGraphs(self, filename):
         """
-        Clear out any pages, and create new ones as per the given file.
+        Clear out any pages, and create new ones as per the given file, which may be xml or YAML.
+        If the file has an up-to-date sidecar, the model is read from that instead,
+        otherwise a sidecar is written in the background for next time.
         """
         self.Scrap()
-        self.tree = etree.parse(filename).getroot()
-        self.BuildGraphs()
+        bG.showVirtuals = self.topframe.GetMenuBar().IsChecked(const.ID_ViewMenuShowVirtuals)
+        digest = fileHash(filename)
+        model = readSidecar(filename, digest)
+        if model is None:
+            if isYAML(filename):
+                tree = readYAML(filename)
+                model = tree, bG.buildGraphs(tree)
+            else:
+                model = bG.parseGraphs(filename)
+            if options.useSidecar:
+                self.topframe.saver.submit(writeSidecar, filename, digest, bG.modelState(*model))
+        self.tree, graphs = model
+        payload.absolutePaths(self.tree, os.path.dirname(os.path.abspath(filename)))
+        self.UpdatePages(graphs)
+        self.topframe.recovery.rebase(self.tree, filename)
 
     def Save(self):
         """
-        Save the current state in the undo list
-        The list doesn't grow larger than a defined size
+        Start recording an operation in the undo list.
+        The changes made to the tree are recorded in the journal, rather than the
+        whole tree being copied. The list doesn't grow larger than a defined size.
         """
         self.topframe.Ready()
         if self.tree is not None:
-            if len(self.undoList) >= options.maxUndo:
-                self.undoList.pop(0)
-            self.undoList.append(etree.tostring(self.tree))
-        self.redoList = []
+            Journal.begin()
         self.topframe.undoRedoEnable()
 
     def Undo(self):
         """
-        Undo the last saved operation
+        Undo the last saved operation, re-processing only the graphs it changed.
+        Their previous layouts are usually still in memory, so they are redrawn at once.
         """
-        if len(self.undoList) > 0:
-            self.redoList.append(etree.tostring(self.tree))
-            self.tree = etree.fromstring(self.undoList.pop())
-            Xref.setDirty()
-            self.Refresh()
+        if Journal.undo(bG.touchElement):
+            self.BuildGraphs()
         else:
             self.topframe.Error("No operations to undo")
         self.topframe.undoRedoEnable()
 
     def ScrapIfSame(self):
         """
-        If what we have saved for the undo operation is the
-        same as what we have currently, scrap the last save
+        If nothing has changed since the last save, scrap it
         """
-        if len(self.undoList) > 0 and undoList[-1] == etree.tostring(self.tree):
+        if len(self.undoList) > 0 and Journal.isEmpty():
             self.ScrapUndo()
 
     def Redo(self):
         """
         Redo the last undone operation
         """
-        if len(self.redoList) > 0 :
-            self.undoList.append(etree.tostring(self.tree))
-            self.tree = etree.fromstring(self.redoList.pop())
-            Xref.setDirty()
-            self.Refresh()
+        if Journal.redo(bG.touchElement):
+            self.BuildGraphs()
         else:
             self.topframe.Error("No operations to redo")
         self.topframe.undoRedoEnable()
@@ -217,15 +294,14 @@ class Notebook(wx.aui.AuiNotebook):
         """
         Scrap both the undo and redo lists
         """
-        self.undoList = []
-        self.redoList = []
+        Journal.clear()
         self.topframe.undoRedoEnable()
 
     def ScrapUndo(self):
         """
         Scrap the last save operation
         """
-        self.undoList.pop()
+        Journal.scrap()
         self.topframe.undoRedoEnable()
         
     def NewGraph(self):
@@ -255,7 +331,7 @@ class Notebook(wx.aui.AuiNotebook):
             self.topframe.Error("Can't find the graph named '%s'"%pname, True)
         else:
             self.Save()
-            self.tree.remove(self.graphs[pname][0])
+            journal.remove(self.tree, self.graphs[pname][0])
             # Now fix up everything simply by requiring a rebuild:
             Xref.setDirty()
             self.Refresh()
@@ -354,38 +430,29 @@ class Notebook(wx.aui.AuiNotebook):
                         self.topframe.Error("Can't move child objects unless parent is on the same tab")
                 elif xobj.isVirtual():
                     self.Save()
-                    elem.getparent().remove(elem)
-                    root.append(elem)
+                    bG.touchElement(elem)
+                    journal.append(root, elem)
+                    bG.touchElement(elem)
                     self.BuildGraphs()
                 elif xobj.isImmutable():
                     self.topframe.Error("Immutable data must be global")
                 else:
-                    # Now go looking for graph parameters that reference this object, over
-                    # the entire xml tree. First, build a set of references for the object
-                    # and all it's dataObject children:
+                    # Now go looking for graph parameters that reference this object, using
+                    # the index of uses (see cvxUses). First, build a set of references for the
+                    # object and all it's dataObject children:
                     refs = {ref}
                     for child in elem.iterdescendants():
                         if etree.QName(child).localname in bG.dataObjectTags:
                             refs.add(child.attrib[bG.sreference])
-                    # Now we iterate over all graphs looking for a graph parameter that references
-                    # an object we have in the set, and also create a set of all graphs that reference
+                    # Now look at the node parameters that use an object we have in the set, for
+                    # one that is a graph parameter, and create a set of all graphs that reference
                     # the object:
                     graphs = set()
-                    graphtag = etree.QName(root, bG.sgraph).text
-                    paramtag = etree.QName(root, bG.sparameter).text
-                    nodetag = etree.QName(root, bG.snode).text
-                    for g in root.iterchildren(graphtag):           # check all the graphs
-                        for gp in g.iterchildren(paramtag):         # check all graph parameters
-                            nelem = Xref.get(gp.get(bG.snode)).elem # the node referenced by this graph parameter
-                            nindex = gp.attrib[bG.sparameter]       # index of the node parameter
-                            for np in nelem.iterchildren(paramtag): # check node parameters
-                                # See if the node parameter references this element
-                                if np.attrib[bG.sindex] == nindex and np.attrib[bG.sreference] in refs:
-                                    return self.topframe.Error("Graph parameters must be global")
-                        for n in g.iterchildren(nodetag):           # Check all nodes of the graph
-                            for np in n.iterchildren(paramtag):
-                                if np.attrib[bG.sreference] in refs:
-                                    graphs.add(g)
+                    for r in refs:
+                        for np in Uses.nodeParameters(r):
+                            if Uses.graphParameters(np):
+                                return self.topframe.Error("Graph parameters must be global")
+                            graphs.add(np.getparent().getparent())
                     if len(graphs) == 0:
                         self.topframe.Error("Can't do this as the object is not referenced in any graph")
                     elif len(graphs) > 1:
@@ -394,8 +461,9 @@ class Notebook(wx.aui.AuiNotebook):
                         # here when it's not a graph parameter and referenced in one graph only:
                         # we simply remove from root and append to the selected graph
                         self.Save()
-                        root.remove(elem)
-                        graphs.pop().append(elem)
+                        bG.touchElement(elem)
+                        journal.append(graphs.pop(), elem)
+                        bG.touchElement(elem)
                         self.BuildGraphs()
             else:
                 self.topframe.Error("Must select a data object")
@@ -453,8 +521,9 @@ class Notebook(wx.aui.AuiNotebook):
                     # We have a shortcut and clean out all parameters as well as the node
                     self.Save()
                     for p in params.values():
-                        p.param.attrib[bG.sreplicate_flag] = bG.sfalse
-                    nelem.attrib[bG.sis_replicated] = bG.sfalse
+                        journal.setAttr(p.param, bG.sreplicate_flag, bG.sfalse)
+                    journal.setAttr(nelem, bG.sis_replicated, bG.sfalse)
+                    bG.touchElement(nelem)
                 else:                    
                     # Create a set of parameter indices
                     selections = set()
@@ -483,20 +552,84 @@ class Notebook(wx.aui.AuiNotebook):
                     # (checks on graph may still fail) so we can save and proceed:
                     self.Save()
                     for p in params.values():    # Clear out old replicate flags
-                        p.param.attrib[bG.sreplicate_flag] = bG.sfalse
+                        journal.setAttr(p.param, bG.sreplicate_flag, bG.sfalse)
                     for i in selections:
                         if params[i].ptag not in {bG.sobject_array, bG.spyramid}:
                             # We must create an object array or pyramid for the parameters.
                             if insertAsPyramid and params[i].kp.ptype == kdefs.s_vx_image:
-                                bG.makePyramid(params[i].elem, pg.graph, replicates)
+                                bG.makePyramid(params[i].elem, pg.model, replicates)
                             else:
-                                bG.makeObjectArray(params[i].elem, pg.graph, replicates)
-                        params[i].param.attrib[bG.sreplicate_flag] = bG.strue
-                    nelem.attrib[bG.sis_replicated] = bG.strue
+                                bG.makeObjectArray(params[i].elem, pg.model, replicates)
+                        journal.setAttr(params[i].param, bG.sreplicate_flag, bG.strue)
+                    journal.setAttr(nelem, bG.sis_replicated, bG.strue)
+                    bG.touchElement(nelem)
                 self.BuildGraphs()
             else:
                 self.topframe.Error("Must select a node")
 
+    def SelectedData(self):
+        """
+        Return the Xref entry of the selected data object, or report an error and return False
+        """
+        obj = self.GetCurrentPage().selectedObj
+        if obj is None:
+            return self.topframe.Error("No object selected")
+        xobj = Xref.get(str(obj))
+        if xobj.tag not in payload.storableTags:
+            return self.topframe.Error("Must select an object with data that can be kept in a file")
+        if xobj.isVirtual():
+            return self.topframe.Error("Virtual objects have no data")
+        return xobj
+
+    def StoreData(self):
+        """
+        Keep the data of the selected object in a NumPy file chosen by the user
+        """
+        xobj = self.SelectedData()
+        if xobj:
+            filename = xobj.getFilename() or payload.newFilename(xobj.name)
+            fd = wx.FileDialog(self, message="Select file for the data of %s"%xobj.name,
+                               defaultDir=os.path.dirname(filename), defaultFile=os.path.basename(filename),
+                               wildcard=dataFileTypes, style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+            if fd.ShowModal() == wx.ID_OK:
+                self.ChangeData(xobj, fd.GetPath(), xobj.storeData)
+
+    def LoadData(self):
+        """
+        Use a NumPy file chosen by the user for the data of the selected object
+        """
+        xobj = self.SelectedData()
+        if xobj:
+            fd = wx.FileDialog(self, message="Select file with the data for %s"%xobj.name,
+                               defaultFile=xobj.getFilename() or "", wildcard=dataFileTypes, style=wx.FD_OPEN)
+            if fd.ShowModal() == wx.ID_OK:
+                self.ChangeData(xobj, fd.GetPath(), xobj.loadData)
+
+    def CompactReferences(self):
+        """
+        Renumber the references of all the objects consecutively. This is not an
+        edit to be undone; the references in the undo journal are changed to match.
+        Selections are cleared, as they are kept by reference.
+        """
+        if self.tree is not None:
+            bG.compactReferences(self.tree)
+            for i in range(self.GetPageCount()):
+                self.GetPage(i).InitPos()
+            self.BuildGraphs()
+
+    def ChangeData(self, xobj, filename, action):
+        """
+        Store or load the data of a data object as an operation that may be undone
+        """
+        self.Save()
+        xobj.setFilename(filename)
+        bG.touchElement(xobj.elem)
+        if action():
+            self.GetCurrentPage().attrObj = None
+            self.BuildGraphs()
+        else:
+            self.ScrapUndo()
+
     def RenameObject(self, newName):
         """
         Rename the selected object, or the graph
@@ -552,12 +685,17 @@ class Notebook(wx.aui.AuiNotebook):
             xobj = Xref.get(ref)
             elem = xobj.elem
             tag = etree.QName(elem).localname
+            if xobj.isStored() and attr != bG.sname and not isPageProperty(attr):
+                self.ScrapUndo()
+                p.attrObj = None
+                return self.topframe.Error("The data of %s is kept in '%s' and cannot be changed here"%(
+                                           xobj.name, xobj.getFilename()), True)
             if tag == bG.snode:
                 if attr == bG.sborderconst:
                     for child in elem.iterchildren(etree.QName(elem, attr).text):
-                        child.text = "#%8X"%value
+                        journal.setText(child, "#%8X"%value)
                 elif attr == bG.sbordermode:
-                    elem.set(attr, stringValue)
+                    journal.setAttr(elem, attr, stringValue)
                 else:
                     # Here we have to update any immutable parameters
                     for param in elem.iterchildren(etree.QName(elem, bG.sparameter).text):
@@ -576,15 +714,15 @@ class Notebook(wx.aui.AuiNotebook):
                                 bG.updateScalarValues(Xref.get(pref), '.'.join(parts), value, stringValue)
 
             elif attr == bG.sscale and tag == bG.spyramid:
-                elem.set(attr, ["0.5", "0.8408964"][value])
+                journal.setAttr(elem, attr, ["0.5", "0.8408964"][value])
             elif attr == bG.sformat:
-                elem.set(attr, TypeDef.formatToString(value))
+                journal.setAttr(elem, attr, TypeDef.formatToString(value))
             elif attr.startswith(bG.sdimension):
                 # tensor dimension size
                 idx = attr.split(' ')[1]
                 for dim in elem.iterchildren(etree.QName(elem, bG.sdimension).text):
                     if idx == dim.get(bG.sindex):
-                        dim.set(bG.ssize, stringValue)
+                        journal.setAttr(dim, bG.ssize, stringValue)
             elif attr == 'identifier':
                 # user struct identifier change. Have to find the old one in the table
                 # and replace it, if this is allowed
@@ -597,26 +735,36 @@ class Notebook(wx.aui.AuiNotebook):
                 else:
                     ptype.defs[stringValue] = ptype.defs.get(elem.text)
                     del ptype.defs[elem.text]
-                    elem.text = stringValue
+                    journal.setText(elem, stringValue)
             elif tag == bG.sscalar:
                 if attr.endswith(' subtype'):
                     # just set sub-type for properties change
                     xobj.subtype = stringValue
                 else:
                     if attr == bG.selemType:
-                        elem.set(attr, stringValue)
+                        bG.setDataAttribute(elem, attr, stringValue)
                     else:
                         bG.updateScalarValues(xobj, attr, value, stringValue)
             elif tag == bG.sarray:
                 if attr.endswith(' subtype'):
                     xobj.subtype = stringValue
+                elif attr.endswith(' start'):
+                    xobj.start = value
                 elif attr.endswith(' size'):
-                    xobj.datasize = value
+                    bG.resizeArray(xobj, value)
                 else:
                     if attr in {bG.scapacity, bG.selemType}:
-                        elem.set(attr, stringValue)
+                        bG.setDataAttribute(elem, attr, stringValue)
                     else:
                         bG.updateArrayValues(xobj, attr, value, stringValue)
+            elif tag in {bG.smatrix, bG.sconvolution} and attr.startswith('start '):
+                cols = int(elem.get(bG.scolumns, '1'))
+                row, col = divmod(xobj.start, cols)
+                if attr == 'start row':
+                    row = value
+                else:
+                    col = value
+                xobj.start = row * cols + col
             elif tag in {bG.smatrix, bG.sconvolution} and attr.startswith('data['):
                 bG.updateRowColumn(elem, attr[4:],
                                    TypeDef.tagFromEnum(elem.get(bG.selemType)) if tag == bG.smatrix else bG.sint16,
@@ -631,39 +779,25 @@ class Notebook(wx.aui.AuiNotebook):
                 xobj.datasize[attr] = stringValue
             elif attr.startswith('src_') and tag == bG.sremap:
                 splits = attr.split('[')
-                name = splits[0]
-                dst_y = splits[1][:-1]
-                dst_x = splits[2][:-1]
-                for child in list(elem):
-                    if child.get('dst_x') == dst_x and child.get('dst_y') == dst_y:
-                        break
-                else:
-                    # We have not been able to write the data; the subelement is missing, so we must create one
-                    child = etree.Element(etree.QName(elem, 'point'))
-                    child.set('dst_x', dst_x)
-                    child.set('dst_y', dst_y)
-                    child.set('src_x', dst_x)
-                    child.set('src_y', dst_y)
-                    elem.append(child)
-                child.set(name, stringValue)
+                bG.updateRemapPoint(elem, int(splits[2][:-1]), int(splits[1][:-1]), splits[0], value)
             else:
-                elem.set(attr, stringValue)
+                bG.setDataAttribute(elem, attr, stringValue)
             # check for change in compound object count or other attribute that
             # may need propagation
             if tag == bG.spyramid:
-                bG.changePyramidAttributes(elem, p.graph)
+                bG.changePyramidAttributes(elem, p.model)
             elif attr == bG.scount:
-                bG.changeDelayOrArrayCount(elem, p.graph)
+                bG.changeDelayOrArrayCount(elem, p.model)
             elif attr == bG.snumber_of_dims:
-                bG.changeTensorSize(elem, p.graph)
+                bG.changeTensorSize(elem, p.model)
             # get parent and tag from xml
             pelem = elem.getparent()
             ptag = etree.QName(pelem).localname
             # check for child change to be propagated to parent
             if ptag == bG.spyramid:
-                bG.changePyramidChildAttributes(elem, p.graph)
+                bG.changePyramidChildAttributes(elem, p.model)
             elif ptag in {bG.sobject_array, bG.sdelay}:
-                bG.changeDelayOrArrayChildAttributes(elem, p.graph)
+                bG.changeDelayOrArrayChildAttributes(elem, p.model)
     
             p.attrObj = None # properties most likely will need to be updated.
             self.Refresh()
@@ -683,34 +817,34 @@ class Notebook(wx.aui.AuiNotebook):
                                         "Select type for delay", bG.delayChoices)
             if choice != "":
                 self.Save()
-                bG.insertDelay(p.element, p.graph, choice)
+                bG.insertDelay(p.element, p.model, choice)
         elif id == const.ID_InsertMenuDataObjectArray:
             choice = wx.GetSingleChoice("Please select from available object types",
                                         "Select type for object array", bG.objectArrayChoices)
             if choice != "":
                 self.Save()
-                bG.insertObjectArray(p.element, p.graph, choice)
+                bG.insertObjectArray(p.element, p.model, choice)
         elif id == const.ID_InsertMenuDataDelayOfSelected:
             self.Save()
-            bG.makeDelay(Xref.get(obj).elem, p.graph, 3)
+            bG.makeDelay(Xref.get(obj).elem, p.model, 3)
         elif id == const.ID_InsertMenuDataObjectArrayOfSelected:
             self.Save()
-            bG.makeObjectArray(Xref.get(obj).elem, p.graph, 3)
+            bG.makeObjectArray(Xref.get(obj).elem, p.model, 3)
         elif id == const.ID_InsertMenuDataPyramidOfSelected:
             self.Save()
-            bG.makePyramid(Xref.get(obj).elem, p.graph, 4)
+            bG.makePyramid(Xref.get(obj).elem, p.model, 4)
         elif id == const.ID_InsertMenuDataObjectArrayFromTensor:
             pass
         elif id in {const.ID_InsertMenuDataROI, const.ID_InsertMenuDataChannel}:
             self.Save()
-            bG.insertObject(Xref.get(obj).elem, p.graph, idToTagMap[id])
+            bG.insertObject(Xref.get(obj).elem, p.model, idToTagMap[id])
         elif id == const.ID_InsertMenuDataView:
             pass
         else:
             tag = idToTagMap[id]
         if tag is not None:
             self.Save()
-            bG.insertObject(p.element, p.graph, tag)
+            bG.insertObject(p.element, p.model, tag)
         self.Refresh()
 
 class DrawPanel(wx.ScrolledWindow):
@@ -744,6 +878,10 @@ class DrawPanel(wx.ScrolledWindow):
         self.Bind(wx.EVT_MOUSE_EVENTS, self.OnMouse)
         self.Bind(wx.EVT_PAINT, self.OnPaintTab)
         self.InitPos()
+        # The last bitmap drawn, its vector drawing, and an index of the bounding boxes of its nodes
+        self.bitmap = wx.Bitmap(1, 1)
+        self.drawing = None
+        self.index = GridIndex()
         self.Update(elemGraph)
         # Set up a dictionary for key event handling for this window
         self.key_table = {(wx.ACCEL_NORMAL,
@@ -791,30 +929,32 @@ class DrawPanel(wx.ScrolledWindow):
 
         Just draw the bitmap...
         and the selection
+        The graphs, menus and properties are brought up to date when the
+        application is idle (see cvxIdle), and the last bitmap is drawn until
+        a new layout is finished.
+        In vector mode only the visible shapes are drawn, at the current zoom.
 
         wx.Event evt
         
         """
-        if Xref.isDirty():
-            # We need to rebuild the graphs
-            self.parent.BuildGraphs()
-        if Xref.isDirty(self.graph):
-            # We need to redraw
-            self.Redraw()
-        self.updateMenus()
-        self.updateProperties()
         x, y = self.bitmap.GetSize()
         scale = self.parent.zoom
-        self.SetVirtualSize(x * scale, y * scale)
         dc = wx.PaintDC(self)
-        self.PrepareDC(dc)
-        dc.Clear()
-        dc.SetUserScale(scale, scale)
-        vr = self.getVisibleRect()
-        br = wx.Rect(0, 0, x, y)
-        br = br.Intersect(vr)
-        if br.width > 0 and br.height > 0:
-            dc.DrawBitmap(self.bitmap.GetSubBitmap(br), br.left, br.top)
+        if self.parent.vector and self.drawing is not None:
+            vr = self.getVisibleRect()
+            dc.Clear()
+            self.PaintVector(dc, vr)
+            self.PrepareDC(dc)
+            dc.SetUserScale(scale, scale)
+        else:
+            self.PrepareDC(dc)
+            dc.Clear()
+            dc.SetUserScale(scale, scale)
+            vr = self.getVisibleRect()
+            br = wx.Rect(0, 0, x, y)
+            br = br.Intersect(vr)
+            if br.width > 0 and br.height > 0:
+                dc.DrawBitmap(self.bitmap.GetSubBitmap(br), br.left, br.top)
         if self.selectedRect is not None:
             dc.SetBrush(wx.Brush('WHITE', style=wx.TRANSPARENT))
             dc.SetPen(wx.Pen('GREEN', style=wx.DOT))
@@ -826,6 +966,39 @@ class DrawPanel(wx.ScrolledWindow):
             dc.SetBrush(wx.Brush('WHITE', style=wx.TRANSPARENT))
             dc.SetPen(wx.Pen('RED', style=wx.DOT))
             dc.DrawRectangle(self.upRect)
+        if self.hoverObj is not None and self.hoverObj not in (self.selectedObj, self.upObj):
+            dc.SetBrush(wx.Brush('WHITE', style=wx.TRANSPARENT))
+            dc.SetPen(wx.Pen('LIGHT GREY', style=wx.DOT))
+            dc.DrawRectangle(self.hoverRect)
+
+    def Refresh(self, eraseBackground=True, rect=None):
+        """
+        Repaint, and bring the graphs and panels up to date when next idle
+        """
+        wx.ScrolledWindow.Refresh(self, eraseBackground, rect)
+        self.parent.idle.request()
+
+    def fitVirtualSize(self):
+        """
+        Make the scrolled area fit the bitmap at the current zoom
+        """
+        x, y = self.bitmap.GetSize()
+        scale = self.parent.zoom
+        size = wx.Size(int(x * scale), int(y * scale))
+        if self.GetVirtualSize() != size:
+            self.SetVirtualSize(size)
+
+    def PaintVector(self, dc, vr):
+        """
+        Draw the shapes of the graph that are within the visible rectangle vr
+        """
+        gc = wx.GraphicsContext.Create(dc)
+        ox, oy = self.CalcUnscrolledPosition(0, 0)
+        gc.Translate(-ox, -oy)
+        scale = self.parent.zoom
+        gc.Scale(scale, scale)
+        self.drawing.draw(gc, vr)
+        del gc      # flush the drawing to the dc
 
     def OnMouse(self, event):
         """
@@ -884,6 +1057,12 @@ class DrawPanel(wx.ScrolledWindow):
             self.Refresh()
         elif event.RightDClick():       # Always precede by a RightUp()
             pass
+        elif event.Moving():
+            # Highlight the object under the mouse
+            hoverObj, hoverRect = self.ObjAtPos(mpos)
+            if hoverObj != self.hoverObj:
+                self.hoverObj, self.hoverRect = hoverObj, hoverRect
+                self.Refresh()
         else:
             delta = - round(event.GetWheelRotation() / 60.0)
             if delta:
@@ -934,6 +1113,19 @@ class DrawPanel(wx.ScrolledWindow):
                 values.append(d)
         return values
 
+    def storedData(self, xobj):
+        """
+        Return the data of xobj if it is kept in a file, otherwise None.
+        Only the parts of the data that are used are read from the file.
+        """
+        if xobj is None or not xobj.isStored():
+            return None
+        try:
+            return xobj.getPayload()
+        except (ValueError, OSError) as e:
+            self.topframe.Error("Cannot read the data of %s: %s"%(xobj.name, e))
+            return None
+
     def insertArrayDataProperty(self, props, pname, pxtype, pref, isArray=True, needData=True):
         """
         Insert a scalar data property or multiple array data properties
@@ -943,8 +1135,15 @@ class DrawPanel(wx.ScrolledWindow):
         """
         ptype = TypeDef.typeFromEnum(pxtype, pxtype)
         elem = Xref.get(pref).elem
-        values = self.getData(TypeDef.tagFromEnum(elem.get(bG.selemType)), elem)
         xobj = Xref.get(pref)
+        data = self.storedData(xobj)
+        buf = Buffer.get(elem)
+        if buf is not None:
+            data = buf.values
+        if data is None:
+            values = self.getData(TypeDef.tagFromEnum(elem.get(bG.selemType)), elem)
+        elif isArray:
+            xobj.datasize = len(data)
         if ptype == 'vx_enum':
             # Need to select a sub-type for this object
             t = xobj.subtype  # get last recorded sub-type for this object
@@ -959,16 +1158,37 @@ class DrawPanel(wx.ScrolledWindow):
             cap = int(xobj.elem.get(bG.scapacity, "1"))
             cursize = xobj.datasize     # min(len(values), xobj.datasize)
             self.insertUintProperty(props, pname + ' size', cursize, max=cap)
+            if data is not None:
+                self.insertSummaryProperties(props, data)
+            # Only a page of the items is shown, from the start item
+            start = xobj.start = min(xobj.start, max(cursize - 1, 0))
+            stop = min(cursize, start + options.propertyPageSize)
+            self.insertUintProperty(props, pname + ' start', start, max=max(cursize - 1, 0))
         else:
-            cursize = 1
-        if needData and len(values) < cursize:
-            values += [TypeDef.defaultData(ptype)] * (cursize - len(values))
-        for i in range(cursize):
+            start, stop = 0, 1
+        if data is None:
+            values = values[start:stop]
+        else:
+            # Only the items shown are turned into text
+            values = [str(v) if buf is None else text(buf.code, v) for v in data[start:stop]]
+        if needData and len(values) < stop - start:
+            values += [TypeDef.defaultData(ptype)] * (stop - start - len(values))
+        for i in range(start, stop):
             if isArray:
                 elname = "%s[%d]"%(pname, i)
             else:
                 elname = pname
-            self.insertScalarDataProperty(props, elname, ptype, values[i], pref)
+            self.insertScalarDataProperty(props, elname, ptype, values[i - start], pref)
+
+    def insertSummaryProperties(self, props, data, suffix=''):
+        """
+        Insert read-only properties showing the minimum, maximum and mean of data,
+        a typed buffer or array of numbers, so that large objects can be seen at a glance
+        """
+        stats = payload.summary(data)
+        if stats is not None:
+            for name, value in zip(('min', 'max', 'mean'), stats):
+                self.insertStringProperty(props, name + suffix, '%g'%value, True)
 
     def insertScalarDataProperty(self, props, elname, ptype, value, pref):
         """
@@ -1119,48 +1339,73 @@ class DrawPanel(wx.ScrolledWindow):
             
     def insertMatrixProperties(self, props, elem, tag, displayName, rows, cols):
         """
-        Insert properties to disply and set matrix and convolution data
+        Insert properties to disply and set matrix and convolution data.
+        Only a page of the cells is shown, in row major order from the start row and column.
         """
-        props.Append(wx.propgrid.PropertyCategory('%s data in [row][column] order'%displayName))
+        xobj = Xref.get(elem.get(bG.sreference))
+        xobj.start = min(xobj.start, rows * cols - 1)
+        row, col = divmod(xobj.start, cols)
+        self.insertUintProperty(props, 'start row', row, max=rows - 1)
+        self.insertUintProperty(props, 'start column', col, max=cols - 1)
+        cells = [divmod(i, cols) for i in range(xobj.start, min(xobj.start + options.propertyPageSize, rows * cols))]
         matMap = {}
-        for child in elem:
-            if etree.QName(child).localname == tag:
-                matMap["data[%s][%s]"%(child.get(bG.srow, "."), child.get(bG.scolumn, "."))] = child.text
-        for r in range(rows):
-            for c in range(cols):
-                matName = "data[%d][%d]"%(r, c)
-                if tag == bG.sfloat32:
-                    self.insertFloatProperty(props, matName, matMap.get(matName, 0.0))
-                elif tag == bG.sint16:
-                    self.insertIntProperty(props, matName, matMap.get(matName, 0), min=-0x8000, max=0x7FFF)
-                elif tag == bG.sint32:
-                    self.insertIntProperty(props, matName, matMap.get(matName, 0), min=-0x80000000, max=0x7FFFFFFF)
-                elif tag == bG.uint8:
-                    self.insertUintProperty(props, matName, matMap.get(matName, 0), max=255)
-                else:
-                    self.insertUintProperty(props, matName, matMap.get(matName, 42))    # secretly flag an unknown type with no data...
+        buf = Buffer.get(elem)
+        data = self.storedData(xobj) if buf is None else None
+        if buf is not None:
+            self.insertSummaryProperties(props, buf.values)
+            for r, c in cells:
+                matMap["data[%d][%d]"%(r, c)] = text(buf.code, buf.values[buf.index(r, c)])
+        elif data is not None:
+            self.insertSummaryProperties(props, data)
+            for r, c in cells:
+                if r < data.shape[0] and c < data.shape[1]:
+                    matMap["data[%d][%d]"%(r, c)] = str(data[r, c])
+        props.Append(wx.propgrid.PropertyCategory('%s data in [row][column] order'%displayName))
+        if buf is None and data is None:
+            for child in elem:
+                if etree.QName(child).localname == tag:
+                    matMap["data[%s][%s]"%(child.get(bG.srow, "."), child.get(bG.scolumn, "."))] = child.text
+        for r, c in cells:
+            matName = "data[%d][%d]"%(r, c)
+            if tag == bG.sfloat32:
+                self.insertFloatProperty(props, matName, matMap.get(matName, 0.0))
+            elif tag == bG.sint16:
+                self.insertIntProperty(props, matName, matMap.get(matName, 0), min=-0x8000, max=0x7FFF)
+            elif tag == bG.sint32:
+                self.insertIntProperty(props, matName, matMap.get(matName, 0), min=-0x80000000, max=0x7FFFFFFF)
+            elif tag == bG.uint8:
+                self.insertUintProperty(props, matName, matMap.get(matName, 0), max=255)
+            else:
+                self.insertUintProperty(props, matName, matMap.get(matName, 42))    # secretly flag an unknown type with no data...
 
     def insertListDataProperty(self, props, ref, tag, attr, max, displayName):
         """
         Insert properties to display and edit data where there is one item per child, with
         tag tag and index attribute attr. Maximum number of children is max.
-        The user is invited to edit up to 10 entries at a time, starting with the entry
+        The user is invited to edit a page of entries at a time, starting with the entry
         stored in the Xref.datasize property.
         """
         xobj = Xref.get(ref)
         curstart = xobj.datasize    # we re-use the size property as the start property
         self.insertUintProperty(props, 'start ' + attr, curstart, max=max - 1)
+        stop = min(curstart + options.propertyPageSize, max)
 
-        props.Append(wx.propgrid.PropertyCategory('%s data from %s %d'%(displayName, attr, curstart)))
-
-        # collect the data
+        # collect the data, from the buffer, the file or the xml
         dataMap = {}
-        for child in xobj.elem:
-            if tag == etree.QName(child).localname:
-                dataMap[child.get(attr, "?")] = child.text
+        buf = Buffer.get(xobj.elem)
+        data = buf.values if buf is not None else self.storedData(xobj)
+        if data is not None:
+            self.insertSummaryProperties(props, data)
+            for i in range(curstart, min(stop, len(data))):
+                dataMap[str(i)] = str(data[i])
+        props.Append(wx.propgrid.PropertyCategory('%s data from %s %d'%(displayName, attr, curstart)))
+        if data is None:
+            for child in xobj.elem:
+                if tag == etree.QName(child).localname:
+                    dataMap[child.get(attr, "?")] = child.text
         
-        # display up to 10 data for editing
-        for i in range(curstart, min(curstart + 10, max)):
+        # display a page of data for editing
+        for i in range(curstart, stop):
             name = "%s %d"%(attr, i)
             value = dataMap.get(str(i), 0)
             if tag == bG.suint8:
@@ -1191,6 +1436,8 @@ class DrawPanel(wx.ScrolledWindow):
             self.insertStringProperty(props, bG.sreference, ref, True)
             # cannot edit root name or graph parameter names
             self.insertStringProperty(props, bG.sname, xobj.name, ref == bG.sroot or tag == bG.sparameter)
+            if xobj.isStored():
+                self.insertStringProperty(props, payload.sdata_file, elem, True)
 
             # data for each possible tag
             if tag == 'openvx':
@@ -1277,7 +1524,7 @@ class DrawPanel(wx.ScrolledWindow):
             elif tag == bG.sdelay:
                 self.insertUintProperty(props, bG.scount, elem, 1, 256)
             elif tag == bG.sdistribution:
-                distBins = int(elem.get(bG.sbins, "256"))
+                distBins = int(elem.get(bG.sbins, bG.dataObjectTags[bG.sdistribution][bG.sbins]))
                 self.insertUintProperty(props, bG.sbins, distBins, 1)
                 self.insertUintProperty(props, bG.soffset, elem)
                 self.insertUintProperty(props, bG.srange, elem, 1)
@@ -1320,40 +1567,52 @@ class DrawPanel(wx.ScrolledWindow):
             elif tag == bG.sremap:
                 for name in [bG.ssrc_width, bG.ssrc_height, bG.sdst_width, bG.sdst_height]:
                     self.insertUintProperty(props, name, elem, 0, 8096)
-                # Now the data. It is set per up to 16 items only increasing in the in the x direction most rapidly
+                # Now the data. It is set per page of items increasing in the in the x direction most rapidly
                 if not xobj.isVirtual():
                     remapData = {}
                     dstw = int(elem.get(bG.sdst_width, 16))
                     dsth = int(elem.get(bG.sdst_height, 16))
                     if not isinstance(xobj.datasize, dict):
                         xobj.datasize = dict(dst_x="0", dst_y="0")
-                    dstx = int(xobj.datasize['dst_x'])
-                    dsty = int(xobj.datasize['dst_y'])
+                    # keep the start of the page inside the remap
+                    dstx = min(int(xobj.datasize['dst_x']), dstw - 1)
+                    dsty = min(int(xobj.datasize['dst_y']), dsth - 1)
+                    xobj.datasize = dict(dst_x=str(dstx), dst_y=str(dsty))
                     self.insertUintProperty(props, 'dst_x', dstx, max=dstw - 1)
                     self.insertUintProperty(props, 'dst_y', dsty, max=dsth - 1)
                     keys = []
                     remapData = {}
-                    for i in range(16):
+                    for i in range(options.propertyPageSize):
                         # create lists of keys and map of default data
-                        k = "[%d][%d]"%(dsty, dstx)
-                        keys.append(k)
-                        remapData[k] = (str(float(dsty)), str(float(dstx)))
+                        keys.append((dsty, dstx))
+                        remapData[(dsty, dstx)] = (float(dsty), float(dstx))
                         dstx += 1
                         if dstx >= dstw:
                             dstx = 0
                             dsty += 1
                         if dsty >= dsth:
                             break
+                    # Find the data corresponding to the map, in the remap's buffer or its file
+                    buf = Buffer.get(elem)
+                    data = self.storedData(xobj) if buf is None else None
+                    if buf is not None:
+                        self.insertSummaryProperties(props, buf.values[0::2], ' src_x')
+                        self.insertSummaryProperties(props, buf.values[1::2], ' src_y')
+                        for y, x in keys:
+                            i = buf.index(x, y)
+                            remapData[(y, x)] = (text(buf.code, buf.values[i + 1]), text(buf.code, buf.values[i]))
+                    elif data is not None:
+                        self.insertSummaryProperties(props, data[:, :, 0], ' src_x')
+                        self.insertSummaryProperties(props, data[:, :, 1], ' src_y')
+                        for y, x in keys:
+                            if y < data.shape[0] and x < data.shape[1]:
+                                remapData[(y, x)] = (str(data[y, x, 1]), str(data[y, x, 0]))
                     props.Append(wx.propgrid.PropertyCategory('Data: [y][x]pairs from the dst_y, dst_x values'))
-                    # Find the data corresponding to the map
-                    for child in list(elem):
-                        k = "[%s][%s]"%(child.get('dst_y'), child.get('dst_x'))
-                        if k in keys:
-                            remapData[k] = (child.get('src_y'), child.get('src_x'))
-                    for k in keys:
-                        y, x = remapData[k]
-                        self.insertFloatProperty(props, 'src_y' + k, y)
-                        self.insertFloatProperty(props, 'src_x' + k, x)
+                    for y, x in keys:
+                        k = "[%d][%d]"%(y, x)
+                        sy, sx = remapData[(y, x)]
+                        self.insertFloatProperty(props, 'src_y' + k, sy)
+                        self.insertFloatProperty(props, 'src_x' + k, sx)
 
             # elif tag == bG.sthreshold:
             elif tag == bG.stensor:
@@ -1419,6 +1678,8 @@ class DrawPanel(wx.ScrolledWindow):
         self.topframe.GetMenuBar().FindItemById(const.ID_InsertMenuXNode).Enable(not withDelays)
         self.topframe.GetMenuBar().FindItemById(const.ID_EditMenuReplicate).Enable(tag == bG.snode)
         self.topframe.GetMenuBar().FindItemById(const.ID_EditMenuVirtual).Enable(tag in bG.dataObjectTags)
+        self.topframe.GetMenuBar().FindItemById(const.ID_EditMenuStoreData).Enable(tag in payload.storableTags)
+        self.topframe.GetMenuBar().FindItemById(const.ID_EditMenuLoadData).Enable(tag in payload.storableTags)
         self.topframe.GetMenuBar().FindItemById(const.ID_EditMenuConnect).Enable(tag is not None)
         self.topframe.GetMenuBar().FindItemById(const.ID_EditMenuRemoveObject).Enable(tag is not None)
         self.topframe.GetMenuBar().FindItemById(const.ID_EditMenuRemoveGraph).Enable(not withDelays)
@@ -1454,8 +1715,9 @@ class DrawPanel(wx.ScrolledWindow):
         self.PopupMenu(DataMenu(*self.getMenuUpdateData()))
 
     def Update(self, elemGraph):
-        # Initialise the XML tree and graph:
-        self.element, self.graph = elemGraph
+        # Initialise the XML tree, the graph that models it and the view of that which is drawn:
+        self.element, self.model = elemGraph
+        self.graph = bG.viewOf(self.model)
         # Initialise attribute object
         self.attrObj = "None"
         # Initialise bitmap:
@@ -1475,6 +1737,9 @@ class DrawPanel(wx.ScrolledWindow):
         # Mouse action positions
         self.downPos = None
         self.dragPos = None
+        # Object under the mouse and its rect
+        self.hoverObj = None
+        self.hoverRect = None
 
     def SelectNone(self):
         """
@@ -1527,18 +1792,29 @@ class DrawPanel(wx.ScrolledWindow):
                         srect = nrect
                         sobj = n
         else:
+            # Search the index in growing squares around the object. Anything
+            # positioned within distance r lies in the square of 'radius' r, so once
+            # the best found is that close there can be nothing better outside.
             rect = self.BoundingRect(sobj)
             srect = rect
             rpos = rect.GetPosition()
-            best = 1000000000000000
-            for n in nodes:
-                nrect = self.BoundingRect(n)
-                ndiff = nrect.GetPosition() - rpos
-                dist = ndiff.x * ndiff.x + ndiff.y * ndiff.y
-                if test(nrect, rect) and dist < best:
-                    best = dist
-                    sobj = n
-                    srect = nrect
+            bsize = self.bitmap.GetSize()
+            r = self.index.cellSize
+            while True:
+                best = None
+                for name in self.index.query((rpos.x - r, rpos.y - r, rect.width + 2 * r, rect.height + 2 * r)):
+                    if not self.graph.has_node(name):
+                        continue
+                    nrect = self.BoundingRect(name)
+                    ndiff = nrect.GetPosition() - rpos
+                    dist = ndiff.x * ndiff.x + ndiff.y * ndiff.y
+                    if test(nrect, rect) and (best is None or dist < best):
+                        best = dist
+                        sobj = self.graph.get_node(name)
+                        srect = nrect
+                if (best is not None and best <= r * r) or r > max(bsize.width, bsize.height):
+                    break
+                r *= 2
         if sobj is not None:
             # Scroll if necessary to make sure object is visible
             self.ScrollToObj(sobj)
@@ -1593,40 +1869,43 @@ class DrawPanel(wx.ScrolledWindow):
 
     def Redraw(self):
         '''
-        Redraw the graph onto the bitmap, laying out.
-        Also creates bounding boxes for each node of the graph:
+        Start laying out the graph in the background; SetLayout() is
+        called with the results.
+        Required after modifications have been made.
+        The view of the graph is projected again from the model if it has changed,
+        or showVirtuals has.
+        '''
+        self.graph = bG.viewOf(self.model)
+        # clear the 'dirty' flag in our graph:
+        Xref.clearDirty(self.graph)
+        self.parent.layouts.schedule(self, self.graph, self.parent.rankdir)
+
+    def SetLayout(self, bitmap, nodes, drawing):
+        '''
+        Use the new bitmap and vector drawing of the graph, and create bounding boxes for each node
+        from the width, height and position given by the layout:
         Note that coordinates obtained from the graph are in points,
         and the lower left corner is at (0,0)
         Width and height from the graph are in inches
         Graphs are drawn by dot assuming 96 DPI ("standard" screen resolution)
         There is (apparently) a margin of 4 pixels on the bitmap
-        Required after modifications have been made.
         '''
         # Set the resolution
         dpi = 96        # dots per inch; always 96 for the screen
-        # Assign positions and sizes to objects so we can select them
-        self.graph.layout(prog='dot', args="-Grankdir=%s"%self.parent.rankdir)
-        h, path = tempfile.mkstemp(suffix='.png')
-        os.close(h)
-        self.graph.draw(path)
-        self.bitmap = wx.Bitmap(path)
-        os.unlink(path)
+        self.bitmap = bitmap
+        self.drawing = drawing
         # Create bounding boxes in screen coordinates for each node
         ppi = 72.0          # points per inch
         ppp = dpi / ppi     # pixels per point
         margin = 4 * ppp    # Margin around the drawing
-        for n in self.graph.nodes():
-            width = n.attr['width']
-            height = n.attr['height']
-            pos = n.attr['pos']
+        self.index = GridIndex()
+        for name, width, height, pos in nodes:
             w = int(dpi * float(width) + 0.5)
             h = int(dpi * float(height) + 0.5)
             x, y = [int(float(p) * ppp + 0.5) + margin for p in pos.split(',')]
             y = self.bitmap.GetHeight() - y  # invert the y coordinate as lower left is at (0,0)
             # Now create the bounding rectangle of this object
-            n.attr['brect'] = '%d,%d,%d,%d'%(x - w / 2, y - h / 2, w, h)
-        # clear the 'dirty' flag in our graph:
-        Xref.clearDirty(self.graph)
+            self.index.insert(name, (int(x - w / 2), int(y - h / 2), w, h))
         # try and set the previously selected objects:
         if self.selectedObj is not None and self.graph.has_node(self.selectedObj):
             self.selectedObj = self.graph.get_node(self.selectedObj)
@@ -1640,9 +1919,11 @@ class DrawPanel(wx.ScrolledWindow):
         else:
             self.upObj = None
             self.upRect = None
+        self.hoverObj = None
+        self.hoverRect = None
         self.ScrollToObj(self.upObj if self.selectedObj is None else self.selectedObj)
+        self.Refresh()
 
-    
     def Write(self):
         """
         Write the current graph to a drawing file
@@ -1665,7 +1946,8 @@ class DrawPanel(wx.ScrolledWindow):
             filename = fd.GetPath()
         if filename != "":
             try:
-                self.graph.draw(filename, args="-Grankdir=%s -Gdpi=%s"%(self.parent.rankdir, self.parent.dpi))
+                self.graph.draw(filename, prog=options.dotEngine,
+                                args="-Grankdir=%s -Gdpi=%s"%(self.parent.rankdir, self.parent.dpi))
             except:
                 self.topframe.Error("Error writing to file '%s'"%filename, True)
 
@@ -1673,19 +1955,27 @@ class DrawPanel(wx.ScrolledWindow):
         return Large(self.BoundingRect(obj))
         
     def BoundingRect(self, obj):
-        return wx.Rect(*(int(i) for i in obj.attr['brect'].split(',')))
+        """
+        Return the bounding rect of the object, which is empty until
+        the object has been laid out
+        """
+        rect = self.index.get(str(obj))
+        return wx.Rect() if rect is None else wx.Rect(*rect)
 
     def ObjAtPos(self, pos):
         '''
         Return a tuple of object at the given screen position, and the object's bounding rect
         If there is no object, return (None, None)
+        Objects are found within the large bounding rect; if there are several, the smallest
         '''
-        for n in self.graph.nodes():
-            # Now create the bounding rectangle of this object
-            brect = self.LargeBoundingRect(n)
-            if brect.Contains(pos):
-                return (n, brect)
-        return (None, None)
+        found = None
+        x, y = pos
+        for name in self.index.query((x - 5, y - 5, 11, 11)):
+            brect = self.LargeBoundingRect(name)
+            if brect.Contains(wx.Point(int(x), int(y))) and self.graph.has_node(name):
+                if found is None or brect.width * brect.height < found[1].width * found[1].height:
+                    found = (self.graph.get_node(name), brect)
+        return (None, None) if found is None else found
 
     def rightMouse(self, control, shift, alt):
         """
@@ -1774,22 +2064,20 @@ class DrawPanel(wx.ScrolledWindow):
         else:
             pass
 
-    def isDescendant(self, elem, desc, seen=set()):
+    def isDescendant(self, elem, desc):
         """
         If a cycle is detected in the graph, log an error
         and return True
         If desc is a descendant of elem, return True
         Otherwise, return false
+        The topological order of the graph (see cvxOrder) is used, rather than
+        following every path.
         """
-        if elem == desc:
-            return True
-        if elem in seen:
+        reached, cycle = GraphOrder.get(self.graph).reaches(elem, desc)
+        if cycle:
             self.topframe.Error("Cycle detected in the graph!")
             return True
-        for c in self.graph.successors(elem):
-            if self.isDescendant(c, desc, seen | {elem}):
-                return True
-        return False
+        return reached
     
     def getWriter(self, dnode):
         """
@@ -1874,7 +2162,7 @@ class DrawPanel(wx.ScrolledWindow):
             for choice in selections:
                 # OK to connect, so do it:
                 o = int(choices[choice].split(' ')[1])
-                if not bG.addOptional(self.element, self.graph, dnode, opts, o):
+                if not bG.addOptional(self.element, self.model, dnode, opts, o):
                     self.parent.Undo()
                     break
 
@@ -1926,7 +2214,7 @@ class DrawPanel(wx.ScrolledWindow):
                     if fval != tval:
                         nomatch[attr] = (fval, tval)
             # We hand off the task of matching attributes to the bG function
-            return bG.mergeToVirtual(self.element, self.graph, source, sink, fromWriter, nomatch)
+            return bG.mergeToVirtual(self.element, self.model, source, sink, fromWriter, nomatch)
         elif fromTag == bG.svx_reference:
             # Here we can merge two objects because one of them is a reference
             bG.convertReferenceTo(source, sink)
@@ -1948,7 +2236,7 @@ class DrawPanel(wx.ScrolledWindow):
             self.topframe.Error("Cannot insert node in %s; use a graph tab"%bG.globalsName)
         else:
             self.parent.Save()
-            bG.insertNode(self.element, self.graph, kernel)
+            bG.insertNode(self.element, self.model, kernel)
 
     def insertGraphParameter(self, obj, node=None):
         """
@@ -1974,7 +2262,7 @@ class DrawPanel(wx.ScrolledWindow):
             return self.topframe.Error("Second selected object must be a directly connected node.")
         # We've done the checks, hand off to bG to do the work. We may have to rebuild:
         self.parent.Save()
-        if not bG.insertGraphParameter(self.element, self.graph, obj, node):
+        if not bG.insertGraphParameter(self.element, self.model, obj, node):
             self.parent.ScrapUndo()
 
     def removeNode(self, obj):
@@ -1985,58 +2273,53 @@ class DrawPanel(wx.ScrolledWindow):
         remove the node together with those objects.
         """
         nelem = Xref.get(obj).elem
+        bG.touchElement(nelem)
         paramtag = etree.QName(self.element, bG.sparameter).text
         changes = 0
         # First, remove graph parameters:
         pIndex = 0  # for re-numbering
-        for gp in self.element.iterchildren(paramtag):
+        for gp in list(self.element.iterchildren(paramtag)):
             if gp.attrib[bG.snode] == obj:
-                self.element.remove(gp)
+                journal.remove(self.element, gp)
                 changes += 1
             else:
-                gp.attrib[bG.sindex] = str(pIndex)  # renumber other graph parameters
+                journal.setAttr(gp, bG.sindex, pIndex)  # renumber other graph parameters
                 pIndex += 1
 
         # Now, remove node parameters that are connected to other things.
         # What we don't remove are parameters for virtuals that have only one neighbor.
         # We also build up a set of potentially orphaned virtual data objects
         vSet = set()
-        for np in nelem.iterchildren(paramtag):
+        for np in list(nelem.iterchildren(paramtag)):
             pref = np.attrib[bG.sreference]
             xObj = Xref.get(pref)
             if xObj.elem.getparent() == self.element:
                 # This is virtual
                 # is degree of the parameter > 1?
-                degree = 0
-                for npr in self.element.iterdescendants(paramtag):
-                    if npr.get(bG.sreference) == pref:
-                        degree += 1
-                        if degree > 1:
-                            break
-                if degree > 1:
-                    nelem.remove(np)
+                if len(Uses.nodeParameters(pref)) > 1:
+                    journal.remove(nelem, np)
                     changes += 1
                 else:
                     vSet.add(xObj.elem)
             elif xObj.isImmutable():
-                nelem.remove(np)
+                journal.remove(nelem, np)
                 if len(xObj.readers) == 1:
-                    xObj.elem.getparent().remove(xObj.elem)
+                    bG.touchElement(xObj.elem)
+                    journal.remove(xObj.elem.getparent(), xObj.elem)
             else:
                 # Non-virtual mutable
-                nelem.remove(np)
+                journal.remove(nelem, np)
                 changes += 1
         # Now see if we need to delete the node or not
         if changes == 0:
             # We've done nothing so far, so we must delete the node
             # and all the virtual data objects
-            self.element.remove(nelem)
+            journal.remove(self.element, nelem)
             for vobj in vSet:   # Remove the (now orphaned) virtual data
-                self.element.remove(vobj)
+                journal.remove(self.element, vobj)
         else:
             # The node has been disconnected, therefore it can no longer be replicated
-            nelem.attrib[bG.sis_replicated] = bG.sfalse
-        Xref.setDirty()
+            journal.setAttr(nelem, bG.sis_replicated, bG.sfalse)
 
     def removeGraphParameter(self, obj):
         """
@@ -2044,7 +2327,7 @@ class DrawPanel(wx.ScrolledWindow):
         If the bG function returns false, we have to redbuild.
         """
         self.parent.Save()
-        if not bG.removeGraphParameter(self.element, self.graph, obj):
+        if not bG.removeGraphParameter(self.element, self.model, obj):
             self.parent.ScrapUndo()
 
     def removeData(self, obj):
@@ -2061,44 +2344,38 @@ class DrawPanel(wx.ScrolledWindow):
         isChild = xobj.isChild() and xobj.tag not in {bG.sroi, bG.sview, bG.splane}
         isVirtual = xobj.isVirtual()
         elem = xobj.elem
-        # Now go looking for graph parameters that reference this object, over
-        # the entire xml tree. First, build a set of references for the object
-        # and all it's dataObject children:
-        refs = {ref}
+        # Every graph that references the object or its children also shows it
+        bG.touchElement(elem)
+        # Now go looking for the node parameters that use this object, and the graph
+        # parameters that expose them, using the index of uses (see cvxUses).
+        # First, build a list of references for the object and all it's dataObject children:
+        refs = [ref]
         for child in elem.iterdescendants():
             if etree.QName(child).localname in bG.dataObjectTags:
-                refs.add(child.attrib[bG.sreference])
-        # Now we iterate over all graphs looking for a parameters that reference
-        # an object we have in the set:
-        root = Xref.getroot().elem
-        graphtag = etree.QName(root, bG.sgraph).text
-        paramtag = etree.QName(root, bG.sparameter).text
-        nodetag = etree.QName(root, bG.snode).text
+                refs.append(child.attrib[bG.sreference])
         changes = 0
         hadOne = isChild or not isVirtual
-        for g in root.iterchildren(graphtag):           # check all the graphs
-            params = set() # The parameters we have found
-            for n in g.iterchildren(nodetag):
-                kps = bG.getKernelInfo(n).params
-                nref = n.attrib[bG.sreference]
-                for p in n.iterchildren(paramtag):
-                    pref = p.attrib[bG.sreference]
-                    if pref in refs:
-                        params.add((p.attrib[bG.sindex], nref))
-                        if pref != ref or hadOne or kps[int(p.attrib[bG.sindex])].pstate == kdefs.kpOptional:
-                            n.remove(p)
-                            changes += 1
-                        elif pref == ref:
-                            hadOne = True
-            pIndex = 0                                  # for re-numbering graph parameters
-            for gp in g.iterchildren(paramtag):         # check all graph parameters
-                affected = False                        # we'll set this True if this parameter is affected
-                if (gp.attrib[bG.sparameter], gp.attrib[bG.snode]) in params:
-                    g.remove(gp)                        # remove the graph parameter
+        graphs = []                                     # graphs that have lost graph parameters
+        for r in refs:
+            for p in Uses.nodeParameters(r):            # in document order
+                n = p.getparent()
+                for gp in Uses.graphParameters(p):
+                    g = gp.getparent()
+                    journal.remove(g, gp)               # remove the graph parameter
+                    changes += 1
+                    if g not in graphs:
+                        graphs.append(g)
+                if r != ref or hadOne or \
+                   bG.getKernelInfo(n).params[int(p.attrib[bG.sindex])].pstate == kdefs.kpOptional:
+                    journal.remove(n, p)
                     changes += 1
                 else:
-                    gp.attrib[bG.sindex] = str(pIndex)  # renumber other graph parameters
-                    pIndex += 1
+                    hadOne = True
+        for g in graphs:
+            pIndex = 0                                  # for re-numbering graph parameters
+            for gp in g.iterchildren(etree.QName(g, bG.sparameter).text):
+                journal.setAttr(gp, bG.sindex, pIndex)
+                pIndex += 1
 
         # here to see if we have disconnected anything - if not, we'll proceed as delete
         if changes == 0:
@@ -2107,7 +2384,6 @@ class DrawPanel(wx.ScrolledWindow):
             elif hadOne and isVirtual:
                 return self.topframe.Error("Nothing to do")
             else:
-                elem.getparent().remove(elem)
-        Xref.setDirty()
+                journal.remove(elem.getparent(), elem)
         return True
         
@@ -0,0 +1,158 @@
+'''
+This module keeps an index of the uses of data objects, so that finding the
+nodes and graph parameters connected to an object costs time in proportion to
+its connections rather than to the size of the document.
+A node parameter <parameter index="i" reference="r"/> uses the data object r,
+and a graph parameter <parameter node="n" parameter="i" index="j"/> exposes
+parameter i of node n. The index maps data references to node parameters,
+and node references to graph parameters.
+It is built from the document when first needed, and is then kept up to date
+by the functions in cvxJournal that change the tree.
+'''
+from lxml import etree
+
+sparameter = 'parameter'
+sreference = 'reference'
+snode = 'node'
+sgraph = 'graph'
+sindex = 'index'
+
+def localname(elem):
+    return etree.QName(elem).localname
+
+class Uses(object):
+    """
+    Static class holding the index of the document Uses.root
+    """
+    root = None             # The document indexed
+    built = False           # False until the index is needed
+    params = {}             # data object reference: set of node parameter elements
+    graphParams = {}        # node reference: set of graph parameter elements
+
+    @staticmethod
+    def setroot(root):
+        """
+        Use the document root; the index is built when first needed
+        """
+        Uses.root = root
+        Uses.clear()
+
+    @staticmethod
+    def clear():
+        """
+        Forget the index, e.g. when references have been renumbered
+        """
+        Uses.built = False
+        Uses.params = {}
+        Uses.graphParams = {}
+
+    @staticmethod
+    def build():
+        if not Uses.built and Uses.root is not None:
+            Uses.built = True
+            Uses.add(Uses.root)
+
+    @staticmethod
+    def keyOf(param):
+        """
+        Return the dictionary and key under which a parameter element is indexed,
+        or None if it is not a node or graph parameter
+        """
+        parent = param.getparent()
+        if parent is None or not isinstance(param.tag, str) or localname(param) != sparameter:
+            return None
+        ptag = localname(parent)
+        if ptag == snode:
+            return Uses.params, param.get(sreference)
+        elif ptag == sgraph:
+            return Uses.graphParams, param.get(snode)
+        return None
+
+    @staticmethod
+    def inDocument(elem):
+        while elem is not None:
+            if elem is Uses.root:
+                return True
+            elem = elem.getparent()
+        return False
+
+    @staticmethod
+    def add(elem):
+        """
+        Index the parameters in the subtree elem, which is in the document
+        """
+        for param in elem.iter('{*}' + sparameter):
+            key = Uses.keyOf(param)
+            if key is not None:
+                key[0].setdefault(key[1], set()).add(param)
+
+    @staticmethod
+    def discard(elem):
+        """
+        Forget the parameters in the subtree elem
+        """
+        for param in elem.iter('{*}' + sparameter):
+            key = Uses.keyOf(param)
+            if key is not None:
+                uses = key[0].get(key[1])
+                if uses is not None:
+                    uses.discard(param)
+                    if len(uses) == 0:
+                        del key[0][key[1]]
+
+    # Here from cvxJournal around each change to the tree
+
+    @staticmethod
+    def removing(elem):
+        if Uses.built and Uses.inDocument(elem):
+            Uses.discard(elem)
+
+    @staticmethod
+    def inserted(elem):
+        if Uses.built and Uses.inDocument(elem):
+            Uses.add(elem)
+
+    @staticmethod
+    def watched(elem, name):
+        """
+        Return True if a change to the attribute name of elem changes the index
+        """
+        return Uses.built and name in (sreference, snode) and isinstance(elem.tag, str) and \
+            localname(elem) == sparameter
+
+    # Queries
+
+    @staticmethod
+    def ordered(elems):
+        """
+        Return the elements in document order; the cost is in the depth of the
+        elements and the number of their siblings, not the size of the document
+        """
+        def path(elem):
+            indices = []
+            parent = elem.getparent()
+            while parent is not None:
+                indices.append(parent.index(elem))
+                elem, parent = parent, parent.getparent()
+            indices.reverse()
+            return indices
+        return sorted(elems, key=path) if len(elems) > 1 else list(elems)
+
+    @staticmethod
+    def nodeParameters(ref):
+        """
+        Return the node parameter elements that use the data object ref, in document order
+        """
+        Uses.build()
+        return Uses.ordered(Uses.params.get(ref, ()))
+
+    @staticmethod
+    def graphParameters(param):
+        """
+        Return the graph parameter elements that expose the node parameter element
+        param, in document order
+        """
+        Uses.build()
+        noderef = param.getparent().get(sreference)
+        index = param.get(sindex)
+        return Uses.ordered([gp for gp in Uses.graphParams.get(noderef, ()) if gp.get(sparameter) == index])
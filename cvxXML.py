@@ -3,13 +3,28 @@ This file holds the functions for parsing reading and writing XML,
 converting them to graphs, and for rendering the graphs.
 '''
 import wx
+import os
+import ast
 import math
+import array
+import operator
+import stat
+import tempfile
+import heapq
+from copy import deepcopy
+from contextlib import contextmanager
 from lxml import etree
 import pygraphviz as pgv
 import cvxKernelDefs as kdefs
 from cvxKernelDefs import KernelDef
 import cvxDataDefs as ddefs
 from cvxDataDefs import TypeDef
+import cvxJournal as journal
+from cvxJournal import Journal
+import cvxPayload as payload
+from cvxBuffer import Buffer, convert, converted, limits
+from cvxUses import Uses
+from cvxOrder import GraphOrder
 from cvxPreferences import updateBidEdge, updateContainerEdge, \
     updateGraphInputParameterObj, updateGraphOutputParameterObj, \
     updateNodeCustomObj, updateNormalEdge, updateObj
@@ -48,6 +63,8 @@ ssrc_width = "src_width"
 sdst_width = "dst_width"
 ssrc_height = "src_height"
 sdst_height = "dst_height"
+ssrc_x = "src_x"
+ssrc_y = "src_y"
 sstart_x = "start_x"
 sstart_y = "start_y"
 send_x = "end_x"
@@ -253,7 +270,7 @@ formatMap = {
 # The name of the 'globals' page:
 globalsName = '.globals'
 
-# Whether to show connected data or not
+# Whether to show connected data or not; this only changes the views (see projectGraph())
 showVirtuals = False
 
 # Utility to make a reference by joining several strings in a standard way
@@ -335,6 +352,14 @@ class Xref(object):
     xref = {}
     # Whether the graphs need rebuilding.
     xmlDirty = True
+    # References held in each AGraph, by graph name
+    members = {}
+    # Incremental changes waiting for updateGraphs(): references of graphs to be
+    # re-processed, references of global data objects to be taken out of the root
+    # graph, and elements of global data objects to be processed into it.
+    changedGraphs = set()
+    removedGlobals = set()
+    addedGlobals = []
 
     def __init__(self, elem, tagref, name, graph, direction=None, repl=False,
                 isDirty=True, immutable=False, tag=None,
@@ -357,108 +382,101 @@ class Xref(object):
         self._parent = isparent         # whether data object is a parent
         self._virtual = None            # whether data object is virtual, initialised by calling isVirtual()
         self._filename = None           # File where data is stored (e.g. image, tensor, remap)
+        self._payload = None            # (filename, array) of the data last read from a file
+        self.start = 0                  # first item of an array or matrix shown on the properties page
 
     def getFilename(self):
         """
         Return the filename for backing data storage (or None)
+        This is the file set by setFilename(), or else the file the data is kept in.
         """
+        if self._filename is None and self.elem is not None:
+            return self.elem.get(payload.sdata_file)
         return self._filename
 
     def setFilename(self, filename):
         """
         Set the filename for backing data storage
         """
-        self._load_filenameFile = filename
+        self._filename = None if filename is None else os.path.abspath(filename)
+
+    def isStored(self):
+        """
+        Return True if the object's data is kept in a file rather than in the xml
+        """
+        return self.elem is not None and payload.sdata_file in self.elem.attrib
+
+    def getPayload(self):
+        """
+        Return the object's data as a read-only, memory-mapped array if it is
+        kept in a file, otherwise None
+        """
+        if not self.isStored():
+            return None
+        filename = self.elem.get(payload.sdata_file)
+        if self._payload is None or self._payload[0] != filename:
+            self._payload = (filename, payload.load(filename))
+        return self._payload[1]
 
     def storeData(self):
         """
         Store the object's data in an appropriate format using the filename.
         If the filename is None, create one and assign it.
         The data is removed from the xml object.
+        Images and tensors have no data in the xml, so theirs is all zero unless it
+        is already in a file.
+        Delays, pyramids and object arrays hold no data of their own, and the data of
+        thresholds and scalars is too small to be worth storing.
+        Returns False if there was a problem.
         """
-        if self._filename is None:
-            wx.GetApp().frame.Error("Filename has not been set", True)
-        if self.tag == simage:
-            # Not uniform images, ROI, image from channel or object array of images from tensor
-            # Image data is always stored.
-            wx.GetApp().frame.Error("Storing image data is not supported yet", True)
-            # Images are supported through standard image file formats, and XML
-        elif self.tage == stensor:
-            # Not views
-            # Tensor data is alwasy stored
-            wx.GetApp().frame.Error("Storing tensor data is not supported yet", True)
-            # Tensors are supported through image file formats, NNEF, and XML
-        elif self.tag == sremap:
-            wx.GetApp().frame.Error("Storing remap data is not supported yet", True)
-            # Remaps are supported through .csv and XML
-            # Stored on request
-        elif self.tag == slut:
-            wx.GetApp().frame.Error("Storing LUT data is not supported yet", True)
-            # LUT supported through XML and csv
-            # Stored on request
-        elif self.tag == sdistribution:
-            wx.GetApp().frame.Error("Storing distribution data is not supported yet", True)
-            # distribution supported through XML and csv
-            # stored on request
-        elif self.tag == smatrix:
-            wx.GetApp().frame.Error("Storing remap data is not supported yet", True)
-            # matrix supported through xml and csv
-            # stored on request
-        elif self.tag == sconvolution:
-            wx.GetApp().frame.Error("Storing convolution data is not supported yet", True)
-            # convolution supported through xml and csv
-            # stored on request
-        elif self.tag == sarray:
-            wx.GetApp().frame.Error("Storing array data is not supported yet", True)
-            # array supported through xml and csv
-            # stored on request
-
-        # The following are not supoprted:
-        # vx_delay, vx_pyramid, vx_object_array - these are effectively supported at a higher level
-        # vx_threshold, vx_scalar - data is trivial and does not need to be stored/ created externally
-
+        if not payload.available():
+            return wx.GetApp().frame.Error("Storing data needs the NumPy package", True)
+        filename = self.getFilename()
+        if filename is None:
+            self.setFilename(payload.newFilename(self.name))
+            filename = self.getFilename()
+        Buffer.sync(self.elem)
+        try:
+            data = self.getPayload() if self.isStored() else payload.fromElement(self.elem)
+            with replaceFile(filename) as f:
+                payload.save(f, data)
+        except (ValueError, TypeError, OSError) as e:
+            return wx.GetApp().frame.Error("Cannot store the data of %s: %s"%(self.name, e), True)
+        # The data must be read from the new file, even if it has the same name
+        self._payload = None
+        payload.clearData(self.elem)
+        journal.setAttr(self.elem, payload.sdata_file, filename)
+        return True
 
     def loadData(self):
         """
         Load data from the file given by filename, it it exists.
-        Replace all the data in the xml object.
+        Replace all the data in the xml object, which is changed to suit the data.
         If the file does not exist, then report an error.
-        If the command is not appropriate for the tyupe of object (e.g. scalar) then do nothing at all
+        Returns False if there was a problem.
         """
-        if self._filename is None:
-            wx.GetApp().frame.Error("Filename has not been set", True)
-        if self.tag == simage:
-            # Not uniform images, ROI, image from channel or object array of images from tensor
-            data = wx.Image(self._filename)
-            wx.GetApp().frame.Error("Loading image data is not supported yet", True)
-            # Images are supported through standard image file formats, and XML
-        elif self.tage == stensor:
-            # Not views
-            wx.GetApp().frame.Error("Loading tensor data is not supported yet", True)
-            # Tensors are supported through image file formats, NNEF, and XML
-        elif self.tag == sremap:
-            wx.GetApp().frame.Error("Loading remap data is not supported yet", True)
-            # Remaps are supported through .csv and XML
-        elif self.tag == slut:
-            wx.GetApp().frame.Error("Loading LUT data is not supported yet", True)
-            # LUT supported through XML and csv
-        elif self.tag == sdistribution:
-            wx.GetApp().frame.Error("Loading distribution data is not supported yet", True)
-            # distribution supported through XML and csv
-        elif self.tag == smatrix:
-            wx.GetApp().frame.Error("Loading remap data is not supported yet", True)
-            # matrix supported through xml and csv
-        elif self.tag == sconvolution:
-            wx.GetApp().frame.Error("Loading convolution data is not supported yet", True)
-            # convolution supported through xml and csv
+        if not payload.available():
+            return wx.GetApp().frame.Error("Loading data needs the NumPy package", True)
+        filename = self.getFilename()
+        if filename is None:
+            return wx.GetApp().frame.Error("Filename has not been set", True)
+        try:
+            data = payload.load(filename)
+            attrs = payload.fit(self.elem, data)
+        except (ValueError, OSError) as e:
+            return wx.GetApp().frame.Error("Cannot load the data of %s from '%s': %s"%(self.name, filename, e), True)
+        payload.clearData(self.elem)
+        for name, value in list(attrs.items()):
+            journal.setAttr(self.elem, name, value)
+        if self.tag == stensor:
+            changeTensorSize(self.elem, None)
+            for dim, size in zip(payload.dimensions(self.elem), data.shape):
+                journal.setAttr(dim, ssize, size)
         elif self.tag == sarray:
-            wx.GetApp().frame.Error("Loading array data is not supported yet", True)
-            # array supported through xml and csv
-
-        # The following are not supoprted:
-        # vx_delay, vx_pyramid, vx_object_array - these are effectively supported at a higher level
-        # vx_threshold, vx_scalar - data is trivial and does not need to be stored/ created externally
-
+            self.datasize = len(data)
+        journal.setAttr(self.elem, payload.sdata_file, filename)
+        self._payload = (filename, data)
+        return True
 
     def graph(self, exclude=set()):
         """
@@ -514,19 +532,69 @@ class Xref(object):
     @staticmethod
     def setDirty(graph=None, dirty=True):
         """
-        Set the dirty flag for the xml or the graph
+        Set the dirty flag for the xml or the graph.
+        A graph that is dirty has changed, so its topological order and views are forgotten.
         """
         if graph is None:
             Xref.xmlDirty = dirty
         elif graph is sroot:
             Xref.xref[sroot].graphdirty = dirty
+            if dirty:
+                GraphOrder.forget(sroot)
+                forgetViews(sroot)
         else:
             Xref.xref[graph.name].graphdirty = dirty
+            if dirty:
+                GraphOrder.forget(graph.name)
+                forgetViews(graph.name)
 
     @staticmethod
     def clearDirty(graph = None):
         Xref.setDirty(graph, False)
 
+    @staticmethod
+    def isChanged():
+        """
+        Return True if there are incremental changes waiting for updateGraphs()
+        """
+        return len(Xref.changedGraphs) > 0 or len(Xref.removedGlobals) > 0 or len(Xref.addedGlobals) > 0
+
+    @staticmethod
+    def changeGraph(ref):
+        """
+        Record that the graph with the given reference needs re-processing
+        """
+        Xref.changedGraphs.add(ref)
+
+    @staticmethod
+    def removeGlobal(ref):
+        """
+        Record that the global data object with the given reference, and its children,
+        must be taken out of the root graph. All the graphs showing any of them are
+        re-processed as well.
+        """
+        xobj = Xref.get(ref)
+        if xobj is not None:
+            for elem in xobj.elem.iter():
+                cref = elem.get(sreference)
+                child = Xref.get(cref)
+                if child is not None and child.elem is elem:
+                    Xref.removedGlobals.add(cref)
+                    Xref.changedGraphs.update(name for name in child.graphs if name != sroot)
+
+    @staticmethod
+    def addGlobal(elem):
+        """
+        Record that the global data object elem must be processed into the root graph
+        """
+        Xref.addedGlobals.append(elem)
+
+    @staticmethod
+    def clearChanges():
+        Xref.changedGraphs.clear()
+        Xref.removedGlobals.clear()
+        del Xref.addedGlobals[:]
+
     @staticmethod
     def update(ref, elem=None, tagref=None, name=None, graph=None, direction=None,
                repl=False, isDirty=None, reader=None, writer=None, immutable=None,
@@ -544,6 +612,7 @@ class Xref(object):
                 Xref.xref[ref].name = name
             if graph is not None:
                 Xref.xref[ref].graphs[graph.name] = graph
+                Xref.members.setdefault(graph.name, set()).add(ref)
             if reader is not None:
                 Xref.xref[ref].readers.add(reader)
             if writer is not None:
@@ -572,10 +641,13 @@ class Xref(object):
                                   immutable=immutable is True, tag=tag,
                                   kdef=kdef, subtype=subtype, 
                                   datasize=0 if datasize is None else datasize)
+            Xref.members.setdefault(graph.name, set()).add(ref)
 
     @staticmethod
     def remove(ref):
-        del Xref.xref[ref]
+        xobj = Xref.xref.pop(ref)
+        for name in xobj.graphs:
+            Xref.members.get(name, set()).discard(ref)
 
     @staticmethod
     def get(ref):
@@ -587,6 +659,8 @@ class Xref(object):
     @staticmethod
     def clear():
         Xref.xref.clear()
+        Xref.members.clear()
+        Xref.clearChanges()
 
     @staticmethod
     def getroot():
@@ -596,6 +670,13 @@ class Xref(object):
     def setroot(elem, name, graph):
         Xref.clear()
         Xref.update(sroot, elem, sroot, name, graph, tag=sgraph)
+        if Journal.root is not elem:
+            Buffer.clear()
+            References.reset()
+            Uses.setroot(elem)
+            GraphOrder.clear()
+            views.clear()
+        Journal.root = elem
 
     @staticmethod
     def connections(ref):
@@ -620,8 +701,56 @@ class Xref(object):
 
 # Name management. We keep a dictionary of names and elements.
 # Duplicate names are not allowed!
+# New names are made by adding _0, _1... to a prefix. For each prefix we keep the
+# next suffix to try, and a heap of the suffixes below it that have been given up,
+# so that the lowest free name is found without trying every suffix in turn.
 
 elementNames = {}
+namedElements = {}      # element: its name in elementNames
+nameCounters = {}       # prefix: the next suffix to try
+freeSuffixes = {}       # prefix: heap of suffixes below the counter that may be free
+
+def clearNames():
+    elementNames.clear()
+    namedElements.clear()
+    nameCounters.clear()
+    freeSuffixes.clear()
+
+def splitName(name):
+    '''
+    Return the prefix and numeric suffix of a name like "node_12", or the name
+    and None if it has no suffix
+    '''
+    prefix, sep, suffix = name.rpartition('_')
+    if sep and suffix.isdigit() and str(int(suffix)) == suffix:
+        return prefix, int(suffix)
+    return name, None
+
+def dropName(name):
+    '''
+    Remove the name from the dictionary, and make its suffix free for re-use
+    '''
+    namedElements.pop(elementNames.pop(name), None)
+    prefix, seq = splitName(name)
+    if seq is not None and seq < nameCounters.get(prefix, 0):
+        heapq.heappush(freeSuffixes.setdefault(prefix, []), seq)
+
+def freeName(prefix):
+    '''
+    Return the name made from prefix with the lowest suffix not in use.
+    Every suffix below the counter is either in use or in the heap; names given
+    directly (e.g. read from a file) are skipped over once as the counter passes them.
+    '''
+    free = freeSuffixes.get(prefix)
+    while free:
+        name = '%s_%d'%(prefix, heapq.heappop(free))
+        if name not in elementNames:
+            return name
+    seq = nameCounters.get(prefix, 0)
+    while '%s_%d'%(prefix, seq) in elementNames:
+        seq += 1
+    nameCounters[prefix] = seq + 1
+    return '%s_%d'%(prefix, seq)
 
 def getData(child, tag):
     """
@@ -665,8 +794,16 @@ def updateScalarValues(xobj, attr, value, stringValue, index=0):
     value is the value returned by the property editor (could be str, int, float, bool)
     stringValue is the value displayed by the property editor
     Handles arrays as well as scalars...
+    The values of numbers are kept in a buffer (see cvxBuffer), which is changed
+    in place; the xml is only rebuilt for other types.
     """
     elem = xobj.elem
+    buf = Buffer.get(elem)
+    if buf is not None:
+        if index >= len(buf):
+            journal.splice(elem, len(buf), len(buf), [0] * (index + 1 - len(buf)))
+        journal.setItem(elem, index, convert(buf.code, value))
+        return
     num = len(elem)
     etype = elem.get(selemType)
     vxtype = TypeDef.typeFromEnum(etype)
@@ -707,10 +844,11 @@ def updateScalarValues(xobj, attr, value, stringValue, index=0):
     for i in range(num, reqsize):
         # insert missing data
         child = etree.Element(etree.QName(elem,'new'))
-        elem.append(child)
+        journal.append(elem, child)
         insertChildData(child, vxtype, elsize, sindex, etype, fname, newvalue)
     # remove excess data
-    elem[reqsize:num] = []
+    for child in elem[reqsize:num]:
+        journal.remove(elem, child)
     # Now update according to type
     insertChildData(elem[index], vxtype, elsize, sindex, etype, fname, newvalue)
 
@@ -730,7 +868,7 @@ def insertChildData(elem, ptype, elsize, sindex, etype, attr, value):
     data = getData(elem, qtag.localname)
     if data is None:
         # data is wrong type. Correct the tag and get default data
-        elem.tag = qtag.text
+        journal.setTag(elem, qtag.text)
         if isinstance(sdata, (list, dict)):
             # user struct or other array type (is there one?)
             data = sdata
@@ -738,22 +876,22 @@ def insertChildData(elem, ptype, elsize, sindex, etype, attr, value):
             # make a list of the appropriate size
             data = [sdata] * elsize
     # Now delete everything and rebuild, inserting new data along the way
-    elem.clear()
+    journal.clear(elem)
     if TypeDef.get(ptype).isArray():
         # array data as bytes (are there any other array types used?)
         data[sindex] = value
-        elem.text = " ".join([str(i) for i in data])
+        journal.setText(elem, " ".join([str(i) for i in data]))
     elif isinstance(data, dict):
         # structure type
         print(("attr='%s', data is %s and value is %s"%(attr, data, value)))
         for k, v in list(data.items()):
             child = etree.Element(etree.QName(elem, k))
-            elem.append(child)
             if k == attr:
                 child.text = value
             else:
                 print(("setting %s to %s"%(k,v)))
                 child.text = v
+            journal.append(elem, child)
     else:
         # data is a list - but of the correct size?
         lenvalues = len(data)
@@ -762,7 +900,7 @@ def insertChildData(elem, ptype, elsize, sindex, etype, attr, value):
         elif lenvalues < elsize:
             data[lenvalues:elsize] = [sdata] * (elsize - lenvalues)
         data[sindex] = value
-        elem.text = " ".join(data)
+        journal.setText(elem, " ".join(data))
 
 def updateArrayValues(xobj, attr, value, stringValue):
     """
@@ -781,13 +919,91 @@ def updateArrayValues(xobj, attr, value, stringValue):
     # now update that specific value
     updateScalarValues(xobj, name, value, stringValue, int(rname[0]))
 
+def resizeArray(xobj, size):
+    """
+    Change the number of items in an array. If its values are kept in a buffer,
+    items are removed from the end or zeros added; otherwise only the size shown
+    changes, and the xml is corrected when an item is set.
+    """
+    buf = Buffer.get(xobj.elem)
+    if buf is not None:
+        length = len(buf)
+        if size < length:
+            journal.splice(xobj.elem, size, length, [])
+        elif size > length:
+            journal.splice(xobj.elem, length, length, [0] * (size - length))
+    xobj.datasize = size
+
+def updateRemapPoint(elem, x, y, name, value):
+    """
+    Set src_x or src_y, given by name, of the point (x, y) of a remap
+    """
+    buf = Buffer.get(elem)
+    journal.setItem(elem, buf.index(x, y) + (name == ssrc_y), value)
+
+def fillRemap(elem, function):
+    """
+    Set every point of a remap from function(x, y), which returns src_x, src_y for
+    the destination coordinates x, y. With NumPy, x and y are float32 arrays of all
+    the coordinates, so the whole remap is done in one call and in one journal
+    operation; otherwise the function is called for each point with numbers.
+    See remapScaling() and remapUndistortion() for functions.
+    """
+    buf = Buffer.get(elem)
+    width, height = buf.key
+    if payload.available():
+        np = payload.np
+        y, x = np.mgrid[0:height, 0:width].astype('float32')
+        points = np.empty((height, width, 2), dtype='float32')
+        points[:, :, 0], points[:, :, 1] = function(x, y)
+        values = array.array('f', points.tobytes())
+    else:
+        values = array.array('f')
+        for y in range(height):
+            for x in range(width):
+                values.extend(function(float(x), float(y)))
+    journal.splice(elem, 0, len(buf), values)
+
+def remapScaling(elem):
+    """
+    Return a function for fillRemap() that scales the source image to the
+    destination, matching the centres of the pixels
+    """
+    sx = float(elem.get(ssrc_width, '16')) / float(elem.get(sdst_width, '16'))
+    sy = float(elem.get(ssrc_height, '16')) / float(elem.get(sdst_height, '16'))
+    return lambda x, y: ((x + 0.5) * sx - 0.5, (y + 0.5) * sy - 0.5)
+
+def remapUndistortion(elem, k1, k2=0.0, focal=None):
+    """
+    Return a function for fillRemap() that corrects radial lens distortion with the
+    coefficients k1 and k2, about the centre of the source image. focal is the focal
+    length in pixels, by default half the diagonal of the source image.
+    """
+    width, height = float(elem.get(ssrc_width, '16')), float(elem.get(ssrc_height, '16'))
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+    if focal is None:
+        focal = math.hypot(width, height) / 2
+    scale = remapScaling(elem)
+    def undistort(x, y):
+        x, y = scale(x, y)
+        u, v = (x - cx) / focal, (y - cy) / focal
+        r2 = u * u + v * v
+        factor = 1 + k1 * r2 + k2 * r2 * r2
+        return cx + u * factor * focal, cy + v * factor * focal
+    return undistort
+
 def updateRowColumn(elem, rowCol, tag, value):
     """
     Update (or insert) child data for row and column of given matrix or convolution,
     remove any incorrect tags and put things in the correct order.
     rowCol is a row, column identifier in the form "[%d][%d]", and value is string data.
+    If the coefficients are kept in a buffer (see cvxBuffer) the one cell is changed there.
     """
     row, column = rowCol[1:-1].split("][")
+    buf = Buffer.get(elem)
+    if buf is not None:
+        journal.setItem(elem, buf.index(int(row), int(column)), value)
+        return
     rows = elem.get(srows, str(int(row) + 1))
     columns = elem.get(scolumns, str(int(column) + 1))
     rcMap = {}
@@ -795,7 +1011,7 @@ def updateRowColumn(elem, rowCol, tag, value):
     for child in list(elem):
         if etree.QName(child).localname == tag:
             rcMap["[%s][%s]"%(child.get(srow), child.get(scolumn))] = child.text
-        elem.remove(child)
+        journal.remove(elem, child)
     # Update the correct element
     rcMap[rowCol] = value
     # Add new children in correct order
@@ -805,7 +1021,63 @@ def updateRowColumn(elem, rowCol, tag, value):
             child.set(srow, str(r))
             child.set(scolumn, str(c))
             child.text = rcMap.get("[%d][%d]"%(r, c), "0")
-            elem.append(child)
+            journal.append(elem, child)
+
+def pasteMatrix(elem, row, column, block):
+    """
+    Set the coefficients of a matrix or convolution from the given row and column
+    onwards from block, a sequence of rows of values, or text with a row on each
+    line, as copied from a spreadsheet. Values beyond the matrix are ignored.
+    The rows are pasted in one journal operation, covering only the rows pasted.
+    """
+    if isinstance(block, str):
+        block = [line.replace(',', ' ').split() for line in block.splitlines() if line.strip()]
+    buf = Buffer.get(elem)
+    rows, columns = buf.key[1:]
+    block = [list(values)[:max(columns - column, 0)] for values in list(block)[:max(rows - row, 0)]]
+    if not any(block):
+        return
+    start = buf.index(row, column)
+    stop = max(buf.index(row + r, column) + len(values) for r, values in enumerate(block))
+    values = buf.values[start:stop]
+    for r, rowValues in enumerate(block):
+        i = buf.index(row + r, column) - start
+        values[i:i + len(rowValues)] = converted(buf.code, rowValues)
+    journal.splice(elem, start, stop, values)
+
+def fillMatrix(elem, function):
+    """
+    Set every coefficient of a matrix or convolution from function(row, column).
+    With NumPy, row and column are arrays of all the coordinates, so the matrix is
+    done in one call; otherwise the function is called for each coefficient.
+    Either way the matrix is changed in one journal operation.
+    """
+    buf = Buffer.get(elem)
+    rows, columns = buf.key[1:]
+    if payload.available():
+        np = payload.np
+        r, c = np.mgrid[0:rows, 0:columns]
+        values = np.broadcast_to(np.asarray(function(r, c)), (rows, columns)).ravel()
+        if buf.code not in 'fd':
+            values = np.clip(np.rint(values), *limits[buf.code])
+        values = array.array(buf.code, values.astype(buf.code).tobytes())
+    else:
+        values = [function(r, c) for r in range(rows) for c in range(columns)]
+        if buf.code not in 'fd':
+            values = [int(round(v)) for v in values]
+    journal.splice(elem, 0, len(buf), values)
+
+def setDataAttribute(elem, name, value):
+    """
+    Set an attribute of a data object. If it gives the layout of the data in its
+    buffer (see cvxBuffer), e.g. the rows of a matrix, the buffer is reshaped to
+    suit in the same change, so that undoing the change gives back the data.
+    """
+    buf = Buffer.get(elem)
+    if buf is not None and name in buf.layout and elem.get(name) != value:
+        journal.reshape(elem, {name: value})
+    else:
+        journal.setAttr(elem, name, value)
 
 def updateSubElement(elem, attridx, tag, value):
     """
@@ -813,21 +1085,169 @@ def updateSubElement(elem, attridx, tag, value):
     any incorrect tags we encounter. We don't bother to try and order
     the children or even look at all the tags
     as there could potentially be a be a large number.
+    LUTs and distributions kept in a buffer (see cvxBuffer) are changed there
+    by index, so the children are not looked at at all.
     """
     attr, index = attridx.split(' ')
+    if Buffer.get(elem) is not None:
+        journal.setItem(elem, int(index), value)
+        return
     for child in list(elem):
         if etree.QName(child).localname == tag:
             if child.get(attr) == index:
                 break
         else:
-            elem.remove(child)
+            journal.remove(elem, child)
     else:
     # here without finding the child to update, so add a new one
         child = etree.Element(etree.QName(elem, tag))
         child.set(attr, index)
-        elem.append(child)
-    child.text = value
+        journal.append(elem, child)
+    journal.setText(child, value)
     
+def fillTable(elem, function):
+    """
+    Set every entry of a LUT, or frequency of a distribution, from function(i) of
+    the index i, or from an expression (see tableFunction()). With NumPy, i is an
+    array of all the indices, so the table is done in one call and in one journal
+    operation; otherwise the function is called for each index. Values are
+    rounded and clamped to the type of the table.
+    """
+    if isinstance(function, str):
+        function = tableFunction(function, elem)
+    buf = Buffer.get(elem)
+    count = len(buf)
+    low, high = limits[buf.code]
+    if payload.available():
+        np = payload.np
+        with np.errstate(all='ignore'):
+            values = np.asarray(function(np.arange(count, dtype='float64')), dtype='float64')
+        values = np.nan_to_num(np.broadcast_to(values, (count,)), nan=0.0, posinf=high, neginf=low)
+        values = np.clip(np.rint(values), low, high).astype(buf.code)
+        values = array.array(buf.code, values.tobytes())
+    else:
+        values = [min(max(int(round(function(float(i)))), low), high) for i in range(count)]
+    journal.splice(elem, 0, count, values)
+
+# What may be used in expressions for tableFunction()
+expressionNames = ('x', 'n', 'pi', 'e')
+expressionFunctions = ('sqrt', 'exp', 'log', 'log10', 'log2', 'sin', 'cos', 'tan', 'asin', 'acos',
+                       'atan', 'atan2', 'sinh', 'cosh', 'tanh', 'floor', 'ceil', 'hypot')
+numpyFunctions = {'asin': 'arcsin', 'acos': 'arccos', 'atan': 'arctan', 'atan2': 'arctan2'}
+binaryOperators = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+                   ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv,
+                   ast.Mod: operator.mod, ast.Pow: operator.pow}
+unaryOperators = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+def compileExpression(node, functions):
+    """
+    Return a function of a dictionary of the values of expressionNames that
+    evaluates the node of a parsed expression. Only numbers, those names,
+    arithmetic and calls of the given functions are allowed; anything else
+    raises ValueError. Numbers are made floating point, so that no value can
+    grow without limit.
+    """
+    if isinstance(node, ast.Expression):
+        return compileExpression(node.body, functions)
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        value = float(node.value)
+        return lambda values: value
+    if isinstance(node, ast.Name):
+        if node.id not in expressionNames:
+            raise ValueError("Unknown name '%s'"%node.id)
+        name = node.id
+        return lambda values: values[name]
+    if isinstance(node, ast.BinOp) and type(node.op) in binaryOperators:
+        op = binaryOperators[type(node.op)]
+        left, right = compileExpression(node.left, functions), compileExpression(node.right, functions)
+        return lambda values: op(left(values), right(values))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in unaryOperators:
+        op = unaryOperators[type(node.op)]
+        operand = compileExpression(node.operand, functions)
+        return lambda values: op(operand(values))
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        if node.func.id not in functions:
+            raise ValueError("Unknown function '%s'"%node.func.id)
+        function = functions[node.func.id]
+        args = [compileExpression(arg, functions) for arg in node.args]
+        return lambda values: function(*[arg(values) for arg in args])
+    raise ValueError("%s is not allowed in an expression"%type(node).__name__)
+
+def tableFunction(expression, elem):
+    """
+    Return a function for fillTable() that evaluates the expression in x, the input
+    value of an entry of a LUT or the number of a bin of a distribution, and n, the
+    number of entries. The expression may use numbers, pi, e, the operators
+    + - * / // % **, abs, min, max and the functions named in expressionFunctions,
+    those of NumPy if available, otherwise those of math.
+    The expression is checked rather than given to eval(); raises ValueError if
+    it is not allowed.
+    """
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        raise ValueError("'%s' is not an expression"%expression)
+    if payload.available():
+        np = payload.np
+        functions = dict((name, getattr(np, numpyFunctions.get(name, name))) for name in expressionFunctions)
+        functions.update(abs=np.abs, min=np.minimum, max=np.maximum)
+    else:
+        functions = dict((name, getattr(math, name)) for name in expressionFunctions)
+        functions.update(abs=abs, min=min, max=max)
+    evaluate = compileExpression(tree, functions)
+    offset = lutOffset(elem) if etree.QName(elem).localname == slut else 0
+    values = dict(n=float(len(Buffer.get(elem))), pi=math.pi, e=math.e)
+    def function(i):
+        values['x'] = i - offset
+        return evaluate(values)
+    return function
+
+def lutOffset(elem):
+    """
+    Return the index of the entry of a LUT for the input value 0.
+    The entries of a LUT of signed values start from the lowest, at index 0.
+    """
+    return len(Buffer.get(elem)) // 2 if elem.get(selemType) == 'VX_TYPE_INT16' else 0
+
+def lutIdentity(elem):
+    """
+    Return a function for fillTable() mapping each value of a LUT to itself
+    """
+    offset = lutOffset(elem)
+    return lambda i: i - offset
+
+def lutGamma(elem, gamma):
+    """
+    Return a function for fillTable() applying gamma correction across the range
+    of the values of a LUT
+    """
+    offset = lutOffset(elem)
+    last = max(len(Buffer.get(elem)) - 1, 1)
+    return lambda i: (i / last) ** gamma * last - offset
+
+def importHistogram(elem, samples):
+    """
+    Set the frequencies of a distribution by counting the samples, a sequence of
+    numbers, in its bins, given by its offset, range and bins. Samples outside
+    the range are not counted.
+    """
+    buf = Buffer.get(elem)
+    bins = len(buf)
+    offset = int(elem.get(soffset, '0'))
+    vrange = int(elem.get(srange, str(bins)))
+    if payload.available():
+        np = payload.np
+        samples = np.asarray(samples).ravel()
+        samples = samples[(samples >= offset) & (samples < offset + vrange)]
+        counts = np.bincount(((samples - offset) * bins // vrange).astype('int64'), minlength=bins)
+        values = array.array(buf.code, np.minimum(counts, limits[buf.code][1]).astype(buf.code).tobytes())
+    else:
+        values = [0] * bins
+        for x in samples:
+            if offset <= x < offset + vrange:
+                values[int((x - offset) * bins // vrange)] += 1
+    journal.splice(elem, 0, bins, values)
+
 def makeNewName(tag, elem):
     '''
     Create a new name from the given tag, give the name to the element
@@ -839,17 +1259,38 @@ def makeNewName(tag, elem):
     tag = tag.strip()
     newName = tag if len(tag) else 'object'
     oldName = elem.get(sname, '')
-    trialName = newName
-    seq = 0
-    while trialName in elementNames and elementNames[trialName] != elem:
-        trialName = newName + '_' + str(seq)
-        seq += 1
-    if oldName in elementNames:
-        del elementNames[oldName]
-    elem.set(sname, trialName)
+    if elementNames.get(oldName) is elem and oldName != newName:
+        dropName(oldName)       # the element's own name may be given again
+    if newName in elementNames and elementNames[newName] is not elem:
+        trialName = freeName(newName)
+    else:
+        trialName = newName
+    if oldName in elementNames and oldName != trialName:
+        dropName(oldName)
+    if namedElements.get(elem, trialName) != trialName:
+        releaseElement(elem)    # its name attribute has changed since it was named, e.g. by undo
+    journal.setAttr(elem, sname, trialName)
     elementNames[trialName] = elem
+    namedElements[elem] = trialName
     return trialName
 
+def releaseName(name, elem):
+    '''
+    Remove the name from the dictionary if it belongs to the given element
+    '''
+    if elementNames.get(name) is elem:
+        dropName(name)
+
+def releaseElement(elem):
+    '''
+    Remove the name given to the element from the dictionary. This is the name
+    the element was given by makeNewName(), even if its name attribute has since
+    been changed, e.g. by undo.
+    '''
+    name = namedElements.get(elem)
+    if name is not None:
+        releaseName(name, elem)
+
 def changeObjectName(name, elem, ref):
     """
     Change the object name, updating the Xref and objects on all AGraphs
@@ -886,47 +1327,149 @@ def getNameRefTag(elem):
     ref = elem.get(sreference, name)
     return (name, ref, tag)
 
+class References(object):
+    '''
+    Hands out the references of new objects (see getNewRef()). References are
+    never given twice while a document is open, so those of objects in the tree
+    and in the undo journal, and anything keyed by reference such as graph node
+    names, layouts and property pages, stay valid across edits and rebuilds.
+    They are only made consecutive on request (compactReferences()) and in the
+    copy of the tree that is saved (copyForSaving()).
+    '''
+    next = 0
+
+    @staticmethod
+    def reset(count=0):
+        References.next = count
+
 def fixupReferences(root):
+    '''
+    Make sure that new references will be above all those in the tree, and put
+    the count in the root 'references' attribute. The references themselves are
+    left alone, unless some are not numbers (e.g. written by hand), when they are
+    all renumbered by compactReferences().
+    fixupReferences is called by buildGraphs() in this module.
+    '''
+    try:
+        top = max((int(ref) for ref in root.xpath('//@%s'%sreference)), default=-1)
+    except ValueError:
+        return compactReferences(root)
+    References.next = max(References.next, top + 1, int(root.get(sreferences, '0')))
+    root.attrib[sreferences] = str(References.next)
+    return References.next
+
+def compactReferences(root):
     '''
     Count references and renumber them all, then put the count in the root
     'references' attribute.
     Note that renumbering the etree will completely invalidate xref and hence
     the graphs will need rebuilding.
-    fixupReferences is called by buildGraphs() in this module and should also be
-    called when saving the file (see cvxMain.MainFrame.SaveInFile())
+    This is only done on request; files are saved from a renumbered copy
+    instead (see copyForSaving())
+    '''
+    oldToNew = referenceMap(root)
+    count = len(oldToNew)
+    # Objects that are only in the undo journal keep their references, numbered after
+    # those in the tree. Put the total count in the root attribute 'references'
+    References.reset(Journal.remapReferences(oldToNew, count, (sreference, snode)))
+    root.attrib[sreferences] = str(References.next)
+    # This is not an edit to be undone, but others watching the tree must know.
+    Journal.notify('renumber', root, root.attrib[sreferences])
+    renumberReferences(root, oldToNew)
+    Uses.clear()
+    # Done - mark xml as dirty and return the number of references
+    Xref.setDirty()
+    return count
+
+def referenceMap(root):
+    '''
+    Return a dictionary mapping every reference in the tree to its new
+    value, numbering them consecutively in document order
     '''
     oldToNew = {}
-    count = 0
     for elem in root.iter():                # iterate over everything
         if sreference in elem.attrib:       # Look at every 'reference' attribute
             ref = elem.attrib[sreference]
             if ref not in oldToNew:         # count references we haven't seen before
-                oldToNew[ref] = str(count)  # and map them to a new value
-                count += 1
-    # Now we have our count, and re-numbering map.
-    # First, put the count in the root attribute 'references'
-    root.attrib[sreferences] = str(count)
+                oldToNew[ref] = str(len(oldToNew))  # and map them to a new value
+    return oldToNew
 
-    # Thee replace all the references in the tree:
+def renumberReferences(root, oldToNew):
+    '''
+    Replace all the references in the tree using the map from referenceMap()
+    '''
     for elem in root.iter():
         if sreference in elem.attrib:
             elem.attrib[sreference] = oldToNew[elem.attrib[sreference]]
         elif snode in elem.attrib:          # Graph parameters use attribute 'node'
             elem.attrib[snode] = oldToNew[elem.attrib[snode]]
-    # Done - mark xml as dirty and return the number of references
-    Xref.setDirty()
-    return count
+
+def copyForSaving(root):
+    '''
+    Return a copy of the tree with its references renumbered, as compactReferences()
+    would do, leaving the tree itself (and so Xref and the graphs) alone, and the
+    buffers that bring the data in the copy up to date (see cvxBuffer).
+    The copy belongs to the caller, and may be written out on another thread
+    with writeCopy().
+    '''
+    copy = deepcopy(root)
+    buffers = Buffer.snapshot(root, copy)
+    oldToNew = referenceMap(copy)
+    copy.attrib[sreferences] = str(len(oldToNew))
+    renumberReferences(copy, oldToNew)
+    return copy, buffers
+
+def writeCopy(write, root, buffers, filename):
+    '''
+    Write the buffers into the copy root, then write it to the file with
+    write(root, filename); here on a worker thread with the result of copyForSaving()
+    '''
+    for buf in buffers:
+        buf.write()
+    write(root, filename)
+
+@contextmanager
+def replaceFile(filename):
+    '''
+    Open a temporary file in the same directory as filename, for writing in binary.
+    When the block ends, the file is synced and renamed over the original, so
+    if anything fails the original file is untouched.
+    '''
+    path = os.path.abspath(filename)
+    h, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(h, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            # keep the permissions of the original file
+            os.chmod(tmp, stat.S_IMODE(os.stat(path).st_mode))
+        os.replace(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+
+def writeTree(root, filename):
+    '''
+    Write the tree to the file as it has always been written, with the namespaces
+    declared once on the root and no xml declaration, replacing the file only
+    when it is complete (see replaceFile())
+    The tree must not be changed while this runs; see copyForSaving().
+    '''
+    with replaceFile(filename) as f:
+        etree.ElementTree(root).write(f)
 
 def getNewRef():
     '''
-    Get a new reference value based upon the count stored in root,
-    and update that count. Assumes that references have been fixed-up
-    at some point and the reference count is greater than the value
+    Get a new reference value from References, and update the count stored
+    in root. Assumes that references have been fixed-up at some point
+    (see fixupReferences()) so that the count is greater than the value
     of any existing references.
     '''
-    root = Xref.getroot().elem
-    ref = root.attrib[sreferences]
-    root.attrib[sreferences] = str(int(ref) + 1)
+    ref = str(References.next)
+    References.next += 1
+    Xref.getroot().elem.attrib[sreferences] = str(References.next)
     return ref
 
 def updateAttributes(elem, dict, update=True):
@@ -940,7 +1483,7 @@ def updateAttributes(elem, dict, update=True):
     """
     for k, v, in list(dict.items()):
         if update or k not in elem.attrib:
-            elem.set(k, str(v))
+            journal.setAttr(elem, k, v)
     return elem
 
 def insertDefaultData(elem, kernelInfo, index, localGraph, repl=False):
@@ -985,10 +1528,6 @@ def insertDefaultData(elem, kernelInfo, index, localGraph, repl=False):
     if repl:    # See if we need to make a parent object as well
         # Make an object array of two elements
         ws.GetApp().frame.Error("TODO - Help! Cannot currently create default replicated parameters", True)
-    if isConstant:
-        root.append(newElem)
-    else:
-        elem.append(newElem)
     if tag == sscalar and ptype != 'vx_scalar':
         # Special case for immutable scalars ****
         enumname = TypeDef.enumFromType(ptype, 'VX_TYPE_ENUM')
@@ -996,15 +1535,19 @@ def insertDefaultData(elem, kernelInfo, index, localGraph, repl=False):
     #     newValue = etree.Element(etree.QName(newElem, 'new'))
     #     # TODO: calculate default value from constraints
     #     newElem.append(newValue)
-
-    # Load more stuff to do here for all the different types! TODO
-    if tag == spyramid:
-        changePyramidAttributes(newElem, localGraph, up=False)
     elif tag == stensor:
         for i in range(int(newElem.get(snumber_of_dims))):
             dim = etree.Element(etree.QName(newElem, sdimension))
             updateAttributes(dim, dict(index=i, size=2)) # Just an arbitray legal size for the dimension
             newElem.append(dim)
+    if isConstant:
+        journal.append(root, newElem)
+    else:
+        journal.append(elem, newElem)
+
+    # Load more stuff to do here for all the different types! TODO
+    if tag == spyramid:
+        changePyramidAttributes(newElem, localGraph, up=False)
     
     # Finally put the new data object in the local graph, and update the immutability
     processDatum(newElem, localGraph)
@@ -1024,9 +1567,9 @@ def processDatum(elem, graph, tagref=None):
     See processData...
     """
     name, ref, tag = getNameRefTag(elem)
-    objectsFound = set()
+    objectsFound = []
     if tag in list(dataObjectTags.keys()) + infoObjectTags:
-        objectsFound = {ref}
+        objectsFound = [ref]
         if tagref is None:
             xobj = Xref.get(ref)
             tagref = graph.name if xobj is None or xobj.tagref != sroot else sroot
@@ -1061,11 +1604,12 @@ def processDatum(elem, graph, tagref=None):
 def processData(tree, graph, tagref=None):
     """
     Insert objects recursively into the graph,
-    return a list of graph objects (tagrefs)
+    return a list of graph objects (tagrefs), in document order so that the
+    children of an object, and so the dot source, are the same every time
     """
-    objectsFound = set()
+    objectsFound = []
     for elem in tree.iterchildren():
-        objectsFound |= processDatum(elem, graph, tagref)
+        objectsFound.extend(processDatum(elem, graph, tagref))
     return objectsFound
 
 def processNode(elem, obj, graph):
@@ -1075,7 +1619,7 @@ def processNode(elem, obj, graph):
     Add border mode attribute as "DEFAULT" if not present.
     """
     if obj.get(sbordermode) is None:
-        obj.set(sbordermode, sUNDEFINED)
+        journal.setAttr(obj, sbordermode, sUNDEFINED)
     # add border const child if absent
     borderconst = None
     for child in obj.iterchildren(etree.QName(obj, sborderconst).text):
@@ -1083,7 +1627,7 @@ def processNode(elem, obj, graph):
     if borderconst is None:
         borderconst = etree.Element(etree.QName(obj, sborderconst))
         borderconst.text = "#00000000"
-        obj.append(borderconst)
+        journal.append(obj, borderconst)
     name, ref, tag = getNameRefTag(obj)
     # Get the replicated flag if present
     repl = obj.get(sis_replicated) == strue
@@ -1114,7 +1658,7 @@ def processNode(elem, obj, graph):
         if sreference not in edge.attrib or not Xref.contains(edge.attrib[sreference]):
             # Missing or invalid reference for this parameter
             pref = insertDefaultData(elem, kernelInfo, index, graph, repl_flag)
-            edge.attrib[sreference] = pref
+            journal.setAttr(edge, sreference, pref)
         else:
             pref = edge.attrib[sreference]
         indicesFound[index] = (pref, edge, repl_flag)
@@ -1123,7 +1667,7 @@ def processNode(elem, obj, graph):
             pref = insertDefaultData(elem, kernelInfo, index, graph)
             # Now fix up the xml by adding a parameter
             edge = etree.Element(etree.QName(obj, sparameter), index=str(index), reference=pref, replicate_flag=sfalse)
-            obj.append(edge)
+            journal.append(obj, edge)
             indicesFound[index] = (pref, edge, False)
     for index in indicesFound:
         pref, edge, repl_flag = indicesFound[index]
@@ -1229,52 +1773,100 @@ def processGraphParameter(obj, graph):
     # Remove the edge between the data object and the node
     graph.remove_edge(source, sink)
 
-def processVirtuals(graph):
-    # TODO: Get rid of this function, it is a kludge! we should not draw this stuff in the first place...
-    # If we aren't showing virtual data objects, then we must remove them
-    # Iterate over objects, and for virtual data objects iterate over edges,
-    # insert new edges between the source and the sinks then remove the data objects.
-    # For non-virtual objects without a writer, show them as constants unless
-    # they are graph parameters
-    # Show all graph parameters in the style for graph parameters
-    # This function also removes all immutable parameter objects from the graphs
-    nodes = graph.nodes()
-    for n in nodes:
+# Views. The graphs built by processGraph() are the model: they hold every data
+# object, node and graph parameter. What is drawn is a view of a model, made by
+# projectGraph(), which leaves out immutable data and, unless showVirtuals is set,
+# connected virtual data. Views are cached for both settings of showVirtuals, and
+# forgotten when the model changes (see Xref.setDirty()).
+
+views = {}          # graph name: {showVirtuals: (model, view)}
+
+def hiddenObjects(graph):
+    """
+    Return a set of the data objects of the graph that are not shown, and a list of
+    the bypass edges to show instead, each a tuple of the edge into a hidden object
+    and the edges out of it.
+    Immutable data is never shown. Unless showVirtuals is set, virtual data objects
+    that are not parents or children and have inputs and outputs are shown as edges
+    from their writer to their readers.
+    """
+    hidden = set()
+    bypasses = []
+    for n in graph.nodes_iter():
         xobj = Xref.get(n)
         if xobj.tag in dataObjectTags:
-            if xobj.isVirtual() and not showVirtuals and not (xobj.isParent() or xobj.isChild() or xobj.isImmutable()):
+            if xobj.isImmutable():
+                hidden.add(n)
+            elif xobj.isVirtual() and not showVirtuals and not (xobj.isParent() or xobj.isChild()):
                 ins = graph.in_edges(n)
                 outs = graph.out_edges(n)
-                preds = graph.in_neighbors(n)
-                succs = graph.out_neighbors(n)
                 if len(ins) and len(outs):
-                    # Only remove the object if it has inputs and outputs
-                    # And only process the first input as it should only have one
-                    for i in range(len(outs)):
-                        # get arrowhead, font etc from previous edges
-                        graph.add_edge(preds[0], succs[i], taillabel=ins[0].attr['taillabel'], headlabel=outs[i].attr['headlabel'],
-                            arrowhead=ins[0].attr['arrowhead'], font=ins[0].attr['font'], fontcolor=ins[0].attr['fontcolor'],
-                            fontsize=ins[0].attr['fontsize'])
-                    # We keep the object in Xref, but remove it from the graph
-                    graph.remove_node(n)
-            elif xobj.isImmutable():
-                graph.remove_node(n)
-            else:
-                # non-virtual or visible mutable data object
-                updateObj(n, Xref)
+                    # Only process the first input as it should only have one
+                    hidden.add(n)
+                    bypasses.append((ins[0], outs))
+    return hidden, bypasses
+
+def projectGraph(graph):
+    """
+    Return a new dot graph with the objects and edges of the model graph that are
+    shown; hidden objects are never added to it.
+    Shown data objects of graphs are styled now that their readers and writers are
+    known; those of the globals graph keep the style processDatum() gave them.
+    """
+    view = pgv.AGraph(name=graph.name, directed=True, strict=False, concentrate=False)
+    view.graph_attr.update(graph.graph_attr)
+    view.node_attr.update(graph.node_attr)
+    view.edge_attr.update(graph.edge_attr)
+    hidden, bypasses = hiddenObjects(graph)
+    restyle = graph.name != sroot
+    for n in graph.nodes_iter():
+        if n not in hidden:
+            view.add_node(n, **dict(n.attr))
+            if restyle and Xref.get(n).tag in dataObjectTags:
+                updateObj(view.get_node(n), Xref)
+    for e in graph.edges_iter():
+        if e[0] not in hidden and e[1] not in hidden:
+            view.add_edge(e[0], e[1], **dict(e.attr))
+    for into, outs in bypasses:
+        # get arrowhead, font etc from the edges replaced
+        for out in outs:
+            view.add_edge(into[0], out[1], taillabel=into.attr['taillabel'], headlabel=out.attr['headlabel'],
+                arrowhead=into.attr['arrowhead'], font=into.attr['font'], fontcolor=into.attr['fontcolor'],
+                fontsize=into.attr['fontsize'])
+    return view
+
+def viewOf(graph):
+    """
+    Return the view of the model graph for the current setting of showVirtuals
+    """
+    cached = views.setdefault(graph.name, {})
+    model, view = cached.get(showVirtuals, (None, None))
+    if model is not graph:
+        view = projectGraph(graph)
+        cached[showVirtuals] = (graph, view)
+    return view
+
+def forgetViews(name):
+    views.pop(name, None)
 
 def processGraph(root, elemGraph):
     elem, graph = elemGraph
     # First, process everything that is not a node or a graph parameter
     processData(elem, graph, graph.name)
+    processGraphNodes(elemGraph)
+
+def processGraphNodes(elemGraph):
+    """
+    Process the nodes and graph parameters of a graph whose data has already
+    been processed. Nothing is hidden here; see projectGraph().
+    """
+    elem, graph = elemGraph
     # Now, process nodes
     for obj in elem.iter(etree.QName(elem, snode).text):
         processNode(elem, obj, graph)
     # Process graph parameters
     for obj in elem.iterchildren(etree.QName(elem, sparameter).text):
         processGraphParameter(obj, graph)
-    # hide virtual data
-    processVirtuals(graph)
 
 def newDotGraph(name=globalsName, ref=sroot, elem=None):
     """
@@ -1300,13 +1892,12 @@ def buildGraphs(tree):
     Clears the xml dirty flag
     Returns a tuple of xref and dictionary of graphs where each entry is a tuple of xref, element and graph
     """
-    elementNames.clear()        # reset the name dictionary
-    #print("Buildgraphs ", elementNames)
-    fixupReferences(tree)       # re-number all the references to make them consecutive
+    clearNames()                # reset the name dictionary
     rg = newDotGraph()
     rg.edge_attr.update(dir='both', arrowtail='none')
     graphDict = {globalsName: (tree, rg)}
     Xref.setroot(tree, globalsName, rg)
+    fixupReferences(tree)       # make sure new references will not clash with existing ones
     # First, process everything that is not a graph
     processData(tree, rg, sroot)
     # Then process graphs
@@ -1317,18 +1908,243 @@ def buildGraphs(tree):
             g.edge_attr.update(dir='both', arrowtail='none')
             graphDict[name] = (elem, g)
         processGraph(tree, graphDict[name])
-    # TODO:
-    # Massive Kludge which needs fixing. Because we have drawn the graphs 'on the fly' rather than
-    # after fully assimilating all the data, we have drawn stuff which should not be there.
-    # Here we remove all the immutable data from all graphs...
-    for xref, xobj in list(Xref.xref.items()):
-        if xobj.isImmutable():
-            for g in list(xobj.graphs.values()):
-                if g.has_node(xref):
-                    g.remove_node(xref)
     Xref.clearDirty()
     return graphDict
 
+def parseGraphs(filename):
+    """
+    Read the xml file and build the graphs while it is being parsed, as buildGraphs()
+    would do for the whole tree. References are re-numbered in document order as
+    they are read, in the same way as compactReferences().
+    Only the root, graphs, nodes, parameters and data objects are seen here; their
+    contents (pixels, points, tensor data and so on) stay in the tree for saving
+    but are never visited.
+    Data objects are processed as they are completed; because nodes may use data
+    defined later in the file, nodes and graph parameters are processed at the end.
+    Returns a tuple of the root element and the dictionary of graphs
+    """
+    clearNames()
+    tags = ['{*}openvx', '{*}' + sgraph, '{*}' + snode, '{*}' + sparameter]
+    tags.extend('{*}' + tag for tag in list(dataObjectTags.keys()) + infoObjectTags)
+    oldToNew = {}
+    def renumber(ref):
+        if ref not in oldToNew:
+            oldToNew[ref] = str(len(oldToNew))
+        return oldToNew[ref]
+    root = None
+    graphDict = {}
+    graphs = {}                                 # graphs by reference
+    for event, elem in etree.iterparse(filename, events=('start', 'end'), tag=tags):
+        if event == 'start':
+            if sreference in elem.attrib:
+                elem.attrib[sreference] = renumber(elem.attrib[sreference])
+            elif snode in elem.attrib:          # Graph parameters use attribute 'node'
+                elem.attrib[snode] = renumber(elem.attrib[snode])
+            if root is None:
+                root = elem
+                rg = newDotGraph()
+                rg.edge_attr.update(dir='both', arrowtail='none')
+                graphDict[globalsName] = (root, rg)
+                Xref.setroot(root, globalsName, rg)
+            elif etree.QName(elem).localname == sgraph and elem.getparent() is root:
+                name, ref, tag = getNameRefTag(elem)
+                g = newDotGraph(name, ref, elem)
+                g.edge_attr.update(dir='both', arrowtail='none')
+                graphDict[name] = (elem, g)
+                graphs[ref] = g
+        elif elem is not root:
+            p = elem.getparent()
+            if p is root:
+                processDatum(elem, rg, sroot)
+            elif etree.QName(p).localname == sgraph and p.getparent() is root:
+                processDatum(elem, graphs[p.get(sreference)], p.get(sreference))
+    root.attrib[sreferences] = str(len(oldToNew))
+    References.reset(len(oldToNew))
+    for name, elemGraph in list(graphDict.items()):
+        if name != globalsName:
+            processGraphNodes(elemGraph)
+    Xref.clearDirty()
+    return root, graphDict
+
+def graphState(graph):
+    """
+    Return the graph as plain data that can be pickled, for restoreGraph(). The nodes
+    and edges are listed in the order they were added, which the dot source keeps.
+    """
+    return dict(name=graph.name, graph=dict(graph.graph_attr), node=dict(graph.node_attr),
+                edge=dict(graph.edge_attr),
+                nodes=[(str(n), dict(n.attr)) for n in graph.nodes_iter()],
+                edges=[(str(e[0]), str(e[1]), e.name, dict(e.attr)) for e in graph.edges_iter()])
+
+def restoreGraph(state):
+    """
+    Return a graph made from the result of graphState(). It is made by adding the
+    nodes and edges in their original order, rather than by reading the dot source,
+    which would order them as they first appear in the source. The dot source is
+    then the same as that of the original graph, so its layout is found in the cache.
+    """
+    graph = pgv.AGraph(name=state['name'], directed=True, strict=False, concentrate=False)
+    graph.graph_attr.update(state['graph'])
+    graph.node_attr.update(state['node'])
+    graph.edge_attr.update(state['edge'])
+    for n, attr in state['nodes']:
+        graph.add_node(n, **attr)
+    for u, v, key, attr in state['edges']:
+        graph.add_edge(u, v, key, **attr)
+    return graph
+
+def modelState(root, graphDict):
+    """
+    Return the tree, Xref, the graphs and the element names as plain data that can
+    be pickled, for restoreModel(). Elements are given by their position in root.iter().
+    """
+    index = dict((elem, i) for i, elem in enumerate(root.iter()))
+    entries = []
+    for ref, xobj in Xref.items():
+        entries.append((ref, index.get(xobj.elem), xobj.tagref, xobj.name, list(xobj.graphs.keys()),
+                        xobj.direction, xobj.repl, xobj._immutable, xobj.readers, xobj.writer, xobj.tag,
+                        None if xobj.kdef is None else xobj.kdef.kname, xobj.subtype, xobj.datasize,
+                        xobj._child, xobj._parent))
+    return dict(xml=etree.tostring(root),
+                graphs=[(name, index[elem], graphState(graph)) for name, (elem, graph) in list(graphDict.items())],
+                xref=entries,
+                names=[(name, index.get(elem)) for name, elem in list(elementNames.items())])
+
+def restoreModel(state):
+    """
+    Rebuild the tree, Xref and the graphs from the result of modelState(), without
+    processing the tree. Returns a tuple of the root element and the dictionary of graphs,
+    as parseGraphs() does.
+    """
+    root = etree.fromstring(state['xml'])
+    elems = list(root.iter())
+    graphDict = {}
+    byRef = {}
+    for name, i, graphData in state['graphs']:
+        graph = restoreGraph(graphData)
+        graphDict[name] = (elems[i], graph)
+        byRef[graph.name] = graph
+    Xref.setroot(root, globalsName, byRef[sroot])
+    for (ref, i, tagref, name, graphs, direction, repl, immutable, readers, writer, tag,
+         kname, subtype, datasize, ischild, isparent) in state['xref']:
+        xobj = Xref(None if i is None else elems[i], tagref, name, byRef[graphs[0]],
+                    direction=direction, repl=repl, immutable=immutable, tag=tag,
+                    kdef=None if kname is None else KernelDef.get(kname), subtype=subtype,
+                    datasize=datasize, isparent=isparent, ischild=ischild)
+        xobj.readers = set(readers)
+        xobj.writer = writer
+        for g in graphs:
+            xobj.graphs[g] = byRef[g]
+            Xref.members.setdefault(g, set()).add(ref)
+        Xref.xref[ref] = xobj
+    clearNames()
+    for name, i in state['names']:
+        if i is not None:
+            elementNames[name] = elems[i]
+            namedElements[elems[i]] = name
+    References.reset(int(root.get(sreferences, '0')))
+    Xref.clearDirty()
+    return root, graphDict
+
+# Incremental changes. Edits record what they have changed with touchElement()
+# and updateGraphs() then patches Xref and just the affected graphs.
+
+def touchElement(elem):
+    """
+    Record a change to elem or its descendants. If elem lives in a graph, only that
+    graph is re-processed; if it is (part of) a global data object then that is
+    re-processed in the root graph, along with all the graphs it appears in.
+    Anything else, including an element not in the tree, requires a full rebuild.
+    Call this before removing an element from the tree.
+    """
+    top = elem
+    p = elem.getparent()
+    while p is not None and p.getparent() is not None and etree.QName(p).localname != sgraph:
+        top = p
+        p = p.getparent()
+    if p is None or (p.getparent() is None and p is not Xref.getroot().elem):
+        Xref.setDirty()
+    elif etree.QName(p).localname == sgraph:
+        Xref.changeGraph(p.get(sreference))
+    elif etree.QName(top).localname == sgraph:
+        Xref.changeGraph(top.get(sreference))
+    elif sreference in top.attrib:
+        Xref.removeGlobal(top.get(sreference))
+        Xref.addGlobal(top)
+    else:
+        Xref.setDirty()
+
+def unloadGraph(graph):
+    """
+    Empty the graph ready for processGraph(). Objects that live only in this graph
+    (nodes, parameters and virtual data) are forgotten, global objects are detached
+    from it and the edges between the graph and globals on the root graph are removed.
+    """
+    gref = graph.name
+    prefix = gref + ','
+    for ref in Xref.members.pop(gref, set()):
+        xobj = Xref.get(ref)
+        if xobj is None:
+            continue
+        xobj.graphs.pop(gref, None)
+        if len(xobj.graphs) == 0:
+            releaseElement(xobj.elem)
+            del Xref.xref[ref]
+        else:
+            xobj.readers = {r for r in xobj.readers if not r.startswith(prefix)}
+            if xobj.writer is not None and xobj.writer.startswith(prefix):
+                xobj.writer = None
+    rg = Xref.getroot().graph()
+    if rg.has_node(gref):
+        rg.remove_edges_from(rg.in_edges(gref) + rg.out_edges(gref))
+    graph.remove_nodes_from(graph.nodes())
+
+def unloadGlobal(ref, rg):
+    """
+    Remove a global data object from the root graph and from Xref
+    """
+    if rg.has_node(ref):
+        rg.remove_node(ref)
+    xobj = Xref.get(ref)
+    if xobj is not None:
+        releaseElement(xobj.elem)
+        Xref.remove(ref)
+
+def updateGraphs(graphDict):
+    """
+    Apply the changes recorded by touchElement() to Xref and the graphs in graphDict.
+    Only the graphs affected are re-processed and marked for redrawing.
+    Returns False if the changes can't be applied incrementally, in which case the
+    xml is marked dirty and the caller must use buildGraphs().
+    """
+    if Xref.isDirty():
+        return False
+    root = Xref.getroot().elem
+    rg = Xref.getroot().graph()
+    byRef = {}
+    for elem, graph in graphDict.values():
+        byRef[graph.name] = (elem, graph)
+    changed = Xref.changedGraphs - {sroot}
+    for gref in changed:
+        if gref not in byRef or byRef[gref][0].getparent() is not root:
+            Xref.setDirty()
+            return False
+    for gref in changed:
+        unloadGraph(byRef[gref][1])
+    for ref in Xref.removedGlobals:
+        unloadGlobal(ref, rg)
+    for elem in Xref.addedGlobals:
+        xobj = Xref.get(elem.get(sreference))
+        if elem.getparent() is root and (xobj is None or sroot not in xobj.graphs):
+            processDatum(elem, rg, sroot)
+    for gref in changed:
+        elem, graph = byRef[gref]
+        processGraph(root, (elem, graph))
+        Xref.setDirty(graph)
+    Xref.setDirty(sroot)
+    Xref.clearChanges()
+    return True
+
 # Functions that insert new items in the graph
 def insertGraph():
     """
@@ -1338,8 +2154,8 @@ def insertGraph():
     ref = getNewRef()
     elem = etree.Element(etree.QName(root, sgraph), reference=ref)
     name = makeNewName(sgraph, elem)
-    root.append(elem)
-    Xref.setDirty()
+    journal.append(root, elem)
+    Xref.setDirty(sroot)
     return name, (elem, newDotGraph(name, ref, elem))
 
 def insertNode(tree, graph, kernelName):
@@ -1357,11 +2173,9 @@ def insertNode(tree, graph, kernelName):
         # put the kernel in the node
         newNode.append(newKernel)
         # put the node in the graph
-        tree.append(newNode)
+        journal.append(tree, newNode)
         # process the node
         processNode(tree, newNode, graph)
-        # make sure parameters are shown correctly
-        processVirtuals(graph)
         # Set the dirty flag on the graph & the root graph
         Xref.setDirty(graph)
         Xref.setDirty(sroot)
@@ -1371,17 +2185,16 @@ def insertGraphParameter(tree, graph, obj, nodeobj):
     Insert a new graph parameter and make obj non-virtual.
     obj and nodeobj are dnodes, obj being a data object and nodeobj being an openvx node.
     Returns True on success
-    Sets isDirty if it was not possible to fix-up the graph and Xref and the graphs need rebuilding
-    (For now weset it - TODO: fix this!)
+    The change is recorded for updateGraphs()
     """
     # count the existing graph parameters to get the next index:
     newIndex = 0
     for p in tree.iterchildren(etree.QName(tree, sparameter).text):
         newIndex += 1
     replant(Xref.get(obj).elem, Xref.getroot().elem)  # Make object non-virtual
-    tree.append(etree.Element(etree.QName(tree, sparameter), node=nodeobj,
+    journal.append(tree, etree.Element(etree.QName(tree, sparameter), node=nodeobj,
                 parameter=paramWithRef(nodeobj, obj), index=str(newIndex)))
-    Xref.setDirty()
+    Xref.changeGraph(tree.get(sreference))
     return True
 
 def paramWithRef(noderef, objref):
@@ -1390,8 +2203,8 @@ def paramWithRef(noderef, objref):
     noderef that references the given objref
     """
     nodeElem = Xref.get(noderef).elem
-    for p in nodeElem.iterchildren(etree.QName(nodeElem, sparameter).text):
-        if p.attrib[sreference] == objref:
+    for p in Uses.nodeParameters(objref):
+        if p.getparent() is nodeElem:
             return p.attrib[sindex]
     return ""
 
@@ -1422,8 +2235,8 @@ def insertImage(tree, graph, df=sU008, width=32, height=32):
     updateAttributes(image, dict(reference=ref, width=width,
                                  height=height, format=df))
     Xref.update(ref, image, tree.get(sreference), makeNewName(simage, image), graph, tag=simage)
-    tree.append(image)
-    Xref.setDirty()
+    journal.append(tree, image)
+    touchElement(image)
     return image
     
 def changeTensorSize(elem, graph):
@@ -1433,16 +2246,16 @@ def changeTensorSize(elem, graph):
     length = int(elem.get(snumber_of_dims))
     i = 0
     # remove excess children
-    for dim in elem.iterchildren(etree.QName(elem, sdimension).text):
+    for dim in list(elem.iterchildren(etree.QName(elem, sdimension).text)):
         if i == length:
-            elem.remove(dim)
+            journal.remove(elem, dim)
         else:
             i += 1
     # insert missing children
     while i < length:
         dim = etree.Element(etree.QName(elem, sdimension))
         updateAttributes(dim, dict(index=i, size=1))
-        elem.append(dim)
+        journal.append(elem, dim)
         i += 1
     # Now do we have to check views and object arrays?
     # TODO
@@ -1456,11 +2269,11 @@ def insertTensor(tree, graph, dims=[2, 2, 2], dtype='VX_TYPE_UINT8', fpp="0"):
     updateAttributes(tensor, dict(reference=ref, number_of_dims=len(dims),
                                   data_type=dtype, fixed_point_position=fpp))
     Xref.update(ref, tensor, tree.get(sreference), makeNewName(stensor, tensor), graph, tag=stensor)        
-    tree.append(tensor)
     for i in range(len(dims)):
         tensor.append(updateAttributes(etree.Element(etree.QName(tensor, sdimension)), 
                                        dict(index=i, size=dims[i])))
-    Xref.setDirty()
+    journal.append(tree, tensor)
+    touchElement(tensor)
     return tensor
     
 def insertObject(tree, graph, tag, parentref=None, num=3):
@@ -1484,8 +2297,8 @@ def insertObject(tree, graph, tag, parentref=None, num=3):
         Xref.update(ref, elem,
                     tree.get(sreference) if parentref is None else parentref,
                     makeNewName(tag, elem), graph, tag=tag)        
-        tree.append(elem)
-        Xref.setDirty()
+        journal.append(tree, elem)
+        touchElement(elem)
     return elem
 
 # Functions that remove items from the graph
@@ -1493,8 +2306,7 @@ def removeGraphParameter(tree, graph, node):
     """
     Remove a graph parameter and renumber graph parameters if necessary.
     Returns True 
-    Sets isDirty if the graphs need rebuilding.
-    TODO: fixup things so the graph doesn't need rebuilding!
+    The change is recorded for updateGraphs()
     """
     # Name of node is comma-separated graph reference and index
     pIndex = int(node.split(',')[1]) # get index
@@ -1502,15 +2314,15 @@ def removeGraphParameter(tree, graph, node):
     for p in tree.iterchildren(paramtag):
         if int(p.attrib[sindex]) == pIndex:
             # We have found it, remove it.
-            tree.remove(p)
+            journal.remove(tree, p)
             break
     pIndex = 0
     for p in tree.iterchildren(paramtag):
         # These are elements in the same graph with tag 'parameter'
         # Parameter index may not match our count; We must renumber
-        p.attrib[sindex] = str(pIndex)
+        journal.setAttr(p, sindex, pIndex)
         pIndex += 1
-    Xref.setDirty()
+    Xref.changeGraph(tree.get(sreference))
     return True
 
 # Functions that merge objects in the graph
@@ -1571,8 +2383,7 @@ def mergeToVirtual(tree, graph, source, sink, writer, nomatch):
     - It has a writer, and
     - It has no parent.
     
-    NOTE: currently we don't fix up anything but the xml, so graphs need rebuilding.
-    TODO: fix up graphs and xref so stuff doesn't need rebuilding (possible performance enhancement)
+    NOTE: currently we only fix up the xml, and record the change for updateGraphs()
     """
     sourceElem = Xref.get(source).elem
     sinkElem = Xref.get(sink).elem
@@ -1604,13 +2415,15 @@ def mergeToVirtual(tree, graph, source, sink, writer, nomatch):
     # Simplify subsequent processing by making sure it is the source.
     if hasParent(sinkElem):
         source, sourceElem, sink, sinkElem = sink, sinkElem, source, sourceElem
-    
+    touchElement(sourceElem)
+    touchElement(sinkElem)
+
     # Make sure the survivor (source) gets the kids
     # Note that this only applies to roi, channel and view as we
     # don't merge object arrays, delays or pyramids with this mechanism
-    for child in sinkElem.iterchildren():
+    for child in list(sinkElem.iterchildren()):
         if etree.QName(child).localname in [sroi, splane, sview]:
-            sourceElem.append(child)
+            journal.append(sourceElem, child)
 
     # Now add attributes to sourceElem that are only in sinkElem:
     #for attr, val in sinkElem.attrib.items():
@@ -1620,9 +2433,8 @@ def mergeToVirtual(tree, graph, source, sink, writer, nomatch):
     # Now we have to find all references to sink and replace them with references to source
     # Notice that we do this for only one level, so references to children of sink will
     # remain and when the tree is rebuilt virtual objects will be generated as necessary
-    for elem in sourceElem.getroottree().getiterator():
-        if elem.get(sreference) == sink:
-            elem.set(sreference, source)
+    for p in Uses.nodeParameters(sink):
+        journal.setAttr(p, sreference, source)
 
     # We can now remove the sink from the xml tree
     xmlRemove(sinkElem)
@@ -1640,7 +2452,6 @@ def mergeToVirtual(tree, graph, source, sink, writer, nomatch):
         replant(sourceElem, tree.getparent())
 
     # All done.
-    Xref.setDirty()
     return True
 
 def convertReferenceTo(refObj, exemplar):
@@ -1653,8 +2464,8 @@ def convertReferenceTo(refObj, exemplar):
     egElem = Xref.get(exemplar).elem
     for k, v in list(egElem.attrib.items()):
         if k not in {sreference}:
-            refElem.attrib[k] = v
-    refElem.tag = egElem.tag
+            journal.setAttr(refElem, k, v)
+    journal.setTag(refElem, egElem.tag)
     for k, v in list(exemplar.attr.items()):
         refObj.attr[k] = v
     Xref.update(refRef, tag=etree.QName(refElem).localname)
@@ -1666,7 +2477,7 @@ def xmlRemove(elem):
     """
     p = elem.getparent()
     if p is not None:
-        p.remove(elem)
+        journal.remove(p, elem)
         return True
     return wx.GetApp().frame.Error("Element %s has no parent"%elem, True)
 
@@ -1744,6 +2555,7 @@ def makeCompatibleData(elem):
         pass
     else:
         # 'normal' object 
+        Buffer.sync(elem)
         newElem = etree.fromstring(etree.tostring(elem)) # dumb but effective for now
     newElem.attrib[sreference] = getNewRef()
     makeNewName(elem.attrib[sname], newElem)
@@ -1762,8 +2574,10 @@ def replant(elem, tree):
         o = p
         p = p.getparent()
     if p is not None:
-        p.remove(o)
-    tree.append(o)
+        touchElement(o)
+        journal.remove(p, o)
+    journal.append(tree, o)
+    touchElement(o)
 
 def getOptionals(dnode):
     """
@@ -1824,33 +2638,37 @@ def makeObjectArray(elem, graph, num, tag=sobject_array):
     This function also can create a delay when passed a different tag
     """
     p = elem.getparent()
+    touchElement(elem)
     objarray = etree.Element(etree.QName(p, tag))
     ref = getNewRef()
     objarray.set(sreference, ref)
     Xref.update(ref, objarray, p.get(sreference), makeNewName(tag, objarray), graph, tag=tag)
     objarray.set(scount, str(num))
-    p.append(objarray)
-    p.remove(elem)
-    objarray.append(elem)
+    journal.append(p, objarray)
+    journal.append(objarray, elem)
     Xref.update(elem.get(sreference), tagref=ref)
+    touchElement(objarray)
     return changeDelayOrArrayCount(objarray, graph)
 
 def changeDelayOrArrayCount(elem, graph):
     """
     Ensures that the number of elements in an object array or delay matches
     the count given in the tag 'count' of the parent elem
-    Sets the dirty flag if any were added or removed
+    Records the change for updateGraphs() if any were added or removed
     If the first child of an object array is connected to a replicated parameter
     of a node, then the number of items is propageted to all other parameters of
     that node.
     """
     count = int(elem.get(scount))
     oldcount = len(elem)
+    if count != oldcount:
+        touchElement(elem)
     index = 0
-    for child in elem:
+    for child in list(elem):
         if index == count:
+            releaseName(child.get(sname), child)
             Xref.remove(child.get(sreference))
-            elem.remove(child)
+            journal.remove(elem, child)
             # TODO: remove all other references to this object
             # Will have to patch up connections... Currently
             # we are just relying upon a re-build to create new virtual
@@ -1863,7 +2681,6 @@ def changeDelayOrArrayCount(elem, graph):
         index += 1
     if count != oldcount:
         # Now we must check all nodes connected to this element
-        Xref.setDirty()
         changeReplicationCount(elem[0], count)
     return elem
 
@@ -1888,11 +2705,11 @@ def changeReplicationCount(elem, count):
                 ptag = etree.QName(parent).localname
                 if ptag == sobject_array:
                     if parent.get(scount) != count:
-                        parent.set(scount, count)
+                        journal.setAttr(parent, scount, count)
                         changeDelayOrArrayCount(parent, graph)
                 elif ptag == spyramid:
                     if parent.get(slevels) != count:
-                        parent.set(slevels, count)
+                        journal.setAttr(parent, slevels, count)
                         changePyramidAttributes(parent, graph)
                 else:
                     wx.GetApp().frame.Error("Found illegal replicated parameter for node '%s' index %s"%(
@@ -1902,14 +2719,14 @@ def insertCopy(tree, graph , elem):
     """
     Insert a copy of the element, with a new name and reference
     """
-    Xref.setDirty()
     tag = etree.QName(elem).localname
     newElem = etree.Element(etree.QName(elem, tag))
     ref = getNewRef()
     newElem.set(sreference, ref)
     Xref.update(ref, newElem, tree.get(sreference), makeNewName(elem.get(sname), newElem), graph, tag=tag)
     updateAttributes(newElem, elem.attrib, False)   # Add only missing attributes
-    tree.append(newElem)
+    journal.append(tree, newElem)
+    touchElement(newElem)
     if tag in {sobject_array, sdelay}:
         insertCopy(newElem, graph, elem[0])
         changeDelayOrArrayCount(newElem, graph)
@@ -1926,7 +2743,7 @@ def copyAttributes(dest, graph, source):
     tag = etree.QName(source).localname
     for k, v in list(source.items()):
         if k not in {sreference, sname}:
-            dest.set(k, v)
+            journal.setAttr(dest, k, v)
     if tag in {sobject_array, sdelay}:
         copyAttributes(dest[0], graph, source[0])
         changeDelayOrArrayCount(dest, graph)
@@ -1965,6 +2782,7 @@ def makePyramid(elem, graph, levels=4, scale=0.5):
     first child of the new pyramid
     """
     p = elem.getparent()
+    touchElement(elem)
     minDim = round(levels / scale)
     width = max(int(elem.get(swidth, str(minDim))), minDim)
     height = max(int(elem.get(sheight, str(minDim))), minDim)
@@ -1975,11 +2793,10 @@ def makePyramid(elem, graph, levels=4, scale=0.5):
     pref = getNewRef()
     updateAttributes(pyramid, dict(reference=pref, levels=levels, scale=scale,
                                    width=width, height=height, format=df))
-    Xref.update(pref, elem, p.get(sreference), makeNewName(spyramid, pyramid), graph, tag=spyramid)
-    p.append(pyramid)
-    p.remove(elem)
+    Xref.update(pref, pyramid, p.get(sreference), makeNewName(spyramid, pyramid), graph, tag=spyramid)
+    journal.append(p, pyramid)
     Xref.update(elem.get(sreference), tagref=pref)
-    pyramid.append(elem)
+    journal.append(pyramid, elem)
     for i in range(levels - 1):
         width = int(math.ceil(width * scale))
         height = int(math.ceil(height * scale))
@@ -1988,8 +2805,8 @@ def makePyramid(elem, graph, levels=4, scale=0.5):
         updateAttributes(newElem, dict(reference=ref, width=width,
                                        height=height, format=df))
         Xref.update(ref, newElem, pref, makeNewName(name, newElem), graph, tag=simage)
-        pyramid.append(newElem)
-    Xref.setDirty()
+        journal.append(pyramid, newElem)
+    touchElement(pyramid)
     return pyramid
     
 def changePyramidAttributes(pyramid, graph, up=True):
@@ -1997,8 +2814,8 @@ def changePyramidAttributes(pyramid, graph, up=True):
     This function makes sure that all elements of a pyramid
     have the correct width, height and format to conform with
     the parent, and also is able to change the number of levels
-    in the pyramid. Sets the dirty flag if the number of images
-    was changed, returns the pyramid
+    in the pyramid. Records the change for updateGraphs() if the number
+    of images was changed, returns the pyramid
     If the first child of a pyramid is connected to a replicated parameter
     of a node, then the number of items is propageted to all other parameters of
     that node.
@@ -2013,9 +2830,12 @@ def changePyramidAttributes(pyramid, graph, up=True):
     scale = float(pyramid.get(sscale))
     count = 0
     name = pyramid[0].get(sname) if oldlevels > 0 else simage
-    for image in pyramid:
+    if oldlevels != levels:
+        touchElement(pyramid)
+    for image in list(pyramid):
         if count == levels:
-            pyramid.remove(image)
+            releaseName(image.get(sname), image)
+            journal.remove(pyramid, image)
             Xref.remove(image.get(sreference))
         else:
             updateAttributes(image, dict(width=width, height=height, format=df))
@@ -2028,12 +2848,11 @@ def changePyramidAttributes(pyramid, graph, up=True):
         updateAttributes(newElem, dict(reference=ref, width=width,
                                        height=height, format=df))
         Xref.update(ref, newElem, pref, makeNewName(name, newElem), graph, tag=simage)
-        pyramid.append(newElem)
+        journal.append(pyramid, newElem)
         width = int(math.ceil(width * scale))
         height = int(math.ceil(height * scale))
         count += 1
     if oldlevels != levels:
-        Xref.setDirty()
         changeReplicationCount(pyramid[0], levels)
     # in case parent is an object array or delay:
     if up and etree.QName(pyramid.getparent()).localname in {sobject_array, sdelay}:
@@ -2079,8 +2898,7 @@ def addOptional(tree, graph, dnode, kps, index):
     The added data object will be virtual, and because it
     is an optional, cannot be immutable.
     Returns True
-    Only the xml is manipulated, and we set isDirty
-    TODO: patch up the graph, Xref, and don't set isDirty
+    Only the xml is manipulated, and the change is recorded for updateGraphs()
     """
     node = Xref.get(dnode).elem
     ref = getNewRef()
@@ -2106,14 +2924,14 @@ def addOptional(tree, graph, dnode, kps, index):
     newElem.attrib[sname] = makeNewName(kps[index].pname, newElem)   # base the name on the kernel parameter name
     for attribute in dataObjectTags[tag]:
         newElem.attrib[attribute] = dataObjectTags[tag][attribute]
-    tree.append(newElem)
+    journal.append(tree, newElem)
     # Now insert a new parameter in the node object
     newParam = etree.Element(etree.QName(node, sparameter))
     newParam.attrib[sindex] = str(index)
     newParam.attrib[sreference] = ref
-    node.append(newParam)
+    journal.append(node, newParam)
     # all done
-    Xref.setDirty()
+    touchElement(node)
     return True
 
 def getConnected(nelem):
@@ -2135,13 +2953,12 @@ def connectDataNode(obj, dnode, kpInfo, index):
     index is the number of the parameter
     kpInfo is the kernel parameter information for that index
     Returns True
-    Set isDirty if a rebuild is necessary
-    TODO: fix up the xref and graph
+    The change is recorded for updateGraphs()
     """
     node = Xref.get(dnode).elem
     newParam = etree.Element(etree.QName(node, sparameter), index=str(index), reference=str(obj), replicate_flag=sfalse)
-    node.append(newParam)
-    Xref.setDirty()
+    journal.append(node, newParam)
+    touchElement(node)
     return True
 
 def getVxType(obj):
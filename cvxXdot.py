@@ -0,0 +1,198 @@
+'''
+This module draws graphs from the xdot drawing operations that dot gives
+in its json output, rather than from a bitmap. The operations are parsed
+once per layout into primitives in bitmap coordinates, and only the objects
+that are visible are drawn, with a wx.GraphicsContext, at any zoom.
+'''
+import wx
+from cvxSpatial import GridIndex
+
+# The attributes holding drawing operations, in the order they are drawn
+nodeDrawAttrs = ['_draw_', '_ldraw_']
+edgeDrawAttrs = ['_draw_', '_hdraw_', '_tdraw_', '_ldraw_', '_hldraw_', '_tldraw_']
+
+# font families for graphviz font names
+fontFamilies = {
+    'times': wx.FONTFAMILY_ROMAN,
+    'helvetica': wx.FONTFAMILY_SWISS,
+    'arial': wx.FONTFAMILY_SWISS,
+    'courier': wx.FONTFAMILY_TELETYPE
+    }
+
+class Drawing(object):
+    """
+    The drawing of a laid-out graph.
+    Each object drawn (the graph itself, a node or an edge) becomes a shape,
+    which is a list of primitives; a primitive is a tuple of the state
+    (pen colour, fill colour, style, line width, font) and the operation.
+    Shapes are entered into a GridIndex by their bounding rectangles.
+    """
+    def __init__(self, layout, height, dpi=96):
+        """
+        layout is the json output of dot and height the height of the
+        image it would have drawn, in pixels.
+        """
+        self.ppp = dpi / 72.0                   # pixels per point
+        self.margin = 4 * self.ppp              # Margin around the drawing
+        self.height = height
+        self.shapes = []
+        self.index = GridIndex()
+        self.addShape(layout, ['_draw_'])
+        for obj in layout.get('objects', []):
+            if 'nodes' not in obj:              # subgraphs list their nodes
+                self.addShape(obj, nodeDrawAttrs)
+        for obj in layout.get('edges', []):
+            self.addShape(obj, edgeDrawAttrs)
+        # caches of wx objects created when drawing
+        self.pens = {}
+        self.brushes = {}
+        self.fonts = {}
+
+    def point(self, p):
+        """
+        Convert a point from graph coordinates (points, origin at the bottom)
+        to bitmap coordinates
+        """
+        return (p[0] * self.ppp + self.margin, self.height - (p[1] * self.ppp + self.margin))
+
+    def addShape(self, obj, attrs):
+        """
+        Parse the drawing operations of an object into a new shape
+        """
+        prims = []
+        xs = []
+        ys = []
+        for attr in attrs:
+            # The drawing state starts afresh for each attribute
+            state = dict(pen='black', fill='black', style=wx.PENSTYLE_SOLID, width=1,
+                         font=(14.0, 'Times'), invis=False)
+            for op in obj.get(attr, []):
+                kind = op['op']
+                if kind in 'cC':
+                    colour = op.get('color')
+                    if colour is None and op.get('stops'):
+                        colour = op['stops'][0]['color']
+                    state['pen' if kind == 'c' else 'fill'] = colour or 'black'
+                elif kind == 'S':
+                    self.setStyle(state, op['style'])
+                elif kind == 'F':
+                    state['font'] = (float(op['size']), op['face'])
+                elif state['invis']:
+                    continue
+                elif kind in 'eE':
+                    x, y, rx, ry = op['rect']
+                    cx, cy = self.point((x, y))
+                    rx *= self.ppp
+                    ry *= self.ppp
+                    xs.extend((cx - rx, cx + rx))
+                    ys.extend((cy - ry, cy + ry))
+                    prims.append((self.penState(state, kind == 'E'), ('ellipse', cx - rx, cy - ry, 2 * rx, 2 * ry)))
+                elif kind in 'pPLbB':
+                    points = [self.point(p) for p in op['points']]
+                    xs.extend(p[0] for p in points)
+                    ys.extend(p[1] for p in points)
+                    shape = {'p': 'polygon', 'P': 'polygon', 'L': 'lines', 'b': 'bezier', 'B': 'bezier'}[kind]
+                    prims.append((self.penState(state, kind in 'PB'), (shape, points)))
+                elif kind == 'T':
+                    x, y = self.point(op['pt'])
+                    w = float(op['width']) * self.ppp
+                    size = state['font'][0] * self.ppp
+                    left = {'l': x, 'r': x - w}.get(op['align'], x - w / 2)
+                    xs.extend((left, left + w))
+                    ys.extend((y - size, y + size / 3))
+                    prims.append((self.penState(state, False), ('text', x, y, op['align'], op['text'])))
+        if prims:
+            key = len(self.shapes)
+            self.shapes.append(prims)
+            x0 = min(xs)
+            y0 = min(ys)
+            self.index.insert(key, (x0, y0, max(xs) - x0 + 2, max(ys) - y0 + 2))
+
+    def setStyle(self, state, style):
+        """
+        Apply a graphviz style to the drawing state
+        """
+        if style == 'dashed':
+            state['style'] = wx.PENSTYLE_SHORT_DASH
+        elif style == 'dotted':
+            state['style'] = wx.PENSTYLE_DOT
+        elif style == 'solid':
+            state['style'] = wx.PENSTYLE_SOLID
+        elif style == 'bold':
+            state['width'] = 2
+        elif style == 'invis' or style == 'invisible':
+            state['invis'] = True
+        elif style.startswith('setlinewidth('):
+            state['width'] = float(style[len('setlinewidth('):-1])
+
+    def penState(self, state, filled):
+        """
+        Return the part of the state needed for a primitive
+        """
+        return (state['pen'], state['fill'] if filled else None,
+                state['style'], state['width'], state['font'])
+
+    def colour(self, name):
+        """
+        Return a wx.Colour for a graphviz colour, which may have an alpha value
+        """
+        if name in ('transparent', 'none', 'invis'):
+            return wx.TransparentColour
+        if name.startswith('#') and len(name) == 9:
+            return wx.Colour(int(name[1:3], 16), int(name[3:5], 16), int(name[5:7], 16), int(name[7:9], 16))
+        return wx.Colour(name)
+
+    def pen(self, colour, style, width):
+        key = (colour, style, width)
+        if key not in self.pens:
+            self.pens[key] = wx.Pen(self.colour(colour), max(int(round(width * self.ppp)), 1), style)
+        return self.pens[key]
+
+    def brush(self, colour):
+        if colour not in self.brushes:
+            self.brushes[colour] = wx.TRANSPARENT_BRUSH if colour is None else wx.Brush(self.colour(colour))
+        return self.brushes[colour]
+
+    def font(self, font):
+        if font not in self.fonts:
+            size, face = font
+            family = fontFamilies.get(face.split('-')[0].lower(), wx.FONTFAMILY_DEFAULT)
+            self.fonts[font] = wx.Font(wx.FontInfo(size).Family(family))
+        return self.fonts[font]
+
+    def draw(self, gc, rect):
+        """
+        Draw the shapes that intersect the given rectangle, which is in bitmap
+        coordinates, as is the graphics context
+        """
+        for key in sorted(self.index.query(rect)):
+            for state, prim in self.shapes[key]:
+                pen, fill, style, width, font = state
+                kind = prim[0]
+                if kind == 'text':
+                    x, y, align, text = prim[1:]
+                    gc.SetFont(self.font(font), self.colour(pen))
+                    w, h, descent, leading = gc.GetFullTextExtent(text)
+                    x = {'l': x, 'r': x - w}.get(align, x - w / 2)
+                    gc.DrawText(text, x, y - h + descent)
+                    continue
+                gc.SetPen(self.pen(pen, style, width))
+                gc.SetBrush(self.brush(fill))
+                if kind == 'ellipse':
+                    gc.DrawEllipse(*prim[1:])
+                    continue
+                points = prim[1]
+                path = gc.CreatePath()
+                path.MoveToPoint(*points[0])
+                if kind == 'bezier':
+                    for i in range(1, len(points) - 2, 3):
+                        path.AddCurveToPoint(*(points[i] + points[i + 1] + points[i + 2]))
+                else:
+                    for p in points[1:]:
+                        path.AddLineToPoint(*p)
+                    if kind == 'polygon':
+                        path.CloseSubpath()
+                if fill is None:
+                    gc.StrokePath(path)
+                else:
+                    gc.DrawPath(path)
@@ -0,0 +1,404 @@
+'''
+This module reads and writes OpenVX graphs as YAML, as an alternative to XML.
+The YAML holds the same tree as the XML, so a file read here goes through
+buildGraphs() like any other, and is saved again as the same XML, byte for byte.
+Each element is a mapping, written so as to be smaller than the XML:
+    the first key is the tag, prefix:name or {uri}name if not in the default
+    namespace, and its value is the text (null if none). Text made of numbers
+    separated by single spaces, as in the values of arrays, is written as a
+    flow sequence, which is joined with spaces again when read.
+    the attributes follow as keys, in order, with the namespace declarations
+    of the root as xmlns and xmlns:prefix.
+    .children:  a list of the child elements.
+Runs of children with the same tag and attribute names and no children of
+their own, such as the pixels of an image or the entries of a lut, are written
+as a table: .table: [tag, attribute names], then .rows: a list of flow sequences
+of the attribute values followed by the text.
+White space between elements is written only where it is not what indenting the
+document by the unit given by .indent on the root would give (see etree.indent());
+otherwise .text gives the text of an element with children and .tail the tail.
+Comments are written as {.comment: text} and processing instructions as
+{.pi: target, .text: text}.
+All values are read back as the strings written, so numbers are not quoted.
+Both reading and writing work on the stream of YAML events rather than on one
+large document or string, using the libyaml C parser and emitter when PyYAML
+has them, so big data blocks are written out as they are reached.
+'''
+import io
+from lxml import etree
+try:
+    import yaml
+except ImportError:
+    yaml = None
+from cvxXML import replaceFile
+
+strTag = 'tag:yaml.org,2002:str'
+nullValues = ('', '~', 'null', 'Null', 'NULL')
+minRows = 3          # the fewest similar children written as a table
+
+def isYAML(filename):
+    return filename.lower().endswith(('.yaml', '.yml'))
+
+def dumper():
+    if yaml is None:
+        raise ImportError("Writing YAML needs the PyYAML package")
+    return getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+def loader():
+    if yaml is None:
+        raise ImportError("Reading YAML needs the PyYAML package")
+    return getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+def shortName(name, nsmap, default):
+    """
+    Return the name to write for the qualified name, which is unqualified if
+    it is in the default namespace given
+    """
+    if not name.startswith('{'):
+        return name if default is None else '{}' + name
+    uri, local = name[1:].split('}', 1)
+    if uri == default:
+        return local
+    for prefix, u in nsmap.items():
+        if prefix is not None and u == uri:
+            return '%s:%s'%(prefix, local)
+    return name
+
+def longName(name, nsmap, default):
+    """
+    The reverse of shortName()
+    """
+    if name.startswith('{}'):
+        return name[2:]
+    if name.startswith('{'):
+        return name
+    if ':' in name:
+        prefix, local = name.split(':', 1)
+        if prefix not in nsmap:
+            raise ValueError("Unknown namespace prefix '%s'"%prefix)
+        return '{%s}%s'%(nsmap[prefix], local)
+    return name if default is None else '{%s}%s'%(default, name)
+
+def spacing(unit, level):
+    """
+    Return the white space before an element at the given level of a document
+    indented by unit, as etree.indent() makes it
+    """
+    return None if unit is None else '\n' + unit * level
+
+def numbers(text):
+    """
+    Return the text split at single spaces if it is numbers separated that way,
+    otherwise None
+    """
+    if text is None or ' ' not in text:
+        return None
+    tokens = text.split(' ')
+    values = [t for t in tokens if t]
+    if len(values) < 2 or text.split() != values:
+        return None
+    try:
+        for t in values:
+            float(t)
+    except ValueError:
+        return None
+    return tokens
+
+class Writer(object):
+    """
+    Turns a tree into YAML events
+    """
+    def __init__(self, root):
+        self.root = root
+        self.nsmap = root.nsmap
+        self.default = self.nsmap.get(None)
+        text = root.text
+        # The unit of indentation, if the document is laid out by one
+        self.unit = text[1:] if len(root) and text and text[0] == '\n' and not text.strip() else None
+
+    def scalar(self, value):
+        if value is None:
+            return yaml.ScalarEvent(None, None, (True, False), '~')
+        # Quote anything that would otherwise be read back as null
+        return yaml.ScalarEvent(None, strTag, (value not in nullValues, True), value)
+
+    def item(self, key, value):
+        yield self.scalar(key)
+        yield self.scalar(value)
+
+    def sequence(self, values):
+        yield yaml.SequenceStartEvent(None, None, True, flow_style=True)
+        for value in values:
+            yield self.scalar(value)
+        yield yaml.SequenceEndEvent()
+
+    def text(self, text):
+        tokens = numbers(text)
+        if tokens is None:
+            yield self.scalar(text)
+        else:
+            yield from self.sequence(tokens)
+
+    def document(self):
+        yield yaml.StreamStartEvent()
+        yield yaml.DocumentStartEvent(explicit=False)
+        yield from self.element(self.root, 0, None)
+        yield yaml.DocumentEndEvent(explicit=False)
+        yield yaml.StreamEndEvent()
+
+    def tail(self, index, last, level):
+        """
+        Return the tail expected of the child with the given index, of the children
+        at the given level
+        """
+        return spacing(self.unit, level if index < last else level - 1)
+
+    def element(self, elem, level, tail):
+        """
+        The events for an element at the given level, whose tail is expected to be tail
+        """
+        yield yaml.MappingStartEvent(None, None, True, flow_style=False)
+        if elem.tag is etree.Comment:
+            yield from self.item('.comment', elem.text)
+        elif elem.tag is etree.PI:
+            yield from self.item('.pi', elem.target)
+            if elem.text is not None:
+                yield from self.item('.text', elem.text)
+        else:
+            yield self.scalar(shortName(elem.tag, self.nsmap, self.default))
+            if len(elem):
+                yield self.scalar(None)
+            else:
+                yield from self.text(elem.text)
+            if level == 0:
+                for prefix, uri in self.nsmap.items():
+                    yield from self.item('xmlns:' + prefix if prefix else 'xmlns', uri)
+                if self.unit is not None:
+                    yield from self.item('.indent', self.unit)
+            for name, value in elem.attrib.items():
+                yield from self.item(shortName(name, self.nsmap, None), value)
+            if len(elem) and elem.text != spacing(self.unit, level + 1):
+                yield from self.item('.text', elem.text)
+        if level and elem.tail != tail:
+            yield from self.item('.tail', elem.tail)
+        if len(elem):
+            yield self.scalar('.children')
+            yield yaml.SequenceStartEvent(None, None, True, flow_style=False)
+            yield from self.children(elem, level + 1)
+            yield yaml.SequenceEndEvent()
+        yield yaml.MappingEndEvent()
+
+    def rowKind(self, children, index, level):
+        """
+        Return the tag and attribute names of the child if it can be a row of
+        a table, otherwise None
+        """
+        child = children[index]
+        if not isinstance(child.tag, str) or len(child) or \
+           child.tail != self.tail(index, len(children) - 1, level):
+            return None
+        return child.tag, tuple(child.attrib.keys())
+
+    def children(self, elem, level):
+        """
+        The events for the children of elem, which are at the given level
+        """
+        children = [child for child in elem if isinstance(child.tag, str) or child.tag in (etree.Comment, etree.PI)]
+        last = len(children) - 1
+        i = 0
+        while i <= last:
+            kind = self.rowKind(children, i, level)
+            j = i + 1
+            if kind is not None:
+                while j <= last and self.rowKind(children, j, level) == kind:
+                    j += 1
+            if j - i >= minRows:
+                yield from self.table(children[i:j], kind)
+            else:
+                for k in range(i, j):
+                    yield from self.element(children[k], level, self.tail(k, last, level))
+            i = j
+
+    def table(self, rows, kind):
+        tag, names = kind
+        yield yaml.MappingStartEvent(None, None, True, flow_style=False)
+        yield self.scalar('.table')
+        yield from self.sequence([shortName(tag, self.nsmap, self.default)] +
+                                 [shortName(name, self.nsmap, None) for name in names])
+        yield self.scalar('.rows')
+        yield yaml.SequenceStartEvent(None, None, True, flow_style=False)
+        for row in rows:
+            yield from self.sequence(row.attrib.values() + [row.text])
+        yield yaml.SequenceEndEvent()
+        yield yaml.MappingEndEvent()
+
+def writeYAML(root, filename):
+    """
+    Write the tree to the file as YAML, replacing the file only when it is
+    complete (see replaceFile())
+    The tree must not be changed while this runs; see copyForSaving().
+    """
+    Dumper = dumper()
+    with replaceFile(filename) as f:
+        text = io.TextIOWrapper(f, encoding='utf-8', newline='\n')
+        yaml.emit(Writer(root).document(), text, Dumper=Dumper, allow_unicode=True)
+        text.flush()
+        text.detach()
+
+class Reader(object):
+    """
+    Builds a tree from YAML events
+    """
+    def __init__(self, events):
+        self.events = events
+        self.nsmap = {}
+        self.unit = None
+
+    def next(self, *kinds):
+        event = next(self.events)
+        if not isinstance(event, kinds):
+            raise ValueError("%s: expected %s, not %s"%(event.start_mark,
+                            ' or '.join(k.__name__ for k in kinds), type(event).__name__))
+        return event
+
+    def value(self, event):
+        if not event.style and event.value in nullValues:
+            return None
+        return event.value
+
+    def scalar(self):
+        return self.value(self.next(yaml.ScalarEvent))
+
+    def sequence(self):
+        """
+        Return the scalars of a sequence as a list
+        """
+        self.next(yaml.SequenceStartEvent)
+        values = []
+        while True:
+            event = self.next(yaml.ScalarEvent, yaml.SequenceEndEvent)
+            if isinstance(event, yaml.SequenceEndEvent):
+                return values
+            values.append(self.value(event))
+
+    def text(self):
+        """
+        Return the text of an element, which may be written as a sequence of numbers
+        """
+        event = self.next(yaml.ScalarEvent, yaml.SequenceStartEvent)
+        if isinstance(event, yaml.ScalarEvent):
+            return self.value(event)
+        tokens = []
+        while True:
+            event = self.next(yaml.ScalarEvent, yaml.SequenceEndEvent)
+            if isinstance(event, yaml.SequenceEndEvent):
+                return ' '.join(tokens)
+            tokens.append(event.value)
+
+    def document(self):
+        self.next(yaml.StreamStartEvent)
+        self.next(yaml.DocumentStartEvent)
+        self.next(yaml.MappingStartEvent)
+        [(root, tail)] = self.element(None, 0)
+        self.next(yaml.DocumentEndEvent)
+        return root
+
+    def element(self, parent, level):
+        """
+        Read the rest of an element mapping, or of a table, adding the elements to parent.
+        The element is made when its children are reached, so the keys before
+        '.children' must describe it completely.
+        Returns a list of the elements read with their tails, or None for each
+        tail not given, which the parent sets.
+        """
+        fields = {}
+        attrib = []
+        elem = None
+        first = True
+        while True:
+            event = self.next(yaml.ScalarEvent, yaml.MappingEndEvent)
+            if isinstance(event, yaml.MappingEndEvent):
+                break
+            key = event.value
+            if first and not key.startswith('.'):
+                fields['.tag'] = key
+                fields['.value'] = self.text()
+            elif key == '.children':
+                elem = self.make(parent, level, fields, attrib, True)
+                self.next(yaml.SequenceStartEvent)
+                given = []
+                while isinstance(self.next(yaml.MappingStartEvent, yaml.SequenceEndEvent), yaml.MappingStartEvent):
+                    given.extend(self.element(elem, level + 1))
+                last = len(given) - 1
+                for i, (child, tail) in enumerate(given):
+                    child.tail = spacing(self.unit, level + 1 if i < last else level) if tail is None else tail[0]
+            elif key == '.table':
+                fields[key] = self.sequence()
+            elif key == '.rows':
+                return self.rows(parent, fields['.table'])
+            elif key.startswith('.'):
+                fields[key] = self.scalar()
+            else:
+                value = self.scalar()
+                attrib.append((key, '' if value is None else value))
+            first = False
+        if elem is None:
+            elem = self.make(parent, level, fields, attrib, False)
+        return [(elem, (fields['.tail'],) if '.tail' in fields else None)]
+
+    def rows(self, parent, names):
+        """
+        Read the rows of a table, adding an element to parent for each
+        """
+        tag = longName(names[0], self.nsmap, self.nsmap.get(''))
+        names = [longName(name, self.nsmap, None) for name in names[1:]]
+        given = []
+        self.next(yaml.SequenceStartEvent)
+        while isinstance(self.next(yaml.SequenceStartEvent, yaml.SequenceEndEvent), yaml.SequenceStartEvent):
+            elem = etree.SubElement(parent, tag)
+            for name in names:
+                value = self.scalar()
+                elem.set(name, '' if value is None else value)
+            elem.text = self.scalar()
+            self.next(yaml.SequenceEndEvent)
+            given.append((elem, None))
+        self.next(yaml.MappingEndEvent)
+        return given
+
+    def make(self, parent, level, fields, attrib, children):
+        if '.comment' in fields:
+            elem = etree.Comment(fields['.comment'])
+        elif '.pi' in fields:
+            elem = etree.PI(fields['.pi'], fields.get('.text'))
+        else:
+            if fields.get('.tag') is None:
+                raise ValueError("Element without a tag")
+            if parent is None:
+                self.nsmap = dict((name[6:], uri) for name, uri in attrib if name.split(':')[0] == 'xmlns')
+                attrib = [(name, value) for name, value in attrib if name.split(':')[0] != 'xmlns']
+                self.unit = fields.get('.indent')
+            tag = longName(fields['.tag'], self.nsmap, self.nsmap.get(''))
+            if parent is None:
+                elem = etree.Element(tag, nsmap={prefix or None: uri for prefix, uri in self.nsmap.items()})
+            else:
+                elem = etree.SubElement(parent, tag)
+            for name, value in attrib:
+                elem.set(longName(name, self.nsmap, None), value)
+            if '.text' in fields:
+                elem.text = fields['.text']
+            elif children:
+                elem.text = spacing(self.unit, level + 1)
+            else:
+                elem.text = fields['.value']
+            return elem
+        if parent is not None:
+            parent.append(elem)
+        return elem
+
+def readYAML(filename):
+    """
+    Read a YAML file written by writeYAML() and return the root element of the tree
+    """
+    Loader = loader()
+    with open(filename, 'rb') as f:
+        return Reader(iter(yaml.parse(f, Loader=Loader))).document()
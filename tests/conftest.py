@@ -0,0 +1,11 @@
+import os
+import sys
+
+# The modules of the application are at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def sample(name):
+    """
+    Return the path of one of the sample files at the top of the repository
+    """
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), name)
@@ -0,0 +1,326 @@
+'''
+The values of data objects kept in buffers (see cvxBuffer) must be saved in the
+layout they were read in, with only the values edited changed, and edits to them
+must undo and redo exactly.
+Each test reads example.xml, edits a data object through cvxJournal, saves the
+document as writeCopy() does and reads it back.
+'''
+from copy import deepcopy
+import pytest
+from lxml import etree
+from conftest import sample
+import cvxJournal as journal
+from cvxJournal import Journal
+from cvxBuffer import Buffer
+
+def touch(elem):
+    pass
+
+@pytest.fixture
+def root():
+    Buffer.clear()
+    Journal.clear()
+    Journal.root = etree.parse(sample('example.xml')).getroot()
+    Journal.begin()
+    return Journal.root
+
+def find(root, name):
+    return root.xpath('//*[@name=$name]', name=name)[0]
+
+def save(root):
+    """
+    Return the document as it would be saved, read back
+    """
+    copy = deepcopy(root)
+    for buf in Buffer.snapshot(root, copy):
+        buf.write()
+    return etree.fromstring(etree.tostring(copy))
+
+def xml(elem):
+    return etree.tostring(elem, with_tail=False).decode('utf-8')
+
+def saved(root, name):
+    return xml(find(save(root), name))
+
+def roundTrip(root, name, change, old, new):
+    """
+    Check that making the change to the data object with the given name saves it
+    with the text old replaced by new, and that undoing and redoing it work
+    """
+    original = xml(find(root, name))
+    assert old in original
+    change(find(root, name))
+    assert saved(root, name) == original.replace(old, new)
+    assert Journal.undo(touch)
+    assert saved(root, name) == original
+    assert Journal.redo(touch)
+    assert saved(root, name) == original.replace(old, new)
+
+def test_array(root):
+    roundTrip(root, 'array', lambda elem: journal.setItem(elem, 2, 99),
+              '<uint8>2 3 4 5 ', '<uint8>2 3 99 5 ')
+
+def test_array_resize(root):
+    def change(elem):
+        journal.splice(elem, 10, 10, [12, 13])
+    roundTrip(root, 'array', change, '10 11 </uint8>', '10 11 12 13 </uint8>')
+
+def test_array_emptied(root):
+    roundTrip(root, 'array', lambda elem: journal.splice(elem, 0, 10, []),
+              '<uint8>2 3 4 5 6 7 8 9 10 11 </uint8>\n\t', '')
+
+@pytest.mark.parametrize('name, value, old, new', [
+    ('scalar_0', 7, '<uint8>255</uint8>', '<uint8>7</uint8>'),
+    ('scalar_2', 0.5, '<float32>3.141593</float32>', '<float32>0.5</float32>'),
+    ('scalar_3', 2.5, '<float64>6.283185</float64>', '<float64>2.5</float64>'),
+    ('scalar_7', 1, '<uint64>18446744073709551615</uint64>', '<uint64>1</uint64>'),
+    ('scalar_12', -3, '<int32>7</int32>', '<int32>-3</int32>'),
+    ])
+def test_scalar(root, name, value, old, new):
+    roundTrip(root, name, lambda elem: journal.setItem(elem, 0, value), old, new)
+
+def test_float_text_kept(root):
+    # values that read the same are not written again
+    roundTrip(root, 'scalar_2', lambda elem: journal.setItem(elem, 0, 3.1415930001),
+              '3.141593', '3.141593')
+
+def test_scalar_type(root):
+    roundTrip(root, 'scalar_12', lambda elem: journal.reshape(elem, {'elemType': 'VX_TYPE_FLOAT32'}),
+              'elemType="VX_TYPE_INT32" name="scalar_12">\n\t\t<int32>7</int32>',
+              'elemType="VX_TYPE_FLOAT32" name="scalar_12">\n\t\t<float32>7</float32>')
+
+def test_remap_point(root):
+    def change(elem):
+        journal.setItem(elem, Buffer.get(elem).index(2, 0), 9)
+    roundTrip(root, 'remap', change, '<point src_x="1.500000" src_y="0.500000" dst_x="2" dst_y="0"/>',
+              '<point src_x="9" src_y="0.5" dst_x="2" dst_y="0"/>')
+
+def test_sparse_remap(root):
+    # only the points that were given, or that have been set, are written
+    def change(elem):
+        journal.splice(elem, Buffer.get(elem).index(1, 1), Buffer.get(elem).index(1, 1) + 2, [4, 1])
+    roundTrip(root, 'remap_0', change, '\t\t</remap>', '\t\t<point src_x="4" src_y="1" dst_x="1" dst_y="1"/></remap>')
+
+def test_remap_resize(root):
+    original = saved(root, 'remap')
+    journal.reshape(find(root, 'remap'), {'dst_width': 3})
+    points = find(save(root), 'remap')
+    assert [(p.get('dst_x'), p.get('dst_y')) for p in points] == [(str(x), str(y)) for y in range(4) for x in range(3)]
+    assert Journal.undo(touch)
+    assert saved(root, 'remap') == original
+
+@pytest.fixture(params=[True, False], ids=['numpy', 'python'])
+def bG(request, monkeypatch):
+    """
+    cvxXML, with and without NumPy
+    """
+    bG = pytest.importorskip('cvxXML')
+    import cvxPayload as payload
+    if request.param:
+        if not payload.available():
+            pytest.skip("NumPy is not available")
+    else:
+        monkeypatch.setattr(payload, 'np', None)
+    return bG
+
+def points(root, name):
+    """
+    Return the points of the remap as saved, by destination
+    """
+    return dict(((int(p.get('dst_x')), int(p.get('dst_y'))), (float(p.get('src_x')), float(p.get('src_y'))))
+                for p in find(save(root), name))
+
+def test_remap_scaling(root, bG):
+    remap = find(root, 'remap')
+    journal.reshape(remap, {'dst_width': 3, 'dst_height': 2})
+    before = points(root, 'remap')
+    Journal.begin()
+    bG.fillRemap(remap, bG.remapScaling(remap))
+    # the source is twice the size of the destination
+    assert points(root, 'remap') == {(0, 0): (0.5, 0.5), (1, 0): (2.5, 0.5), (2, 0): (4.5, 0.5),
+                                     (0, 1): (0.5, 2.5), (1, 1): (2.5, 2.5), (2, 1): (4.5, 2.5)}
+    assert Journal.undo(touch)
+    assert points(root, 'remap') == before
+
+def test_remap_undistortion(root, bG):
+    remap = find(root, 'remap')
+    bG.fillRemap(remap, bG.remapUndistortion(remap, 0.1))
+    found = points(root, 'remap')
+    # about the centre (2.5, 1.5), with the focal length half the diagonal, sqrt(13)
+    for point, src in [((0, 0), (-0.1634615, -0.0980769)), ((5, 3), (5.1634615, 3.0980769)),
+                       ((2, 1), (1.9980769, 0.9980769)), ((3, 2), (3.0019231, 2.0019231))]:
+        assert found[point] == pytest.approx(src, abs=1e-5)
+    assert len(found) == 24
+    # without distortion every point maps to itself
+    bG.fillRemap(remap, bG.remapUndistortion(remap, 0.0))
+    assert points(root, 'remap') == dict(((x, y), (float(x), float(y))) for y in range(4) for x in range(6))
+
+def test_lut_entry(root):
+    roundTrip(root, 'lut', lambda elem: journal.setItem(elem, 1, 7),
+              '<uint8 index="1">0</uint8>', '<uint8 index="1">7</uint8>')
+
+def test_sparse_lut(root):
+    # only the entries that were given, or that are not zero, are written
+    roundTrip(root, 'lut_0', lambda elem: journal.setItem(elem, 5, 9),
+              '\t\t</lut>', '\t\t<uint8 index="5">9</uint8></lut>')
+
+def test_lut_type(root):
+    lut = find(root, 'lut')
+    journal.setAttr(lut, 'elemType', 'VX_TYPE_INT16')
+    buf = Buffer.get(lut)
+    assert len(buf.present) == len(buf) == 256
+    journal.setItem(lut, 1, -7)
+    saved = find(save(root), 'lut')
+    assert [child.text for child in saved][:3] == ['255', '-7', '1']
+    assert all(etree.QName(child).localname == 'int16' for child in saved)
+
+def test_distribution(root):
+    roundTrip(root, 'distribution', lambda elem: journal.setItem(elem, 2, 5),
+              '<frequency bin="2">2</frequency>', '<frequency bin="2">5</frequency>')
+
+def test_distribution_bins(root):
+    distribution = find(root, 'distribution_0')
+    journal.setAttr(distribution, 'bins', None)
+    assert len(Buffer.get(distribution)) == 16
+
+def entries(root, name):
+    return [(child.get('index') or child.get('bin'), child.text) for child in find(save(root), name)]
+
+def test_lut_identity(root, bG):
+    lut = find(root, 'lut')
+    original = saved(root, 'lut')
+    Journal.begin()
+    bG.fillTable(lut, bG.lutIdentity(lut))
+    assert entries(root, 'lut') == [(str(i), str(i)) for i in range(256)]
+    assert Journal.undo(touch)
+    assert saved(root, 'lut') == original
+
+def test_lut_gamma(root, bG):
+    lut = find(root, 'lut')
+    bG.fillTable(lut, bG.lutGamma(lut, 2.0))
+    assert dict(entries(root, 'lut'))['128'] == '64'
+    assert dict(entries(root, 'lut'))['255'] == '255'
+
+def test_lut_expression(root, bG):
+    lut = find(root, 'lut')
+    bG.fillTable(lut, '255 - x')
+    assert entries(root, 'lut')[:3] == [('0', '255'), ('1', '254'), ('2', '253')]
+    # values are rounded and clamped to the type
+    bG.fillTable(lut, 'max(2 * x - 100.4, -1)')
+    assert entries(root, 'lut')[:3] == [('0', '0'), ('1', '0'), ('2', '0')]
+    assert entries(root, 'lut')[51:53] == [('51', '2'), ('52', '4')]
+    assert entries(root, 'lut')[-1] == ('255', '255')
+    assert '\n\t\t<uint8 index="51">2</uint8>\n\t\t<uint8 index="52">4</uint8>\n' in saved(root, 'lut')
+
+def test_signed_lut_expression(root, bG):
+    lut = find(root, 'lut')
+    journal.setAttr(lut, 'elemType', 'VX_TYPE_INT16')
+    # x is the input value, which for a signed LUT starts from the lowest
+    bG.fillTable(lut, 'x')
+    assert entries(root, 'lut')[:2] == [('0', '-128'), ('1', '-127')]
+    assert entries(root, 'lut')[128] == ('128', '0')
+    bG.fillTable(lut, 'floor(sqrt(abs(x)) * sin(pi / 2)) + n')
+    assert entries(root, 'lut')[:2] == [('0', '267'), ('1', '267')]
+
+def test_distribution_expression(root, bG):
+    distribution = find(root, 'distribution')
+    bG.fillTable(distribution, 'x * 2')
+    assert entries(root, 'distribution') == [(str(i), str(i * 2)) for i in range(16)]
+    assert '<frequency bin="3">6</frequency>' in saved(root, 'distribution')
+
+def test_histogram(root, bG):
+    distribution = find(root, 'distribution')
+    # 16 bins over 0 to 255
+    bG.importHistogram(distribution, [0, 15, 16, 255, 256, -1, 100])
+    assert [(b, f) for b, f in entries(root, 'distribution') if f != '0'] == \
+        [('0', '2'), ('1', '1'), ('6', '1'), ('15', '1')]
+
+@pytest.mark.parametrize('expression', [
+    "__import__('os').system('true')", "x.real", "[x]", "lambda: 1", "open('f')",
+    "x if x else 1", "'a' * 3", "(1).__class__", "sqrt(x=1)", "y", "x +",
+    ])
+def test_expression_not_allowed(root, bG, expression):
+    lut = find(root, 'lut')
+    original = saved(root, 'lut')
+    with pytest.raises(ValueError):
+        bG.fillTable(lut, expression)
+    assert saved(root, 'lut') == original
+
+def test_matrix(root):
+    def change(elem):
+        journal.setItem(elem, Buffer.get(elem).index(0, 1), 0.25)
+    roundTrip(root, 'matrix', change, '<float32 row="0" column="1">0.000000</float32>',
+              '<float32 row="0" column="1">0.25</float32>')
+
+def test_convolution(root):
+    def change(elem):
+        journal.setItem(elem, Buffer.get(elem).index(1, 0), 5)
+    roundTrip(root, 'convolution', change, '<int16 row="1" column="0">-2</int16>',
+              '<int16 row="1" column="0">5</int16>')
+
+def test_matrix_resize(root):
+    original = saved(root, 'matrix_0')
+    journal.reshape(find(root, 'matrix_0'), {'rows': 2, 'columns': 4})
+    matrix = find(save(root), 'matrix_0')
+    # the new column is zero, so it is not written
+    assert [(c.get('row'), c.get('column')) for c in matrix] == [(str(r), str(c)) for r in range(2) for c in range(3)]
+    assert [c.text for c in matrix][:3] == ['-23', '904', '29']
+    assert Journal.undo(touch)
+    assert saved(root, 'matrix_0') == original
+
+def coefficients(root, name):
+    return [child.text for child in find(save(root), name)]
+
+def test_paste_matrix(root, bG):
+    matrix = find(root, 'matrix_0')
+    original = saved(root, 'matrix_0')
+    changes = []
+    Journal.observer = lambda kind, elem, *args: changes.append(kind)
+    try:
+        Journal.begin()
+        # as copied from a spreadsheet; the value beyond the last column is ignored
+        bG.pasteMatrix(matrix, 1, 1, '1, 2\n3\t4\t5\n')
+    finally:
+        Journal.observer = None
+    assert coefficients(root, 'matrix_0') == ['-23', '904', '29', '782', '1', '2', '848', '3', '4']
+    # one change, which is undone at once
+    assert changes == ['splice']
+    assert len(Journal.current.ops) == 1
+    assert Journal.undo(touch)
+    assert saved(root, 'matrix_0') == original
+    assert Journal.redo(touch)
+    assert coefficients(root, 'matrix_0') == ['-23', '904', '29', '782', '1', '2', '848', '3', '4']
+
+def test_paste_matrix_outside(root, bG):
+    original = saved(root, 'matrix')
+    bG.pasteMatrix(find(root, 'matrix'), 0, 3, [[1, 2], [3, 4]])
+    bG.pasteMatrix(find(root, 'matrix'), 3, 0, [[1, 2]])
+    assert saved(root, 'matrix') == original
+    bG.pasteMatrix(find(root, 'matrix'), 2, 2, [(0.5, 1), (2, 3)])
+    assert coefficients(root, 'matrix')[-1] == '0.5'
+
+def test_fill_matrix(root, bG):
+    matrix = find(root, 'matrix')
+    original = saved(root, 'matrix')
+    Journal.begin()
+    bG.fillMatrix(matrix, lambda row, column: (row == column) * 1.5)
+    # coefficients that were already zero keep their text
+    assert coefficients(root, 'matrix') == ['1.5', '0.000000', '0', '0', '1.5', '0', '0', '0.000000', '1.5']
+    assert len(Journal.current.ops) == 1
+    assert Journal.undo(touch)
+    assert saved(root, 'matrix') == original
+    # integers are rounded and clamped
+    bG.fillMatrix(find(root, 'convolution'), lambda row, column: row * 40000.0 - column * 0.6)
+    assert coefficients(root, 'convolution') == ['0', '-1', '-1', '32767', '32767', '32767', '32767', '32767', '32767']
+
+def test_sparse_matrix(root):
+    def change(elem):
+        journal.setItem(elem, Buffer.get(elem).index(2, 1), 1.5)
+    roundTrip(root, 'matrix_1', change, '\t\t</matrix>', '\t\t<float32 row="2" column="1">1.5</float32></matrix>')
+
+def test_unchanged(root):
+    # every buffer, written back without changes, gives the xml it was read from
+    for elem in root.iter():
+        if Buffer.buffered(elem):
+            Buffer.get(elem).dirty = True
+    assert etree.tostring(save(root)) == etree.tostring(root)
@@ -0,0 +1,72 @@
+'''
+Edits applied incrementally with updateGraphs() must leave Xref, the graphs and
+the element names as a full buildGraphs() of the same tree would.
+'''
+import pytest
+pytest.importorskip('wx')
+pytest.importorskip('pygraphviz')
+from lxml import etree
+from conftest import sample
+import cvxXML as bG
+from cvxXML import Xref
+from cvxJournal import Journal
+
+def model(graphDict):
+    """
+    Return what the build made, as plain data to compare
+    """
+    graphs = {}
+    for name, (elem, graph) in graphDict.items():
+        graphs[name] = (sorted(graph.nodes()), sorted(graph.edges()))
+    return sorted(bG.elementNames), sorted(ref for ref, xobj in Xref.items()), graphs
+
+def rebuilt(root):
+    """
+    Build the graphs of the tree from scratch; this replaces the model being tested
+    """
+    return model(bG.buildGraphs(root))
+
+@pytest.fixture
+def loaded():
+    Journal.clear()
+    root, graphDict = bG.parseGraphs(sample('example.xml'))
+    return root, graphDict
+
+def edit(graphDict, change):
+    Journal.begin()
+    change()
+    assert bG.updateGraphs(graphDict)
+
+def test_remove_graph_parameter(loaded):
+    root, graphDict = loaded
+    elem, graph = graphDict['GRAPH1']
+    edit(graphDict, lambda: bG.removeGraphParameter(elem, graph, '%s,0'%elem.get('reference')))
+    assert 'parameter' not in bG.elementNames
+    assert model(graphDict) == rebuilt(root)
+
+def graphParameter(root):
+    """
+    Return the references of the sobel node of GRAPH1 and of its output image,
+    which is made a graph parameter
+    """
+    image = root.xpath('//*[@name="image_36"]')[0].get('reference')
+    node = root.xpath('//*[@name="node"]')[0].get('reference')
+    return image, node
+
+def test_insert_graph_parameter(loaded):
+    root, graphDict = loaded
+    elem, graph = graphDict['GRAPH1']
+    image, node = graphParameter(root)
+    edit(graphDict, lambda: bG.insertGraphParameter(elem, graph, image, node))
+    assert model(graphDict) == rebuilt(root)
+
+def test_undo_insert_graph_parameter(loaded):
+    root, graphDict = loaded
+    elem, graph = graphDict['GRAPH1']
+    image, node = graphParameter(root)
+    before = model(graphDict)
+    edit(graphDict, lambda: bG.insertGraphParameter(elem, graph, image, node))
+    assert Journal.undo(bG.touchElement)
+    assert bG.updateGraphs(graphDict)
+    assert model(graphDict) == before
+    assert model(graphDict) == rebuilt(root)
@@ -0,0 +1,29 @@
+'''
+The layout cache is keyed on the dot source of the graphs drawn, so the source
+must be the same in every session.
+'''
+import os
+import sys
+import subprocess
+import pytest
+pytest.importorskip('wx')
+pytest.importorskip('pygraphviz')
+
+script = '''
+import cvxXML as bG
+from cvxLayout import cacheKey
+for name in ('example.xml', 'googlenet.xml'):
+    root, graphDict = bG.parseGraphs(name)
+    for graphName, (elem, graph) in sorted(graphDict.items()):
+        for show in (False, True):
+            bG.showVirtuals = show
+            print(name, graphName, show, cacheKey(bG.viewOf(graph).string(), 'LR'))
+'''
+
+def keys(seed):
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONHASHSEED=str(seed), PYTHONPATH=os.pathsep.join([top] + sys.path))
+    return subprocess.check_output([sys.executable, '-c', script], cwd=top, env=env)
+
+def test_cache_key_same_in_every_session():
+    assert keys(1) == keys(2)
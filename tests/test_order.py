@@ -0,0 +1,135 @@
+'''
+GraphOrder (see cvxOrder) must answer whether one node reaches another as a
+plain search of the graph would, and go on doing so as the graph is edited.
+'''
+import random
+import pytest
+pgv = pytest.importorskip('pygraphviz')
+from cvxOrder import GraphOrder
+
+def successors(graph):
+    found = dict((str(n), []) for n in graph.nodes())
+    for u, v in graph.edges():
+        found[str(u)].append(str(v))
+    return found
+
+def search(successors, source, destination):
+    """
+    Return whether there is a path from source to destination, by looking at every path
+    """
+    seen = set()
+    stack = [source]
+    while stack:
+        n = stack.pop()
+        for s in successors[n]:
+            if s == destination:
+                return True
+            if s not in seen:
+                seen.add(s)
+                stack.append(s)
+    return source == destination
+
+def check(graph):
+    order = GraphOrder.get(graph)
+    following = successors(graph)
+    nodes = list(following)
+    cyclic = set(n for n in nodes if any(search(following, s, n) for s in following[n]))
+    for source in nodes:
+        for destination in nodes:
+            reached, cycle = order.reaches(source, destination)
+            assert reached == search(following, source, destination), (source, destination)
+            # a cycle is only reported if there is one that can be reached
+            if cycle:
+                assert any(search(following, source, n) for n in cyclic)
+            if not cyclic:
+                assert not cycle
+    # answers remembered are given again
+    for source in nodes:
+        for destination in nodes:
+            assert order.reaches(source, destination)[0] == search(following, source, destination)
+
+def randomGraph(rnd, size, edges, acyclic):
+    graph = pgv.AGraph(directed=True, strict=False, name='G%d'%size)
+    for n in range(size):
+        graph.add_node(str(n))
+    for i in range(edges):
+        u, v = rnd.sample(range(size), 2)
+        if acyclic and u > v:
+            u, v = v, u
+        graph.add_edge(str(u), str(v))
+    return graph
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('acyclic', [True, False])
+def test_reaches(seed, acyclic):
+    GraphOrder.clear()
+    rnd = random.Random(seed)
+    check(randomGraph(rnd, 25, 30, acyclic))
+
+@pytest.mark.parametrize('seed', range(5))
+def test_after_edits(seed):
+    """
+    Edits are followed by GraphOrder.forget(), as Xref.setDirty() does
+    """
+    GraphOrder.clear()
+    rnd = random.Random(seed)
+    graph = randomGraph(rnd, 20, 20, True)
+    check(graph)
+    for i in range(10):
+        edges = graph.edges()
+        if edges and rnd.random() < 0.4:
+            graph.delete_edge(*rnd.choice(edges))
+        else:
+            u, v = rnd.sample(range(20), 2)
+            # now and then one that makes a cycle
+            if u > v and rnd.random() < 0.8:
+                u, v = v, u
+            graph.add_edge(str(u), str(v))
+        GraphOrder.forget(graph.name)
+        check(graph)
+
+def test_cycle_removed():
+    GraphOrder.clear()
+    graph = pgv.AGraph(directed=True, name='C')
+    graph.add_edges_from([('a', 'b'), ('b', 'c'), ('c', 'a'), ('c', 'd'), ('e', 'a')])
+    check(graph)
+    assert GraphOrder.get(graph).reaches('e', 'd') == (True, True)
+    assert GraphOrder.get(graph).reaches('d', 'e') == (False, False)
+    graph.delete_edge('c', 'a')
+    GraphOrder.forget(graph.name)
+    check(graph)
+    assert GraphOrder.get(graph).reaches('e', 'd') == (True, False)
+    assert not GraphOrder.get(graph).cyclic
+
+def test_model_after_edit():
+    """
+    The order of a graph of a document, after an edit goes through updateGraphs()
+    """
+    pytest.importorskip('wx')
+    from conftest import sample
+    import cvxXML as bG
+    import cvxJournal as journal
+    from cvxJournal import Journal
+    Journal.clear()
+    root, graphDict = bG.parseGraphs(sample('example.xml'))
+    elem, graph = graphDict['GRAPH1']
+    check(graph)
+    node0 = root.xpath('//*[@name="node_0"]')[0]
+    node1 = root.xpath('//*[@name="node_1"]')[0]
+    output = [p for p in node0.iterchildren('{*}parameter') if p.get('index') == '1'][0].get('reference')
+    assert not GraphOrder.get(graph).reaches(node0.get('reference'), node1.get('reference'))[0]
+    # make the output of node_0 the first input of node_1
+    Journal.begin()
+    param = [p for p in node1.iterchildren('{*}parameter') if p.get('index') == '0'][0]
+    bG.touchElement(node1)
+    journal.setAttr(param, 'reference', output)
+    assert bG.updateGraphs(graphDict)
+    elem, graph = graphDict['GRAPH1']
+    check(graph)
+    assert GraphOrder.get(graph).reaches(node0.get('reference'), node1.get('reference')) == (True, False)
+    # and back again
+    assert Journal.undo(bG.touchElement)
+    assert bG.updateGraphs(graphDict)
+    elem, graph = graphDict['GRAPH1']
+    check(graph)
+    assert not GraphOrder.get(graph).reaches(node0.get('reference'), node1.get('reference'))[0]
@@ -0,0 +1,101 @@
+'''
+The data of a data object stored in a .npy file (see cvxPayload) must load back
+as the same values, layout and attributes.
+'''
+import os
+from copy import deepcopy
+import pytest
+np = pytest.importorskip('numpy')
+from lxml import etree
+from conftest import sample
+import cvxPayload as payload
+
+names = ['lut', 'distribution', 'matrix', 'matrix_0', 'convolution', 'remap', 'array']
+
+@pytest.fixture(scope='module')
+def root():
+    return etree.parse(sample('example.xml')).getroot()
+
+def find(root, name):
+    return root.xpath('//*[@name=$name]', name=name)[0]
+
+@pytest.mark.parametrize('name', names)
+def test_file_round_trip(root, name, tmp_path):
+    elem = find(root, name)
+    data = payload.fromElement(elem)
+    filename = str(tmp_path / (name + '.npy'))
+    with open(filename, 'wb') as f:
+        payload.save(f, data)
+    loaded = payload.load(filename)
+    assert loaded.dtype == data.dtype
+    assert loaded.shape == data.shape
+    assert np.array_equal(loaded, data)
+    for attr, value in payload.fit(elem, loaded).items():
+        assert elem.get(attr) == str(value)
+
+def test_remap_points(root):
+    data = payload.fromElement(find(root, 'remap'))
+    for point in find(root, 'remap'):
+        x, y = int(point.get('dst_x')), int(point.get('dst_y'))
+        assert data[y, x].tolist() == [float(point.get('src_x')), float(point.get('src_y'))]
+
+def test_fit_rejects(root):
+    with pytest.raises(ValueError):
+        payload.fit(find(root, 'distribution'), np.zeros(16, dtype='int8'))
+    with pytest.raises(ValueError):
+        payload.fit(find(root, 'remap'), np.zeros((4, 6), dtype='float32'))
+
+def test_tensor_fit():
+    tensor = etree.Element('tensor', data_type='VX_TYPE_UINT8', number_of_dims='1')
+    assert payload.fit(tensor, np.zeros((2, 3, 4), dtype='int16')) == \
+        dict(number_of_dims=3, data_type='VX_TYPE_INT16')
+
+def test_paths(tmp_path):
+    doc = etree.fromstring('<openvx><lut data_file="a/lut.npy"/><tensor data_file="/elsewhere/t.npy"/></openvx>')
+    original = deepcopy(doc)
+    payload.absolutePaths(doc, str(tmp_path))
+    assert doc[0].get('data_file') == os.path.join(str(tmp_path), 'a', 'lut.npy')
+    payload.relativePaths(doc, str(tmp_path))
+    assert doc[0].get('data_file') == original[0].get('data_file')
+    assert os.path.normpath(os.path.join(str(tmp_path), doc[1].get('data_file'))) == \
+        os.path.normpath('/elsewhere/t.npy')
+
+@pytest.fixture
+def loaded(tmp_path):
+    pytest.importorskip('wx')
+    pytest.importorskip('pygraphviz')
+    import cvxXML as bG
+    from cvxJournal import Journal
+    Journal.clear()
+    root, graphDict = bG.parseGraphs(sample('example.xml'))
+    Journal.root = root
+    payload.directory = str(tmp_path)
+    yield root
+    payload.directory = None
+
+def xobject(root, name):
+    from cvxXML import Xref
+    return Xref.get(find(root, name).get('reference'))
+
+@pytest.mark.parametrize('name', names)
+def test_store_and_load(loaded, name):
+    from cvxJournal import Journal
+    root = loaded
+    elem = find(root, name)
+    original = etree.tostring(elem)
+    data = payload.fromElement(elem)
+    xobj = xobject(root, name)
+    Journal.begin()
+    assert xobj.storeData()
+    assert len(elem) == 0
+    assert os.path.dirname(elem.get(payload.sdata_file)) == payload.directory
+    assert np.array_equal(xobj.getPayload(), data)
+    attributes = dict(elem.attrib)
+    Journal.begin()
+    assert xobj.loadData()
+    assert dict(elem.attrib) == attributes
+    assert np.array_equal(xobj.getPayload(), data)
+    # storing is undone by putting the data back in the xml
+    assert Journal.undo(lambda elem: None)
+    assert Journal.undo(lambda elem: None)
+    assert etree.tostring(elem) == original
@@ -0,0 +1,104 @@
+'''
+Replaying the recovery journal (see cvxRecovery) over its base must give the
+document as it was when the journal was written.
+'''
+from copy import deepcopy
+import pytest
+pytest.importorskip('wx')
+from lxml import etree
+from conftest import sample
+import cvxPreferences as options
+import cvxJournal as journal
+from cvxJournal import Journal
+from cvxBuffer import Buffer
+import cvxRecovery
+from cvxRecovery import Recovery, recover
+
+def touch(elem):
+    pass
+
+def saved(root):
+    """
+    Return the document as it would be saved
+    """
+    copy = deepcopy(root)
+    for buf in Buffer.snapshot(root, copy):
+        buf.write()
+    return etree.tostring(copy)
+
+def find(root, name):
+    return root.xpath('//*[@name=$name]', name=name)[0]
+
+@pytest.fixture
+def recovery(tmp_path, monkeypatch):
+    monkeypatch.setattr(options, 'recoveryDir', str(tmp_path))
+    monkeypatch.setattr(options, 'recoveryInterval', 60)
+    Buffer.clear()
+    Journal.clear()
+    Journal.root = etree.parse(sample('example.xml')).getroot()
+    r = Recovery()
+    r.rebase(Journal.root, 'example.xml')
+    yield r
+    Journal.observer = None
+    if not r.stopping:
+        r.stop()
+
+def edit(change):
+    Journal.begin()
+    change()
+
+def replayed(r):
+    r.stop()
+    recovered = recover()
+    assert recovered is not None
+    root, filename = recovered
+    assert filename == 'example.xml'
+    return saved(root)
+
+def test_nothing_to_recover(recovery):
+    recovery.stop()
+    assert recover() is None
+
+def test_attributes_and_text(recovery):
+    root = Journal.root
+    edit(lambda: journal.setAttr(find(root, 'matrix'), 'name', 'renamed'))
+    edit(lambda: journal.setAttr(find(root, 'lut'), 'name', None))
+    edit(lambda: journal.setText(find(root, 'scalar_0')[0], '7'))
+    assert replayed(recovery) == saved(root)
+
+def test_insert_and_remove(recovery):
+    root = Journal.root
+    array = find(root, 'array')
+    copy = deepcopy(array)
+    copy.set('name', 'copied')
+    edit(lambda: journal.insert(array.getparent(), 0, copy))
+    edit(lambda: journal.remove(find(root, 'remap').getparent(), find(root, 'remap')))
+    assert replayed(recovery) == saved(root)
+
+def test_buffers(recovery):
+    root = Journal.root
+    edit(lambda: journal.setItem(find(root, 'array'), 2, 99))
+    edit(lambda: journal.splice(find(root, 'lut'), 0, 4, [9, 8, 7, 6]))
+    edit(lambda: journal.setItem(find(root, 'remap'), 5, 2.5))
+    edit(lambda: journal.reshape(find(root, 'matrix_0'), {'rows': '2', 'columns': '4'}))
+    assert replayed(recovery) == saved(root)
+
+def test_undo_and_redo(recovery):
+    root = Journal.root
+    edit(lambda: journal.setItem(find(root, 'array'), 2, 99))
+    edit(lambda: journal.reshape(find(root, 'matrix_0'), {'rows': '4'}))
+    edit(lambda: journal.remove(find(root, 'remap').getparent(), find(root, 'remap')))
+    assert Journal.undo(touch)
+    assert Journal.undo(touch)
+    assert Journal.redo(touch)
+    assert replayed(recovery) == saved(root)
+
+def test_new_base(recovery):
+    root = Journal.root
+    edit(lambda: journal.setItem(find(root, 'array'), 2, 99))
+    recovery.rebase(root, 'other.xml', saved=False)
+    edit(lambda: journal.setItem(find(root, 'array'), 3, 98))
+    recovery.stop()
+    recovered, filename = recover()
+    assert filename == 'other.xml'
+    assert saved(recovered) == saved(root)
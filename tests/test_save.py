@@ -0,0 +1,27 @@
+'''
+Saving writes the tree as the sample files are written, so that saving an
+unchanged file gives the same bytes.
+'''
+import pytest
+pytest.importorskip('wx')
+pytest.importorskip('pygraphviz')
+from lxml import etree
+from conftest import sample
+import cvxXML as bG
+
+@pytest.mark.parametrize('name', ['example.xml', 'googlenet.xml'])
+def test_write_tree_unchanged(name, tmp_path):
+    filename = str(tmp_path / name)
+    bG.writeTree(etree.parse(sample(name)).getroot(), filename)
+    with open(sample(name), 'rb') as f, open(filename, 'rb') as g:
+        assert g.read() == f.read()
+
+def test_save_copy(tmp_path):
+    root, graphDict = bG.parseGraphs(sample('googlenet.xml'))
+    filename = str(tmp_path / 'googlenet.xml')
+    tree, buffers = bG.copyForSaving(root)
+    bG.writeCopy(bG.writeTree, tree, buffers, filename)
+    with open(filename, 'rb') as f:
+        text = f.read()
+    assert text.count(b'xmlns=') == 1
+    assert etree.tostring(etree.fromstring(text)) == etree.tostring(tree)
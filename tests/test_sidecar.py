@@ -0,0 +1,20 @@
+'''
+A model restored from a sidecar must be the model the file parses to, down to
+the dot source of its graphs, which the layout cache is keyed on.
+'''
+import pickle
+import pytest
+pytest.importorskip('wx')
+pytest.importorskip('pygraphviz')
+from conftest import sample
+import cvxXML as bG
+
+@pytest.mark.parametrize('name', ['example.xml', 'googlenet.xml'])
+def test_restore_model(name):
+    root, graphDict = bG.parseGraphs(sample(name))
+    sources = dict((name, graph.string()) for name, (elem, graph) in graphDict.items())
+    names = sorted(bG.elementNames)
+    state = pickle.loads(pickle.dumps(bG.modelState(root, graphDict)))
+    root, graphDict = bG.restoreModel(state)
+    assert dict((name, graph.string()) for name, (elem, graph) in graphDict.items()) == sources
+    assert sorted(bG.elementNames) == names
@@ -0,0 +1,43 @@
+'''
+GridIndex must find exactly what a scan of every rectangle finds.
+'''
+import random
+import pytest
+from cvxSpatial import GridIndex
+
+def scan(rects, rect):
+    x, y, w, h = rect
+    return set(key for key, (kx, ky, kw, kh) in rects.items()
+               if kx < x + w and x < kx + kw and ky < y + h and y < ky + kh)
+
+def randomRect(rnd, size):
+    return (rnd.randint(-300, 1500), rnd.randint(-300, 1500), rnd.randint(0, size), rnd.randint(0, size))
+
+@pytest.mark.parametrize('cellSize', [16, 128, 1000])
+def test_query_matches_scan(cellSize):
+    rnd = random.Random(cellSize)
+    index = GridIndex(cellSize)
+    rects = {}
+    for key in range(300):
+        rects[key] = randomRect(rnd, 400)
+        index.insert(key, rects[key])
+    for i in range(500):
+        rect = randomRect(rnd, 300)
+        assert index.query(rect) == scan(rects, rect)
+        # hit test about a point, as the panels do
+        x, y = rnd.randint(-300, 1500), rnd.randint(-300, 1500)
+        assert index.query((x - 5, y - 5, 11, 11)) == scan(rects, (x - 5, y - 5, 11, 11))
+
+def test_rebuilt_index():
+    rnd = random.Random(1)
+    index = GridIndex()
+    for key in range(50):
+        index.insert(key, randomRect(rnd, 200))
+    index.clear()
+    rects = dict((key, randomRect(rnd, 200)) for key in range(50, 100))
+    for key, rect in rects.items():
+        index.insert(key, rect)
+    assert sorted(index.keys()) == sorted(rects)
+    for i in range(200):
+        rect = randomRect(rnd, 500)
+        assert index.query(rect) == scan(rects, rect)
@@ -0,0 +1,104 @@
+'''
+The index of uses (see cvxUses), kept up to date as the document is edited,
+must be the same as one built afresh from the document.
+'''
+import pytest
+pytest.importorskip('wx')
+pytest.importorskip('pygraphviz')
+from lxml import etree
+from conftest import sample
+import cvxXML as bG
+from cvxXML import Xref
+import cvxJournal as journal
+from cvxJournal import Journal
+from cvxUses import Uses
+
+def touch(elem):
+    pass
+
+def describe(index):
+    """
+    Return an index as plain data: the parameters under each key, by their
+    node or graph and index
+    """
+    return dict((key, sorted((p.getparent().get('reference'), p.get('index')) for p in params))
+                for key, params in index.items() if params)
+
+def rebuilt():
+    """
+    Build the index from the document, without touching the one kept
+    """
+    params, graphParams = {}, {}
+    for param in Uses.root.iter('{*}parameter'):
+        parent = etree.QName(param.getparent()).localname
+        if parent == 'node':
+            params.setdefault(param.get('reference'), set()).add(param)
+        elif parent == 'graph':
+            graphParams.setdefault(param.get('node'), set()).add(param)
+    return describe(params), describe(graphParams)
+
+def check():
+    assert Uses.built
+    assert (describe(Uses.params), describe(Uses.graphParams)) == rebuilt()
+
+@pytest.fixture
+def loaded():
+    Journal.clear()
+    root, graphDict = bG.parseGraphs(sample('example.xml'))
+    Journal.root = root
+    Uses.build()
+    check()
+    return root, graphDict
+
+def find(root, name):
+    return root.xpath('//*[@name=$name]', name=name)[0]
+
+def edits(root, graphDict):
+    """
+    Connect, disconnect and reconnect things, one edit at a time, checking the index after each
+    """
+    graph, model = graphDict['GRAPH1']
+    node = find(root, 'node')
+    image = find(root, 'image_36')
+    def edit(change):
+        Journal.begin()
+        change()
+        check()
+    # connect an object to a free parameter of a node
+    free = max(int(p.get('index')) for p in node.iterchildren('{*}parameter')) + 1
+    edit(lambda: bG.connectDataNode(image.get('reference'), node.get('reference'), None, free))
+    assert len(Uses.nodeParameters(image.get('reference'))) >= 2
+    # make it a graph parameter, and remove that again
+    edit(lambda: bG.insertGraphParameter(graph, model, image.get('reference'), node.get('reference')))
+    gp = list(graph.iterchildren('{*}parameter'))[-1]
+    edit(lambda: journal.remove(graph, gp))
+    # reconnect a parameter to another object
+    param = Uses.nodeParameters(image.get('reference'))[0]
+    edit(lambda: journal.setAttr(param, 'reference', find(root, 'INPUT_IMG').get('reference')))
+    # disconnect
+    edit(lambda: journal.remove(param.getparent(), param))
+    # remove a whole node, then the graph
+    edit(lambda: journal.remove(graph, node))
+    edit(lambda: journal.remove(root, graph))
+    assert Uses.params == {}
+    return len(Journal.undoList)
+
+def test_edits(loaded):
+    root, graphDict = loaded
+    original = rebuilt()
+    count = edits(root, graphDict)
+    for i in range(count):
+        assert Journal.undo(touch)
+        check()
+    assert rebuilt() == original
+    for i in range(count):
+        assert Journal.redo(touch)
+        check()
+
+def test_document_order(loaded):
+    root, graphDict = loaded
+    # every query gives its elements in the order they are in the document
+    order = dict((id(p), i) for i, p in enumerate(root.iter('{*}parameter')))
+    for ref in list(Uses.params):
+        params = Uses.nodeParameters(ref)
+        assert [order[id(p)] for p in params] == sorted(order[id(p)] for p in params)
@@ -0,0 +1,66 @@
+'''
+A view of a graph (see projectGraph in cvxXML) must draw what processVirtuals()
+and removeImmutables() made of the model graphs before there were views.
+'''
+import pytest
+pytest.importorskip('wx')
+pgv = pytest.importorskip('pygraphviz')
+from conftest import sample
+import cvxXML as bG
+from cvxXML import Xref
+from cvxPreferences import updateObj
+
+def baseline(graph):
+    """
+    Return what processVirtuals() and removeImmutables() left of a copy of the model graph.
+    processVirtuals() was never called for the globals graph.
+    """
+    graph = pgv.AGraph(graph.string())
+    for n in graph.nodes():
+        xobj = Xref.get(n)
+        if xobj.tag in bG.dataObjectTags:
+            if xobj.isImmutable():
+                graph.remove_node(n)
+            elif graph.name == bG.sroot:
+                pass
+            elif xobj.isVirtual() and not bG.showVirtuals and not (xobj.isParent() or xobj.isChild()):
+                ins = graph.in_edges(n)
+                outs = graph.out_edges(n)
+                if len(ins) and len(outs):
+                    for out in outs:
+                        graph.add_edge(ins[0][0], out[1], taillabel=ins[0].attr['taillabel'],
+                            headlabel=out.attr['headlabel'], arrowhead=ins[0].attr['arrowhead'],
+                            font=ins[0].attr['font'], fontcolor=ins[0].attr['fontcolor'],
+                            fontsize=ins[0].attr['fontsize'])
+                    graph.remove_node(n)
+                else:
+                    updateObj(graph.get_node(n), Xref)
+            else:
+                updateObj(graph.get_node(n), Xref)
+    return graph
+
+def drawn(graph):
+    nodes = dict((str(n), dict(n.attr)) for n in graph.nodes_iter())
+    edges = sorted((str(e[0]), str(e[1]), sorted(dict(e.attr).items())) for e in graph.edges_iter())
+    return nodes, edges, dict(graph.graph_attr)
+
+@pytest.fixture(params=[False, True], ids=['virtuals hidden', 'virtuals shown'])
+def show(request, monkeypatch):
+    monkeypatch.setattr(bG, 'showVirtuals', request.param)
+    return request.param
+
+@pytest.mark.parametrize('name', ['example.xml', 'googlenet.xml'])
+def test_view_is_baseline(name, show):
+    root, graphDict = bG.parseGraphs(sample(name))
+    assert bG.globalsName in graphDict
+    for graphName, (elem, graph) in graphDict.items():
+        assert drawn(bG.viewOf(graph)) == drawn(baseline(graph)), graphName
+
+def test_globals_keep_their_style(show):
+    root, graphDict = bG.parseGraphs(sample('example.xml'))
+    graph = graphDict[bG.globalsName][1]
+    view = bG.viewOf(graph)
+    children = [n for n in graph.nodes_iter() if Xref.get(n).isChild() and not Xref.get(n).isImmutable()]
+    assert children
+    for n in children:
+        assert view.get_node(n).attr['color'] == graph.get_node(n).attr['color']
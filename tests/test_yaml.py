@@ -0,0 +1,59 @@
+'''
+A document saved as YAML (see cvxYAML) must read back as the same tree: saved
+again as xml it must be the same bytes, and give the same graphs.
+'''
+import pytest
+pytest.importorskip('wx')
+pytest.importorskip('yaml')
+from lxml import etree
+from conftest import sample
+import cvxXML as bG
+from cvxXML import writeTree
+from cvxYAML import readYAML, writeYAML
+
+def roundTrip(root, tmp_path):
+    """
+    Return the bytes of root saved as xml, and of root saved as YAML, read back
+    and saved as xml
+    """
+    writeTree(root, str(tmp_path / 'a.xml'))
+    writeYAML(root, str(tmp_path / 'a.yaml'))
+    writeTree(readYAML(str(tmp_path / 'a.yaml')), str(tmp_path / 'b.xml'))
+    return (tmp_path / 'a.xml').read_bytes(), (tmp_path / 'b.xml').read_bytes()
+
+@pytest.mark.parametrize('name', ['example.xml', 'googlenet.xml'])
+def test_same_bytes(name, tmp_path):
+    xml, copy = roundTrip(etree.parse(sample(name)).getroot(), tmp_path)
+    assert copy == xml
+
+@pytest.mark.parametrize('name', ['example.xml', 'googlenet.xml'])
+def test_smaller(name, tmp_path):
+    root = etree.parse(sample(name)).getroot()
+    writeTree(root, str(tmp_path / 'a.xml'))
+    writeYAML(root, str(tmp_path / 'a.yaml'))
+    assert (tmp_path / 'a.yaml').stat().st_size < (tmp_path / 'a.xml').stat().st_size
+
+def test_irregular(tmp_path):
+    """
+    Text, white space, comments and values that YAML would read as something else
+    """
+    root = etree.fromstring(
+        '<openvx xmlns="https://www.khronos.org/registry/vx/schema" references="3">\n'
+        '  <!-- a comment -->  <?pi some text?>\n'
+        '  <array name="null" capacity="">  <uint8>1 2  3 </uint8><uint8>~</uint8><uint8></uint8><uint8/>\n'
+        '  </array>mixed <b>text</b> tail\n'
+        '  <lut><uint8 index="0">- 1</uint8><uint8 index="1">a: b</uint8><uint8 index="2"/><uint8 index="3">true</uint8></lut>'
+        '</openvx>')
+    xml, copy = roundTrip(root, tmp_path)
+    assert copy == xml
+
+def graphs(root):
+    graphDict = bG.buildGraphs(root)
+    return sorted(bG.elementNames), dict((name, graph.string()) for name, (elem, graph) in graphDict.items())
+
+@pytest.mark.parametrize('name', ['example.xml', 'googlenet.xml'])
+def test_same_graphs(name, tmp_path):
+    pytest.importorskip('pygraphviz')
+    root = etree.parse(sample(name)).getroot()
+    writeYAML(root, str(tmp_path / 'a.yaml'))
+    assert graphs(readYAML(str(tmp_path / 'a.yaml'))) == graphs(root)